@@ -0,0 +1,257 @@
+import argparse, collections, concurrent.futures, contextlib, copy, fractions
+import io, itertools, json, os, pickle, sys
+import cache, evaluator, inverter, shared, datatypes
+
+#
+# Runs one program over many sets of main vars, in a pool of worker
+# processes. The program is parsed (and resolved) once, here, and each
+# worker is sent a pickled copy when it starts; after that only the main
+# vars go back and forth.
+#
+
+# What running main on one set of main vars gave: the set's position in
+# the input, the final main vars (None if there was an error), anything
+# printed along the way (var-condition warnings) and the error message.
+Result = collections.namedtuple(
+    "Result", ["index", "main_vars", "printed", "error"])
+
+def to_json(value):
+    """
+    Converts an Arrow value into something the json module can write.
+    Integers become numbers; other Nums become "top/bottom" strings.
+    """
+
+    if isinstance(value, datatypes.Num):
+        if value.bottom == 1:
+            return value.top * value.sign
+        return "{}/{}".format(value.top * value.sign, value.bottom)
+    elif isinstance(value, datatypes.String):
+        return value.str
+    elif isinstance(value, (datatypes.List, datatypes.Deque, datatypes.Bitset)):
+        return [to_json(entry) for entry in value]
+    elif isinstance(value, datatypes.Map):
+        # (The json module writes number keys as strings.)
+        return {
+            to_json(key): to_json(entry)
+            for key, entry in value.contents.items()
+            }
+    elif isinstance(value, datatypes.Boolean):
+        return bool(value)
+    return repr(value)
+
+def from_json(value, default=None):
+    """
+    Converts a value read by the json module (or any int, Fraction, str,
+    list or dict) into an Arrow value, the other way around from to_json.
+    Strings become Nums where the main var's default value is one.
+    """
+
+    if isinstance(value, (datatypes.Num, datatypes.String)):
+        return value
+    elif isinstance(value, dict) and isinstance(default, datatypes.Map):
+        # JSON keys are always strings: those which read as numbers become
+        # Nums. Values are converted like the default's first value.
+        entry_default = next(iter(default.contents.values()), None)
+
+        entries = []
+        for key, entry in value.items():
+            try:
+                entries.append(from_json(key, datatypes.Num(0)))
+            except ValueError:
+                entries.append(datatypes.String(key))
+            entries.append(from_json(entry, entry_default))
+        return datatypes.Map(entries)
+    elif isinstance(value, list):
+        # A list becomes a Deque or Bitset where the default is one.
+        # Entries are converted like the default's first entry.
+        if isinstance(default, (datatypes.Deque, datatypes.Bitset)):
+            datatype = type(default)
+        else:
+            datatype = datatypes.List
+        if isinstance(default, (datatypes.List, datatypes.Deque,
+            datatypes.Bitset)) and len(default):
+            default = next(iter(default))
+        return datatype([from_json(entry, default) for entry in value])
+    elif isinstance(value, str) and not isinstance(default, datatypes.Num):
+        return datatypes.String(value)
+    elif isinstance(value, (int, str, fractions.Fraction)):
+        number = fractions.Fraction(value)
+        return datatypes.Num(number.numerator, number.denominator)
+
+    raise ValueError("{!r} can't be an Arrow value.".format(value))
+
+# Each worker's copy of the program.
+program = None
+
+def start_worker(pickled, engine, memo_size, backwards):
+    global program
+
+    shared.engine = engine
+    shared.memo_size = memo_size
+    shared.program = program = pickle.loads(pickled)
+
+    if backwards:
+        program.main.block = inverter.unblock(program.main.block)
+
+def run_chunk(chunk):
+    """
+    Runs main on each (index, main var overrides) pair in chunk, starting
+    from a fresh copy of the program's own main vars each time. Overrides
+    which couldn't be read (see read_overrides) are reported as errors.
+    Returns a list of Results.
+    """
+
+    defaults = program.main_vars
+    results = []
+
+    for index, overrides in chunk:
+        if isinstance(overrides, ValueError):
+            results.append(Result(index, None, "", str(overrides)))
+            continue
+
+        main_vars = copy.deepcopy(defaults)
+        main_vars.update(overrides)
+        printed = io.StringIO()
+
+        try:
+            with contextlib.redirect_stdout(printed):
+                program.main_vars = main_vars
+                main_vars.update(evaluator.program_eval(program).refs)
+            results.append(Result(index, main_vars, printed.getvalue(), None))
+        except shared.ArrowException as e:
+            # Anything else is a bug in the interpreter, and isn't hidden
+            # in the results.
+            results.append(Result(index, None, printed.getvalue(), e.message))
+        finally:
+            program.main_vars = defaults
+
+    return results
+
+def evaluate_many(program, overrides, workers=None, ordered=True,
+    in_flight=None, chunksize=16, backwards=False):
+    """
+    Runs the program's main (backwards, if backwards is set) once for each
+    dict of main var overrides, across a pool of workers processes (by
+    default, one per core). Main vars missing from an override keep the
+    program's values.
+
+    Yields a Result for each override as they finish, in the order the
+    overrides came in if ordered is set. Overrides are sent to the
+    workers chunksize at a time, and at most in_flight chunks (by default,
+    two per worker) are out at once, so overrides are only read from the
+    iterable as fast as the workers get through them.
+    """
+
+    workers = workers or os.cpu_count()
+    in_flight = in_flight or 2 * workers
+
+    pickled = pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+    numbered = enumerate(overrides)
+    chunks = iter(lambda: list(itertools.islice(numbered, chunksize)), [])
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=start_worker,
+        initargs=(pickled, shared.engine, shared.memo_size, backwards)) as pool:
+
+        if ordered:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(run_chunk, chunk))
+                if len(pending) >= in_flight:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+        else:
+            pending = set()
+            for chunk in chunks:
+                pending.add(pool.submit(run_chunk, chunk))
+                if len(pending) >= in_flight:
+                    done, pending = concurrent.futures.wait(pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+
+            for future in concurrent.futures.as_completed(pending):
+                yield from future.result()
+
+def read_overrides(lines, defaults):
+    """
+    Yields a dict of main var overrides for each line of JSON objects, or
+    a ValueError naming the line if one can't be read (which run_chunk
+    reports as that line's error).
+    """
+
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            overrides = json.loads(line)
+            if not isinstance(overrides, dict):
+                raise ValueError("expected an object of main vars")
+
+            for name in overrides:
+                if name not in defaults:
+                    raise ValueError("main has no var '{}'".format(name))
+
+            overrides = {
+                name: from_json(value, defaults[name])
+                for name, value in overrides.items()
+                }
+        except (ValueError, TypeError) as e:
+            overrides = ValueError("line {}: {}".format(line_num, e))
+
+        yield overrides
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Run an Arrow program over many sets of main vars, "
+        "read as JSON objects one per line, and write each run's final main "
+        "vars as a line of JSON.")
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("inputs", nargs="?", default="-",
+        help="the file of main vars (by default, stdin)")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+        help="how many processes to run (by default, one per core)")
+    arg_parser.add_argument("--unordered", action="store_true",
+        help="write results as soon as they finish, rather than in order")
+    arg_parser.add_argument("--in-flight", type=int,
+        help="how many chunks of inputs may be out at once (by default, two "
+        "per worker)")
+    arg_parser.add_argument("--chunk", type=int, default=16,
+        help="how many inputs to send a worker at a time")
+    arg_parser.add_argument("--backwards", action="store_true",
+        help="run main backwards")
+    arg_parser.add_argument("--engine", choices=["tree", "closure", "vm"],
+        default="tree")
+    arg_parser.add_argument("--memo-size", type=int, default=shared.memo_size)
+    args = arg_parser.parse_args()
+
+    shared.engine = args.engine
+    shared.memo_size = args.memo_size
+
+    try:
+        program = cache.load(args.filename)
+    except shared.ArrowException as e:
+        print(e.message, file=sys.stderr)
+        exit(1)
+
+    with (sys.stdin if args.inputs == "-" else open(args.inputs)) as lines:
+        results = evaluate_many(program,
+            read_overrides(lines, program.main_vars), args.workers,
+            not args.unordered, args.in_flight, args.chunk, args.backwards)
+
+        for result in results:
+            line = {"index": result.index}
+            if result.error is None:
+                line["main_vars"] = {
+                    name: to_json(value)
+                    for name, value in result.main_vars.items()
+                    }
+            else:
+                line["error"] = result.error
+            if result.printed:
+                line["printed"] = result.printed
+
+            print(json.dumps(line))
@@ -0,0 +1,673 @@
+import argparse, contextlib, glob, io, json, os, platform, random, re, sys
+import tempfile, time, tracemalloc
+import scanner, parser, evaluator, shared, datatypes, cache, hooks, main
+
+def load(filename):
+    """
+    Scans and parses an Arrow file. Returns the program node.
+    """
+
+    return parser.ArrowParser(scanner.Scanner(filename).tokens()).program()
+
+def time_run(filename, engine, repeat):
+    """
+    Runs the program forwards `repeat` times on a freshly parsed copy each
+    time (so mutated lists don't carry over), using the given engine.
+    Returns (best time in seconds, final main vars as strings).
+    """
+
+    shared.engine = engine
+    best = None
+
+    for _ in range(repeat):
+        program = load(filename)
+
+        # Some samples print var-condition warnings; keep them out of the table.
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = evaluator.program_eval(program)
+            elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, {var: repr(value) for var, value in result.refs.items()}
+
+def peak_memory(filename, engine):
+    """
+    Runs the program forwards once with the given engine.
+    Returns the peak memory allocated while it ran, in bytes.
+    """
+
+    shared.engine = engine
+    program = load(filename)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        evaluator.program_eval(program)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return peak
+
+def compare_memory(filenames, engines):
+    """
+    Prints the peak memory of each engine on each program.
+    """
+
+    header = "{:<24}".format("program") + "".join(
+        "{:>12}".format(engine + " KB") for engine in engines)
+    print(header)
+    print("-" * len(header))
+
+    for filename in filenames:
+        print("{:<24}".format(os.path.basename(filename)) + "".join(
+            "{:>12.1f}".format(peak_memory(filename, engine) / 1024)
+            for engine in engines))
+
+@contextlib.contextmanager
+def allocations():
+    """
+    Counts the syntax tree nodes created inside the with block (by the
+    inverter, for instance), and the BuiltinFunctions. (Each value used to
+    make one for every builtin method it had, whether or not the program
+    called it.) Yields a dict holding the counts.
+    """
+
+    counts = {"nodes": 0, "builtins": 0}
+    inits = {
+        "nodes": parser.ParseNode,
+        "builtins": datatypes.BuiltinFunction,
+        }
+
+    def counted(name, init):
+        def counted_init(self, *args, **kwargs):
+            counts[name] += 1
+            init(self, *args, **kwargs)
+        return counted_init
+
+    for name, cls in inits.items():
+        inits[name] = (cls, cls.__init__)
+        cls.__init__ = counted(name, cls.__init__)
+    try:
+        yield counts
+    finally:
+        for cls, init in inits.values():
+            cls.__init__ = init
+
+def allocation_run(filename, engine, round_trips):
+    """
+    Runs the program forwards once, or forwards and backwards round_trips
+    times (see main.run_batch), with the given engine. Returns the peak
+    memory allocated while it ran, in bytes, and how many of each kind of
+    object it created.
+    """
+
+    shared.engine = engine
+    program = load(filename)
+    mode = "roundtrip" if round_trips else "forward"
+
+    with contextlib.redirect_stdout(io.StringIO()), allocations() as counts:
+        tracemalloc.start()
+        main.run_batch(program, mode, round_trips)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return peak, counts
+
+def compare_allocations(filenames, engines, round_trips):
+    """
+    Prints each engine's peak memory on each program, and how many objects
+    of each kind it created.
+    """
+
+    header = "{:<24}{:<10}{:>10}{:>10}{:>10}".format(
+        "program", "engine", "peak KB", "nodes", "builtins")
+    print(header)
+    print("-" * len(header))
+
+    for filename in filenames:
+        for engine in engines:
+            peak, counts = allocation_run(filename, engine, round_trips)
+            print("{:<24}{:<10}{:>10.1f}{:>10}{:>10}".format(
+                os.path.basename(filename), engine, peak / 1024,
+                counts["nodes"], counts["builtins"]))
+
+def compare_engines(filenames, engines, repeat):
+    """
+    Prints the best time of each engine on each program, along with the
+    other engines' speedup over the first. Flags programs where the engines
+    disagree.
+    """
+
+    header = "{:<24}".format("program") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines) + "".join(
+        "{:>10}".format(engine + " x") for engine in engines[1:])
+    print(header)
+    print("-" * len(header))
+
+    for filename in filenames:
+        times, states = [], []
+        for engine in engines:
+            elapsed, state = time_run(filename, engine, repeat)
+            times.append(elapsed)
+            states.append(state)
+
+        line = "{:<24}".format(os.path.basename(filename))
+        line += "".join("{:>12.3f}".format(t * 1000) for t in times)
+        line += "".join("{:>10.2f}".format(times[0] / t) for t in times[1:])
+
+        if any(state != states[0] for state in states):
+            line += "  MISMATCH"
+
+        print(line)
+
+def synthetic_program(functions):
+    """
+    Returns the source of a large Arrow program with the given number of
+    functions, each exercising most kinds of statement and expression.
+    """
+
+    lines = []
+    for i in range(functions):
+        lines += [
+            "f{}(ref x, ref a, const y){{".format(i),
+            "    x += y * 2 - (y + 1) / 3",
+            "    a[1] <=> a[2]",
+            "    if x > 3 {",
+            "        x -= 1",
+            "    } => x > 2",
+            "    for j := 0, j += 1 {",
+            "        a[0] += j % 2",
+            "    } until j == 3",
+            "    do/undo {",
+            "        t := x",
+            "    } yielding {",
+            "        a[3] += t",
+            "    }",
+            "}",
+            ]
+
+    lines.append("main(x := 0, a := [0, 0, 0, 0]){")
+    lines += ["    f{}(&x, &a, {})".format(i, i) for i in range(functions)]
+    lines.append("}")
+    return "\n".join(lines)
+
+def parse_memory(functions):
+    """
+    Parses a synthetic program (see synthetic_program) and prints how long
+    that took and how much memory the parsed program holds on to.
+    """
+
+    with tempfile.NamedTemporaryFile("w", suffix=".arrow", delete=False) as f:
+        f.write(synthetic_program(functions))
+
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        program = load(f.name)
+        elapsed = time.perf_counter() - start
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        os.remove(f.name)
+
+    print("{} functions: parsed in {:.3f} s, {:.1f} KB held, {:.1f} KB peak".format(
+        functions, elapsed, held / 1024, peak / 1024))
+
+def recursive_program(depth, repeat):
+    """
+    Returns the source of an Arrow program which recurses `depth` calls
+    deep, `repeat` times over, counting every call in main's 'calls'.
+    """
+
+    return "\n".join([
+        "down(ref calls, const depth){",
+        "    calls += 1",
+        "    if depth > 0 {",
+        "        down(&calls, depth - 1)",
+        "    } => depth > 0",
+        "}",
+        "main(calls := 0){",
+        "    for i := 0 {",
+        "        down(&calls, {})".format(depth - 1),
+        "    }} i += 1, until i == {}".format(repeat),
+        "}",
+        ])
+
+def call_rate(depth, engines, calls=100000):
+    """
+    Prints how many Arrow function calls per second each engine makes,
+    recursing `depth` calls deep.
+    """
+
+    # The tree-walker uses several Python frames per Arrow call.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), depth * 20 + 1000))
+
+    with tempfile.NamedTemporaryFile("w", suffix=".arrow", delete=False) as f:
+        f.write(recursive_program(depth, max(1, calls // depth)))
+
+    try:
+        print("{:<10}{:>12}{:>14}".format("engine", "calls", "calls/sec"))
+        for engine in engines:
+            elapsed, state = time_run(f.name, engine, 3)
+            made = int(state["calls"])
+            print("{:<10}{:>12}{:>14.0f}".format(engine, made, made / elapsed))
+    finally:
+        os.remove(f.name)
+
+def deep_recursion(depths, engines):
+    """
+    Prints how long each engine takes to recurse to each depth once, at
+    Python's default recursion limit, or where it runs out of stack.
+    """
+
+    print("{:<10}".format("depth") + "".join(
+        "{:>16}".format(engine + " ms") for engine in engines))
+
+    for depth in depths:
+        with tempfile.NamedTemporaryFile("w", suffix=".arrow", delete=False) as f:
+            f.write(recursive_program(depth, 1))
+
+        line = "{:<10}".format(depth)
+        try:
+            for engine in engines:
+                try:
+                    elapsed, _ = time_run(f.name, engine, 1)
+                    line += "{:>16.1f}".format(elapsed * 1000)
+                except RecursionError:
+                    line += "{:>16}".format("RecursionError")
+        finally:
+            os.remove(f.name)
+
+        print(line)
+
+def memo_speedup(n, engines):
+    """
+    Prints how long fibonacci_rec.arrow takes on input n with and without
+    memoizing fib, and how often the memo was hit.
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, "sample_programs", "fibonacci_rec.arrow")) as f:
+        source = re.sub(r"input := \d+", "input := {}".format(n), f.read())
+
+    with tempfile.NamedTemporaryFile("w", suffix=".arrow", delete=False) as f:
+        f.write(source)
+
+    memo_size = shared.memo_size
+    print("{:<10}{:>10}{:>12}{:>10}{:>10}".format(
+        "engine", "memo", "ms", "hits", "misses"))
+
+    try:
+        for engine in engines:
+            shared.engine = engine
+            for size in (0, memo_size):
+                shared.memo_size = size
+                program = load(f.name)
+
+                start = time.perf_counter()
+                evaluator.program_eval(program)
+                elapsed = time.perf_counter() - start
+
+                memo = program.functions["fib"].memo
+                print("{:<10}{:>10}{:>12.3f}{:>10}{:>10}".format(
+                    engine, size, elapsed * 1000,
+                    memo.hits if memo else "-", memo.misses if memo else "-"))
+    finally:
+        shared.memo_size = memo_size
+        os.remove(f.name)
+
+def scan_speed(functions):
+    """
+    Scans a synthetic program (see synthetic_program) and prints how long
+    that took.
+    """
+
+    source = synthetic_program(functions)
+
+    start = time.perf_counter()
+    count = sum(1 for _ in scanner.Scanner(source=source).tokens())
+    elapsed = time.perf_counter() - start
+
+    print("{:.1f} MB, {} tokens: scanned in {:.3f} s ({:.1f} MB/s)".format(
+        len(source) / 1e6, count, elapsed, len(source) / 1e6 / elapsed))
+
+def startup(filenames, repeat):
+    """
+    Prints how long loading each program takes with an empty cache (cold)
+    and with an up-to-date one (warm).
+    """
+
+    print("{:<24}{:>12}{:>12}{:>10}".format("program", "cold ms", "warm ms", "x"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache.cache_dir = directory
+
+        for filename in filenames:
+            cold = warm = None
+            for _ in range(repeat):
+                for entry in os.listdir(directory):
+                    os.remove(os.path.join(directory, entry))
+
+                start = time.perf_counter()
+                cache.load(filename)
+                elapsed = time.perf_counter() - start
+                cold = elapsed if cold is None else min(cold, elapsed)
+
+                start = time.perf_counter()
+                cache.load(filename)
+                elapsed = time.perf_counter() - start
+                warm = elapsed if warm is None else min(warm, elapsed)
+
+            print("{:<24}{:>12.3f}{:>12.3f}{:>10.1f}".format(
+                os.path.basename(filename), cold * 1000, warm * 1000, cold / warm))
+
+        cache.cache_dir = None
+
+def hook_overhead(filenames, repeat):
+    """
+    Prints the tree-walker's best time on each program before any hook is
+    registered, after a hook has been registered and removed again (which
+    should be the same), and with do-nothing hooks registered.
+    """
+
+    def nothing(*args):
+        pass
+
+    print("{:<24}{:>12}{:>12}{:>12}{:>10}".format(
+        "program", "plain ms", "removed ms", "hooked ms", "hooked x"))
+
+    for filename in filenames:
+        plain, _ = time_run(filename, "tree", repeat)
+
+        hooks.on_statement(nothing)
+        hooks.remove(nothing)
+        removed, _ = time_run(filename, "tree", repeat)
+
+        hooks.on_statement(nothing)
+        hooks.on_call(nothing)
+        hooks.on_return(nothing)
+        hooked, _ = time_run(filename, "tree", repeat)
+        hooks.clear()
+
+        print("{:<24}{:>12.3f}{:>12.3f}{:>12.3f}{:>10.2f}".format(
+            os.path.basename(filename), plain * 1000, removed * 1000,
+            hooked * 1000, hooked / plain))
+
+@contextlib.contextmanager
+def counting():
+    """
+    Counts the statements the tree-walker executes and the function calls
+    made (builtin methods included) inside the with block. Yields a dict
+    holding the counts.
+    """
+
+    counts = {"statements": 0, "calls": 0}
+    statement_eval, call = evaluator.statement_eval, datatypes.Function.call
+
+    def counted_statement_eval(node, table):
+        counts["statements"] += 1
+        return statement_eval(node, table)
+
+    def counted_call(self, *args):
+        counts["calls"] += 1
+        return call(self, *args)
+
+    evaluator.statement_eval = counted_statement_eval
+    datatypes.Function.call = counted_call
+    try:
+        yield counts
+    finally:
+        evaluator.statement_eval = statement_eval
+        datatypes.Function.call = call
+
+def count_run(filename):
+    """
+    Runs the program forwards once on the tree-walker.
+    Returns how many statements it executed and functions it called.
+    """
+
+    shared.engine = "tree"
+    program = load(filename)
+
+    with contextlib.redirect_stdout(io.StringIO()), counting() as counts:
+        evaluator.program_eval(program)
+
+    return counts
+
+def random_array(n):
+    # Seeded, so every run sorts the same array.
+    rng = random.Random(n)
+    return "[{}]".format(", ".join(str(rng.randrange(n)) for _ in range(n)))
+
+def runs(n):
+    # Runs of 1 to 9 letters (compress.arrow writes each run's length as
+    # one digit), no two alike in a row.
+    rng = random.Random(n)
+    chars, last = [], None
+    while len(chars) < n:
+        char = rng.choice([c for c in "abc" if c != last])
+        chars += char * rng.randint(1, 9)
+        last = char
+    return "".join(chars[:n])
+
+# Scaled-up versions of some of the samples. For each sample, the sizes to
+# run it at by default, and how to rewrite its source for a size.
+variants = {
+    "sort.arrow": ([100, 300], lambda source, n: re.sub(
+        r"A := \[[^\]]*\]", "A := " + random_array(n), source)),
+    "primes.arrow": ([1000, 10000], lambda source, n: re.sub(
+        r"n := \d+", "n := {}".format(n), source)),
+    "fibonacci.arrow": ([1000, 10000], lambda source, n: re.sub(
+        r"\b10\b", str(n), source)),
+    "compress.arrow": ([1000, 10000], lambda source, n: re.sub(
+        r'data := "\w*"', 'data := "{}"'.format(runs(n)), source)),
+    }
+
+def write_variants(filenames, sizes, directory):
+    """
+    Writes the scaled-up variants (see variants) of those programs which
+    have them into directory, at the given sizes (by default, each
+    variant's own). Returns a list of (name, filename) pairs.
+    """
+
+    written = []
+    for filename in filenames:
+        base = os.path.basename(filename)
+        if base not in variants:
+            continue
+
+        default_sizes, rewrite = variants[base]
+        with open(filename) as f:
+            source = f.read()
+
+        for n in sizes.get(base, default_sizes):
+            variant = os.path.join(directory, "{}-{}.arrow".format(base[:-6], n))
+            with open(variant, "w") as f:
+                f.write(rewrite(source, n))
+            written.append(("{}[{}]".format(base, n), variant))
+
+    return written
+
+def run_suite(filenames, engines, repeat, sizes):
+    """
+    Runs every program, and its scaled-up variants, on every engine.
+    Returns the results, ready to be saved as a baseline: for each program,
+    the statements executed and functions called, and each engine's best
+    time and peak memory.
+    """
+
+    # Scaled-up programs recurse deeper on the tree-walker.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    results = {
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "programs": {},
+        }
+
+    with tempfile.TemporaryDirectory() as directory:
+        programs = [(os.path.basename(f), f) for f in filenames]
+        programs += write_variants(filenames, sizes, directory)
+
+        for name, filename in programs:
+            entry = dict(count_run(filename), engines={})
+            for engine in engines:
+                elapsed, _ = time_run(filename, engine, repeat)
+                entry["engines"][engine] = {
+                    "ms": elapsed * 1000,
+                    "peak_kb": peak_memory(filename, engine) / 1024,
+                    }
+
+            results["programs"][name] = entry
+            print("{:<28}{:>12} statements{:>10} calls".format(
+                name, entry["statements"], entry["calls"]), file=sys.stderr)
+
+    return results
+
+def print_results(results):
+    """
+    Prints a suite's results as a table.
+    """
+
+    print("{:<28}{:<10}{:>12}{:>12}{:>14}{:>10}".format(
+        "program", "engine", "ms", "peak KB", "statements", "calls"))
+
+    for name, entry in results["programs"].items():
+        for engine, measured in entry["engines"].items():
+            print("{:<28}{:<10}{:>12.3f}{:>12.1f}{:>14}{:>10}".format(
+                name, engine, measured["ms"], measured["peak_kb"],
+                entry["statements"], entry["calls"]))
+
+def compare_results(baseline, results, threshold):
+    """
+    Prints how each program's time and memory changed since the baseline,
+    flagging anything more than threshold percent worse, and any change in
+    the statements executed or functions called (which should only change
+    along with what a program computes). Returns the number flagged.
+    """
+
+    print("{:<28}{:<10}{:>12}{:>12}{:>10}{:>10}  {}".format(
+        "program", "engine", "base ms", "ms", "time %", "mem %", "flags"))
+
+    flagged = 0
+    for name, entry in results["programs"].items():
+        old = baseline["programs"].get(name)
+        if old is None:
+            continue
+
+        for engine, measured in entry["engines"].items():
+            old_measured = old["engines"].get(engine)
+            if old_measured is None:
+                continue
+
+            time_change = (measured["ms"] / old_measured["ms"] - 1) * 100
+            memory_change = (
+                measured["peak_kb"] / old_measured["peak_kb"] - 1) * 100
+
+            flags = []
+            if time_change > threshold:
+                flags.append("SLOWER")
+            if memory_change > threshold:
+                flags.append("MEMORY")
+            for count in ("statements", "calls"):
+                if entry[count] != old[count]:
+                    flags.append("{} {} -> {}".format(
+                        count.upper(), old[count], entry[count]))
+
+            flagged += bool(flags)
+            print("{:<28}{:<10}{:>12.3f}{:>12.3f}{:>+10.1f}{:>+10.1f}  {}".format(
+                name, engine, old_measured["ms"], measured["ms"],
+                time_change, memory_change, " ".join(flags)))
+
+    return flagged
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the Arrow interpreter's engines.")
+    arg_parser.add_argument("filenames", nargs="*",
+        default=sorted(glob.glob(os.path.join(here, "sample_programs", "*.arrow"))))
+    arg_parser.add_argument("--engines", nargs="+", default=["tree", "closure", "vm"])
+    arg_parser.add_argument("--repeat", type=int,
+        help="how many times to time each program (by default, 20; 5 for "
+        "--suite)")
+    arg_parser.add_argument("--memory", action="store_true",
+        help="report peak memory instead of time")
+    arg_parser.add_argument("--allocations", action="store_true",
+        help="report peak memory and the objects created, for each engine")
+    arg_parser.add_argument("--round-trips", type=int, default=0, metavar="N",
+        help="with --allocations, run main forwards and backwards N times, "
+        "rather than just forwards")
+    arg_parser.add_argument("--parse", type=int, metavar="FUNCTIONS",
+        help="parse a synthetic program with this many functions instead")
+    arg_parser.add_argument("--scan", type=int, metavar="FUNCTIONS",
+        help="scan a synthetic program with this many functions instead")
+    arg_parser.add_argument("--startup", action="store_true",
+        help="time loading the programs with a cold and a warm cache")
+    arg_parser.add_argument("--calls", type=int, metavar="DEPTH",
+        help="measure function calls per second, recursing this deep")
+    arg_parser.add_argument("--memo", type=int, metavar="N",
+        help="time fibonacci_rec.arrow on input N with and without memoization")
+    arg_parser.add_argument("--deep", type=int, nargs="+", metavar="DEPTH",
+        help="recurse to each depth once, without raising the recursion limit")
+    arg_parser.add_argument("--suite", action="store_true",
+        help="time, count and measure every program and its scaled-up "
+        "variants")
+    arg_parser.add_argument("--save", metavar="FILE",
+        help="with --suite, save the results as a JSON baseline")
+    arg_parser.add_argument("--compare", metavar="FILE",
+        help="with --suite, compare the results against a saved baseline, "
+        "and exit with status 1 if anything regressed")
+    arg_parser.add_argument("--threshold", type=float, default=10,
+        help="how many percent slower or bigger --compare lets a program get")
+    arg_parser.add_argument("--size", action="append", default=[],
+        metavar="PROGRAM=N[,N...]",
+        help="the sizes to run a program's variants at, e.g. "
+        "sort.arrow=1000,10000")
+    arg_parser.add_argument("--hooks", action="store_true",
+        help="time the tree-walker with and without execution hooks")
+    args = arg_parser.parse_args()
+
+    if args.suite:
+        sizes = {}
+        for size in args.size:
+            program, _, ns = size.partition("=")
+            sizes[program] = [int(n) for n in ns.split(",")]
+
+        results = run_suite(
+            args.filenames, args.engines, args.repeat or 5, sizes)
+
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2)
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if compare_results(baseline, results, args.threshold):
+                exit(1)
+        else:
+            print_results(results)
+    elif args.hooks:
+        hook_overhead(args.filenames, args.repeat or 20)
+    elif args.deep:
+        deep_recursion(args.deep, args.engines)
+    elif args.memo:
+        memo_speedup(args.memo, args.engines)
+    elif args.calls:
+        call_rate(args.calls, args.engines)
+    elif args.startup:
+        startup(args.filenames, args.repeat or 20)
+    elif args.scan:
+        scan_speed(args.scan)
+    elif args.parse:
+        parse_memory(args.parse)
+    elif args.allocations:
+        compare_allocations(args.filenames, args.engines, args.round_trips)
+    elif args.memory:
+        compare_memory(args.filenames, args.engines)
+    else:
+        compare_engines(args.filenames, args.engines, args.repeat or 20)
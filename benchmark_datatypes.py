@@ -0,0 +1,340 @@
+import argparse, array, math, os, time, timeit, tracemalloc
+import evaluator, shared, datatypes, cache
+from benchmark import runs
+
+#
+# Benchmarks of the datatypes on their own: Num arithmetic, and each kind
+# of array against what programs had to do without it. (benchmark.py
+# benchmarks whole programs.)
+#
+
+def arithmetic(number=100000):
+    """
+    Prints how long Num addition, multiplication and comparison take,
+    on integers and on fractions.
+    """
+
+    operands = {
+        "int": (datatypes.Num(1234567), datatypes.Num(7654321)),
+        "fraction": (datatypes.Num(1234567, 1000), datatypes.Num(-7654321, 999)),
+        }
+    operations = {
+        "add": lambda x, y: x + y,
+        "sub": lambda x, y: x - y,
+        "mul": lambda x, y: x * y,
+        "lt": lambda x, y: x < y,
+        "eq": lambda x, y: x == y,
+        }
+
+    print("{:<10}{:<6}{:>10}".format("operands", "op", "ns/op"))
+    for kind, (x, y) in operands.items():
+        for name, operation in operations.items():
+            best = min(timeit.repeat(
+                lambda: operation(x, y), number=number, repeat=5))
+            print("{:<10}{:<6}{:>10.0f}".format(kind, name, best / number * 1e9))
+
+def list_ops(n, engines):
+    """
+    Prints how much memory a List of n integers takes packed into an array
+    and as Nums, and how long adding one such List to another and checking
+    it's sorted take, with an Arrow loop and with the builtins.
+    """
+
+    def make(packed):
+        made = datatypes.List([datatypes.Num(i) for i in range(n)])
+        if not packed:
+            made.unpack()
+        return made
+
+    for packed in (True, False):
+        tracemalloc.start()
+        kept = make(packed)
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{} ints as {}: {:.1f} KB".format(
+            n, "an array" if packed else "Nums", held / 1024))
+
+    programs = {
+        "copy, loop": "for i := 0 {{ t[i] += a[i] }} i += 1, until i == {}",
+        "copy, +=": "t += a",
+        "check, loop": "for i := 0 {{ if a[i] < a[i+1] {{ c += 1 }} <=> }} "
+            "i += 1, until i == {}",
+        "check, is_sorted": "if a.is_sorted() {{ c += {} }} <=>",
+        }
+
+    print()
+    print("{:<20}{:<10}".format("operation", "backing") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines))
+
+    for label, body in programs.items():
+        source = "main(a := [], t := [], c := 0){{ {} }}".format(
+            body.format(n - 1))
+
+        for packed in (True, False):
+            line = "{:<20}{:<10}".format(label, "array" if packed else "Nums")
+            for engine in engines:
+                shared.engine = engine
+                program = cache.parse(source)
+                program.main_vars["a"] = make(packed)
+                program.main_vars["t"] = make(packed)
+
+                start = time.perf_counter()
+                evaluator.program_eval(program)
+                line += "{:>12.1f}".format((time.perf_counter() - start) * 1000)
+
+            print(line)
+
+def deque_ops(n, engines):
+    """
+    Times moving the front entry of an n-entry queue to the back, n times
+    over: with a Deque, and with a List, which has to shift every entry
+    along with an Arrow loop.
+    """
+
+    programs = {
+        "rotate, Deque": (datatypes.Deque, "x := q.peek_left() "
+            "q.push_right(x) un(: q.push_left(x) :) x == q.peek_right()"),
+        "rotate, List": (datatypes.List, "for j := 0 {{ q[j] <=> q[j+1] }} "
+            "j += 1, until j == {}"),
+        }
+
+    print("{:<16}".format("operation") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines))
+
+    for label, (datatype, body) in programs.items():
+        source = "main(q := []){{ for r := 0 {{ {} }} r += 1, " \
+            "until r == {} }}".format(body.format(n - 1), n)
+
+        line = "{:<16}".format(label)
+        for engine in engines:
+            shared.engine = engine
+            program = cache.parse(source)
+            program.main_vars["q"] = datatype(
+                [datatypes.Num(i) for i in range(n)])
+
+            start = time.perf_counter()
+            evaluator.program_eval(program)
+            line += "{:>12.1f}".format((time.perf_counter() - start) * 1000)
+
+        print(line)
+
+def map_ops(n, engines):
+    """
+    Times looking up each of n keys (and adding up their values): in a
+    Map, and by scanning a List of the keys for each one with an Arrow
+    loop, as programs without Maps have to.
+    """
+
+    keys = [datatypes.Num(7 * i) for i in range(n)]
+    programs = {
+        "lookup, Map": "c += m[k[i]]",
+        "lookup, scan": "for j := 0 {{ if keys[j] == k[i] {{ c += vals[j] }} "
+            "<=> }} j += 1, until j == {}",
+        }
+
+    print("{:<16}".format("operation") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines))
+
+    for label, body in programs.items():
+        source = "main(m := map[], keys := [], vals := [], k := [], c := 0)" \
+            "{{ for i := 0 {{ {} }} i += 1, until i == {} }}".format(
+                body.format(n), n)
+
+        line = "{:<16}".format(label)
+        for engine in engines:
+            shared.engine = engine
+            program = cache.parse(source)
+            program.main_vars.update(
+                m=datatypes.Map([entry for key in keys for entry in (key, key)]),
+                keys=datatypes.List(keys), vals=datatypes.List(keys),
+                k=datatypes.List(keys[::-1]))
+
+            start = time.perf_counter()
+            evaluator.program_eval(program)
+            line += "{:>12.1f}".format((time.perf_counter() - start) * 1000)
+
+        print(line)
+
+def sieve_marks(n):
+    """
+    Returns (p, first, end) for each prime p below the square root of n:
+    the marking pass of a sieve of n flags toggles every p'th flag from
+    first up to (not including) end.
+    """
+
+    marks = []
+    for p in range(2, math.isqrt(n - 1) + 1):
+        if all(p % q for q, _, _ in marks):
+            first = p * p
+            marks.append((p, first, first + p * -(-(n - first) // p)))
+    return marks
+
+def bitset_ops(n, engines):
+    """
+    Prints how much memory n flags take as a Bitset, as a List packed into
+    an array and as a List of Nums, and times a sieve's marking pass over
+    them: with Bitset.toggle on n flags, and with Arrow loops toggling one
+    flag at a time on n // 100 flags (which take about as long per flag
+    as they would on n). The programs make their Bitsets themselves, with
+    "bitset[0; n]", and that's timed too.
+    """
+
+    def make(kind, size):
+        if kind == "Bitset":
+            # What "bitset[0; size]" makes.
+            return datatypes.fill_bitset(
+                datatypes.integer(0), datatypes.integer(size))
+        made = datatypes.List(array.array("q", bytes(8 * size)))
+        if kind == "Nums":
+            made.unpack()
+        return made
+
+    for kind in ("Bitset", "array", "Nums"):
+        tracemalloc.start()
+        kept = make(kind, n)
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print("{} flags as {}: {:.1f} KB".format(n, kind, held / 1024))
+
+    small = n // 100
+    runs = [
+        ("toggle", "Bitset", n, "flags.toggle({1}, {size}, {0})"),
+        ("loop", "Bitset", small,
+            "for j := {1} {{ flags[j] ^= 1 }} j += {0}, until j == {2}"),
+        ("loop", "array", small,
+            "for j := {1} {{ flags[j] ^= 1 }} j += {0}, until j == {2}"),
+        ]
+
+    print()
+    print("{:<10}{:<10}{:>10}".format("marking", "flags", "size") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines))
+
+    for label, kind, size, statement in runs:
+        marking = " ".join(
+            statement.format(*mark, size=size) for mark in sieve_marks(size))
+        if kind == "Bitset":
+            source = "main(done := 0){{ flags := bitset[0; {}] {} }}".format(
+                size, marking)
+        else:
+            source = "main(flags := []){{ {} }}".format(marking)
+
+        line = "{:<10}{:<10}{:>10}".format(label, kind, size)
+        for engine in engines:
+            shared.engine = engine
+            program = cache.parse(source)
+            if kind != "Bitset":
+                program.main_vars["flags"] = make(kind, size)
+
+            start = time.perf_counter()
+            evaluator.program_eval(program)
+            line += "{:>12.1f}".format((time.perf_counter() - start) * 1000)
+
+        print(line)
+
+def fill_init(n, engines):
+    """
+    Times parsing and running a program which makes an n-entry scratch
+    array, changes one entry and changes it back, and deallocates the array
+    again: with the array spelled out entry by entry, and with a fill
+    initializer.
+    """
+
+    initializers = {
+        "literal": "[{}]".format(", ".join(["-1"] * n)),
+        "fill": "[-1; {}]".format(n),
+        }
+
+    print("{:<10}{:>10}".format("array", "parse ms") + "".join(
+        "{:>12}".format(engine + " ms") for engine in engines))
+
+    for label, init in initializers.items():
+        source = "main(s := 0){{ t := {0} t[1] += 1 t[1] -= 1 t == {0} }}".format(init)
+
+        start = time.perf_counter()
+        cache.parse(source)
+        line = "{:<10}{:>10.1f}".format(
+            label, (time.perf_counter() - start) * 1000)
+
+        for engine in engines:
+            shared.engine = engine
+            program = cache.parse(source)
+
+            start = time.perf_counter()
+            evaluator.program_eval(program)
+            line += "{:>12.1f}".format((time.perf_counter() - start) * 1000)
+
+        print(line)
+
+def string_scaling(sizes, engines):
+    """
+    Times compress.arrow run forwards on strings of each size (in
+    characters), on each engine. Each run's time per character should stay
+    about the same as the strings grow, since String's end operations don't
+    copy the whole string.
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, "sample_programs", "compress.arrow")) as f:
+        source = f.read()
+
+    print("{:>10}".format("chars") + "".join(
+        "{:>12}{:>14}".format(engine + " s", "us/char") for engine in engines))
+
+    for n in sizes:
+        data = runs(n)
+        line = "{:>10}".format(n)
+
+        for engine in engines:
+            shared.engine = engine
+            program = cache.parse(source)
+            program.main_vars["data"] = datatypes.String(data)
+
+            start = time.perf_counter()
+            evaluator.program_eval(program)
+            elapsed = time.perf_counter() - start
+            line += "{:>12.2f}{:>14.1f}".format(elapsed, elapsed / n * 1e6)
+
+        print(line)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the Arrow interpreter's datatypes.")
+    arg_parser.add_argument("--engines", nargs="+", default=["tree", "closure", "vm"])
+    arg_parser.add_argument("--arithmetic", action="store_true",
+        help="time Num arithmetic")
+    arg_parser.add_argument("--lists", type=int, metavar="N",
+        help="compare List operations with and without the bulk builtins, "
+        "on N integers")
+    arg_parser.add_argument("--deques", type=int, metavar="N",
+        help="compare rotating an N-entry queue held in a Deque and in a List")
+    arg_parser.add_argument("--maps", type=int, metavar="N",
+        help="compare looking up N keys in a Map and by scanning a List")
+    arg_parser.add_argument("--bitsets", type=int, metavar="N",
+        help="compare N flags held in a Bitset and in Lists, in memory and "
+        "in a sieve's marking pass")
+    arg_parser.add_argument("--fill", type=int, metavar="N",
+        help="compare an N-entry array spelled out and made by a fill "
+        "initializer")
+    arg_parser.add_argument("--strings", type=int, nargs="*", metavar="N",
+        help="time compress.arrow on strings of N characters (by default, "
+        "1 KB up to 10 MB, which takes several minutes per engine)")
+    args = arg_parser.parse_args()
+
+    if args.deques:
+        deque_ops(args.deques, args.engines)
+    elif args.maps:
+        map_ops(args.maps, args.engines)
+    elif args.bitsets:
+        bitset_ops(args.bitsets, args.engines)
+    elif args.fill:
+        fill_init(args.fill, args.engines)
+    elif args.strings is not None:
+        string_scaling(args.strings or [10 ** k for k in range(3, 8)],
+            args.engines)
+    elif args.lists:
+        list_ops(args.lists, args.engines)
+    elif args.arithmetic:
+        arithmetic()
+    else:
+        arg_parser.print_help()
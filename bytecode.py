@@ -0,0 +1,409 @@
+import array
+import datatypes, evaluator, inverter
+
+#
+# Opcodes. Every instruction is two words long: the opcode and its argument
+# (zero when the instruction doesn't take one).
+#
+
+LOAD_CONST = 0      # push consts[arg]
+LOAD_VAR = 1        # push values[arg]
+STORE_VAR = 2       # values[arg] = pop()
+LOAD_INDEX = 3      # index = pop(), array = pop(); push array[index]
+STORE_INDEX = 4     # value, index, array = pop() x3; array[index] = value
+BIN_OP = 5          # right = pop(), left = pop(); push left <bin_op_names[arg]> right
+NEGATE = 6          # push -pop()
+BUILD_LIST = 7      # pop arg values and push them as a List
+MOD_VAR = 8         # slot, op = divmod(arg, 16); values[slot] <op>= pop()
+MOD_INDEX = 9       # index, array, value = pop() x3; array[index] <op>= value
+SWAP_INDEX = 10     # j, R, i, L = pop() x4; L[i], R[j] = R[j], L[i]
+ROT_TWO = 11        # swap the two topmost values
+DUP_TWO = 12        # duplicate the two topmost values
+POP_TOP = 13        # discard the topmost value
+CALL = 14           # call calls[arg], popping its arguments and pushing its result
+DEALLOC = 15        # check values[arg] == pop() and delete the variable
+JUMP = 16           # jump to arg
+JUMP_IF_FALSE = 17  # jump to arg if not pop()
+JUMP_IF_TRUE = 18   # jump to arg if pop()
+RETURN = 19         # return from this code object (every one ends with one)
+LOAD_STRING = 20    # push a copy of the String consts[arg]
+BUILD_TYPED = 21    # pop arg values, then a datatype, and push datatype(values)
+BUILD_FILL = 22     # count, value, fill = pop() x3; push fill(value, count)
+BUILD_RANGE = 23    # stop = pop(), start = pop(); push a List of start...stop - 1
+DECLARE_VAR = 24    # values[arg] = pop(), copying a String (see datatypes.unshared)
+
+opnames = {
+    value: name for name, value in list(globals().items())
+    if name.isupper()
+    }
+
+# BIN_OP and the MOD_ instructions refer to operators by their position here.
+bin_op_names = [
+    "+", "-", "*", "/", "%", ">", "<", ">=", "<=", "!=", "==",
+    "and", "or", "not", "^"
+    ]
+
+class Code:
+    """
+    A compiled stream of instructions, along with the pools its
+    instructions' arguments point into. Variables are referred to by their
+    slots in the function's scope (see evaluator.Scope).
+    """
+
+    def __init__(self, name, scope):
+        self.name = name
+        self.scope = scope
+        self.ops = array.array("l")
+        self.consts = []
+
+        # Each call site is a tuple of
+        #   (function name, method attributes, slot of the method's variable,
+        #    backwards, slots of the ref args, number of const args).
+        self.calls = []
+
+        # The position just after each enter statement, by node.
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def emit(self, op, arg=0):
+        """
+        Appends an instruction. Returns its position, for later patching.
+        """
+
+        position = len(self.ops)
+        self.ops.append(op)
+        self.ops.append(arg)
+        return position
+
+    def patch(self, position, target):
+        """
+        Points the jump at `position` to `target`.
+        """
+
+        self.ops[position + 1] = target
+
+    def add_const(self, value):
+        # Nums are immutable, so equal ones can share a pool entry. Strings
+        # are only ever pushed as copies (see LOAD_STRING), so each literal
+        # simply gets its own.
+        if isinstance(value, datatypes.Num):
+            for i, existing in enumerate(self.consts):
+                if isinstance(existing, datatypes.Num) and existing == value:
+                    return i
+
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+# Compiled code, keyed by the block node it was compiled from, and
+# (forward, inverse) pairs keyed by the function body they came from.
+compiled_blocks = {}
+compiled_functions = {}
+
+def compile_expr(node, code):
+    """
+    Emits the instructions for an expression node, which leave the
+    expression's value on top of the stack.
+    """
+
+    if node.kind == "BIN_OP":
+        compile_expr(node.left, code)
+        compile_expr(node.right, code)
+        code.emit(BIN_OP, bin_op_names.index(node.op))
+
+    elif node.kind == "NEGATE":
+        compile_expr(node.expr, code)
+        code.emit(NEGATE)
+
+    elif node.kind == "NUM":
+        code.emit(LOAD_CONST, code.add_const(node.number))
+
+    elif node.kind == "STRING":
+        code.emit(LOAD_STRING, code.add_const(node.string))
+
+    elif node.kind == "VAR_REF":
+        code.emit(LOAD_VAR, node.slot)
+
+    elif node.kind == "ARRAY_REF":
+        code.emit(LOAD_VAR, node.slot)
+        compile_expr(node.expr, code)
+        code.emit(LOAD_INDEX)
+
+    elif node.kind == "FUNCTION_CALL":
+        compile_call(node, code)
+
+    elif node.kind == "ARRAY_EXPR":
+        if node.datatype is datatypes.List:
+            for entry in node.entries:
+                compile_expr(entry, code)
+            code.emit(BUILD_LIST, len(node.entries))
+        else:
+            code.emit(LOAD_CONST, code.add_const(node.datatype))
+            for entry in node.entries:
+                compile_expr(entry, code)
+            code.emit(BUILD_TYPED, len(node.entries))
+
+    elif node.kind == "ARRAY_FILL":
+        code.emit(LOAD_CONST, code.add_const(node.fill))
+        compile_expr(node.value, code)
+        compile_expr(node.count, code)
+        code.emit(BUILD_FILL)
+
+    elif node.kind == "ARRAY_RANGE":
+        compile_expr(node.start, code)
+        compile_expr(node.stop, code)
+        code.emit(BUILD_RANGE)
+
+def compile_call(node, code):
+    """
+    Emits the instructions for a function call, which leave the call's
+    result on top of the stack.
+    """
+
+    # The ref args are read (and written back) by the call instruction.
+    for arg in node.const_args:
+        compile_expr(arg, code)
+
+    code.calls.append((
+        node.name, node.attrs, node.slot, node.backwards,
+        node.ref_slots, len(node.const_args)
+        ))
+    code.emit(CALL, len(code.calls) - 1)
+
+def compile_mod_op(node, code):
+    # The expression is evaluated before the variable is read,
+    # just like in evaluator.mod_op_eval.
+    op = bin_op_names.index(node.op)
+    compile_expr(node.expr, code)
+
+    if node.var.kind == "ARRAY_REF":
+        code.emit(LOAD_VAR, node.var.slot)
+        compile_expr(node.var.expr, code)
+        code.emit(MOD_INDEX, op)
+    else:
+        code.emit(MOD_VAR, node.var.slot * 16 + op)
+
+def compile_swap_op(node, code):
+    left, right = node.left, node.right
+
+    if left.kind == "VAR_REF" and right.kind == "VAR_REF":
+        code.emit(LOAD_VAR, right.slot)
+        code.emit(LOAD_VAR, left.slot)
+        code.emit(STORE_VAR, right.slot)
+        code.emit(STORE_VAR, left.slot)
+
+    elif left.kind == "ARRAY_REF" and right.kind == "ARRAY_REF":
+        code.emit(LOAD_VAR, left.slot)
+        compile_expr(left.expr, code)
+        code.emit(LOAD_VAR, right.slot)
+        compile_expr(right.expr, code)
+        code.emit(SWAP_INDEX)
+
+    else:
+        # One array element and one plain variable.
+        array, var = (left, right) if left.kind == "ARRAY_REF" else (right, left)
+
+        # [A, i] -> [A, i, A[i], v] -> [A, i, v, A[i]]
+        code.emit(LOAD_VAR, array.slot)
+        compile_expr(array.expr, code)
+        code.emit(DUP_TWO)
+        code.emit(LOAD_INDEX)
+        code.emit(LOAD_VAR, var.slot)
+        code.emit(ROT_TWO)
+
+        # v = A[i], then A[i] = v's old value.
+        code.emit(STORE_VAR, var.slot)
+        code.emit(STORE_INDEX)
+
+def compile_var_condition(node, code):
+    compile_expr(node.expr, code)
+    code.emit(DEALLOC, node.slot)
+
+def compile_statement(node, code):
+    """
+    Emits the instructions for a statement node, which leave the
+    stack as they found it.
+    """
+
+    if node.kind == "MOD_OP":
+        compile_mod_op(node, code)
+
+    elif node.kind == "SWAP_OP":
+        compile_swap_op(node, code)
+
+    elif node.kind == "FROM_LOOP":
+        top = len(code)
+        compile_statements(node.block.statements, code)
+        compile_expr(node.end_condition, code)
+        code.emit(JUMP_IF_FALSE, top)
+
+    elif node.kind == "FOR_LOOP":
+        var_dec, until = node.var_declaration, node.end_condition
+
+        compile_expr(var_dec.expr, code)
+        code.emit(DECLARE_VAR, var_dec.slot)
+
+        top = len(code)
+        if not node.inc_at_end:
+            compile_mod_op(node.increment_statement, code)
+        compile_statements(node.block.statements, code)
+        if node.inc_at_end:
+            compile_mod_op(node.increment_statement, code)
+
+        code.emit(LOAD_VAR, until.slot)
+        compile_expr(until.expr, code)
+        code.emit(BIN_OP, bin_op_names.index("=="))
+        code.emit(JUMP_IF_FALSE, top)
+
+        compile_var_condition(until, code)
+
+    elif node.kind == "IF":
+        compile_expr(node.condition, code)
+        to_false = code.emit(JUMP_IF_FALSE)
+        compile_statements(node.true.statements, code)
+
+        if node.false is not None:
+            to_end = code.emit(JUMP)
+            code.patch(to_false, len(code))
+            compile_statements(node.false.statements, code)
+            code.patch(to_end, len(code))
+        else:
+            code.patch(to_false, len(code))
+
+    elif node.kind == "DO/UNDO":
+        # The undo half is inverted here, once, and emitted inline.
+        compile_statements(node.action_block.statements, code)
+        if node.yielding_block is not None:
+            compile_statements(node.yielding_block.statements, code)
+        compile_statements(inverter.unblock(node.action_block).statements, code)
+
+    elif node.kind == "RESULT":
+        compile_expr(node.expr, code)
+        code.emit(STORE_VAR, 0) # 'result' is always in slot 0.
+
+    elif node.kind == "VAR_DEC":
+        compile_expr(node.expr, code)
+        code.emit(DECLARE_VAR, node.slot)
+
+    elif node.kind == "VAR_CONDITION":
+        compile_var_condition(node, code)
+
+    elif node.kind == "BLOCK":
+        compile_statements(node.statements, code)
+
+    elif node.kind == "FUNCTION_CALL":
+        compile_call(node, code)
+        code.emit(POP_TOP)
+
+    elif node.kind == "UN":
+        compile_statement(inverter.unstatement(node.statement), code)
+
+    elif node.kind == "EXIT":
+        compile_expr(node.condition, code)
+        to_next = code.emit(JUMP_IF_FALSE)
+        code.emit(RETURN)
+        code.patch(to_next, len(code))
+
+    elif node.kind == "ENTER":
+        # Entry points are handled by the prologue (see compile_block),
+        # which jumps here.
+        code.entries[node] = len(code)
+
+def compile_statements(statements, code):
+    """
+    Emits the instructions for a list of statements.
+    """
+
+    for statement in statements:
+        compile_statement(statement, code)
+
+def compile_block(node, scope, name="<block>"):
+    """
+    Compiles the body of a function (or of main). Returns a Code object.
+    """
+
+    if node in compiled_blocks:
+        return compiled_blocks[node]
+
+    code = Code(name, scope)
+
+    # If the block has enter statements, however deeply nested, the code
+    # starts by jumping to a prologue at the end. The prologue checks their
+    # conditions from the bottom up (see evaluator.entry_points) and jumps
+    # to just after the first one that holds, or else back to the top.
+    entries = evaluator.entry_points(node)
+    to_prologue = code.emit(JUMP) if entries else None
+    top = len(code)
+
+    compile_statements(node.statements, code)
+    code.emit(RETURN)
+
+    if entries:
+        code.patch(to_prologue, len(code))
+
+        for enter, _ in entries:
+            compile_expr(enter.condition, code)
+            code.emit(JUMP_IF_TRUE, code.entries[enter])
+        code.emit(JUMP, top)
+
+    compiled_blocks[node] = code
+    return code
+
+def compile_function(function):
+    """
+    Compiles an Arrow function in both directions.
+    Returns (forward code, inverse code).
+    """
+
+    if function.block in compiled_functions:
+        return compiled_functions[function.block]
+
+    forward = compile_block(function.block, function.scope, function.name)
+    inverse = compile_block(
+        inverter.unblock(function.block), function.scope, "un-" + function.name)
+
+    compiled_functions[function.block] = forward, inverse
+    return forward, inverse
+
+def disassemble(code):
+    """
+    Returns a human-readable listing of a Code object's instructions.
+    """
+
+    lines = ["{}:".format(code.name)]
+    targets = {
+        code.ops[i + 1] for i in range(0, len(code.ops), 2)
+        if code.ops[i] in (JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE)
+        }
+
+    for i in range(0, len(code.ops), 2):
+        op, arg = code.ops[i], code.ops[i + 1]
+
+        if op == LOAD_CONST or op == LOAD_STRING:
+            # (Datatypes and fill functions are shown by name.)
+            const = code.consts[arg]
+            detail = getattr(const, "__name__", None) or repr(const)
+        elif op in (LOAD_VAR, STORE_VAR, DECLARE_VAR, DEALLOC):
+            detail = code.scope.names[arg]
+        elif op == BIN_OP or op == MOD_INDEX:
+            detail = bin_op_names[arg]
+        elif op == MOD_VAR:
+            slot, bin_op = divmod(arg, 16)
+            detail = "{} {}=".format(code.scope.names[slot], bin_op_names[bin_op])
+        elif op == CALL:
+            name, attrs, _, backwards, ref_slots, n_consts = code.calls[arg]
+            detail = "{}{} (refs: {}; {} const)".format(
+                "un-" if backwards else "", ".".join((name,) + attrs),
+                ", ".join(code.scope.names[slot] for slot in ref_slots) or "none",
+                n_consts)
+        elif op in (JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE):
+            detail = "to {}".format(arg)
+        else:
+            detail = ""
+
+        lines.append("{:>3} {:>5}  {:<14} {:>3} {}".format(
+            ">>" if i in targets else "", i, opnames[op], arg, detail
+            ).rstrip())
+
+    return "\n".join(lines)
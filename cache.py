@@ -0,0 +1,127 @@
+import hashlib, os, pickle, sys, tempfile
+import scanner, parser, shared
+
+#
+# Parsed programs are cached on disk, so running the same file again skips
+# scanning, parsing and resolving. A cache file holds a key, followed by
+# the pickled PROGRAM node (its functions, main, and the main vars'
+# values).
+#
+# The key is a hash of the source together with the interpreter's own
+# code and settings, so editing either one invalidates the cache.
+#
+
+# Where cache files go. None puts them in an __arrowcache__ directory next
+# to each source file.
+cache_dir = None
+
+# The modules whose code decides what a parsed program looks like.
+interpreter_modules = [
+    "scanner", "parser", "resolver", "inverter", "datatypes", "evaluator",
+    "shared", "cache"
+    ]
+
+# (Computed on first use; see interpreter_version.)
+version = None
+
+def interpreter_version():
+    """
+    Returns a hash of the interpreter's source code and of the Python
+    version (which decides the pickle format).
+    """
+
+    global version
+    if version is None:
+        digest = hashlib.sha256(sys.version.encode())
+        for name in interpreter_modules:
+            with open(sys.modules[name].__file__, "rb") as f:
+                digest.update(f.read())
+        version = digest.hexdigest()
+
+    return version
+
+def cache_path(filename):
+    """
+    Returns where the cache file for a source file goes.
+    """
+
+    directory, base = os.path.split(os.path.abspath(filename))
+    if cache_dir is None:
+        return os.path.join(directory, "__arrowcache__", base + "c")
+
+    # Different directories may hold files with the same name.
+    prefix = hashlib.sha256(directory.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "{}-{}c".format(prefix, base))
+
+def cache_key(source):
+    digest = hashlib.sha256(interpreter_version().encode())
+    digest.update(str(shared.memo_size).encode())
+    digest.update(source.encode())
+    return digest.hexdigest().encode()
+
+def parse(source):
+    return parser.ArrowParser(scanner.Scanner(source=source).tokens()).program()
+
+def load(filename):
+    """
+    Returns the program node for an Arrow file, from the cache if it's
+    there and up to date, and otherwise by parsing it (and caching that).
+    Reading stdin ("-") is never cached.
+    """
+
+    if filename == "-":
+        return parse(sys.stdin.read())
+
+    with open(filename, "r") as f:
+        source = f.read()
+
+    key = cache_key(source)
+    path = cache_path(filename)
+
+    program = read(path, key)
+    if program is None:
+        program = parse(source)
+        write(path, key, program)
+    else:
+        # What the scanner and parser would have set up.
+        shared.code = [line.rstrip() for line in source.split("\n")]
+        shared.program = program
+
+    return program
+
+def read(path, key):
+    """
+    Returns the program cached at path if its key matches, or else None.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            if f.readline().rstrip(b"\n") != key:
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        # Missing, unreadable or written by something else: just reparse.
+        return None
+
+def write(path, key, program):
+    """
+    Caches a program. Failing to (say, in a read-only directory) isn't an
+    error; the program just gets parsed again next time.
+    """
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so a run which reads the cache
+        # at the same time never sees half a file.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(key + b"\n")
+            pickle.dump(program, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except (OSError, RecursionError, pickle.PicklingError):
+        os.remove(temp_path)
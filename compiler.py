@@ -0,0 +1,445 @@
+import datatypes, evaluator, inverter, shared
+
+#
+# The compiled closures work directly on a memory table's list of values,
+# reading and writing variables by the slots the resolver gave them.
+#
+# Statement closures return True when an exit statement fires, which tells
+# every enclosing block and loop to stop, and return None otherwise.
+#
+
+# Compiled closures, keyed by the node (or (function, backwards) pair)
+# they were compiled from, so each tree is only compiled once.
+compiled_blocks = {}
+compiled_functions = {}
+
+def compile_expr(node):
+    """
+    Compiles expression nodes.
+    Returns a function which takes a list of values and returns a data value.
+    """
+
+    if node.kind == "BIN_OP":
+        op = evaluator.bin_ops[node.op]
+        left = compile_expr(node.left)
+        right = compile_expr(node.right)
+        return lambda values: op(left(values), right(values))
+
+    elif node.kind == "NEGATE":
+        expr = compile_expr(node.expr)
+        return lambda values: - expr(values)
+
+    elif node.kind == "NUM":
+        number = node.number
+        return lambda values: number
+
+    elif node.kind == "STRING":
+        string = node.string
+        return lambda values: string.copy()
+
+    elif node.kind == "VAR_REF":
+        slot = node.slot
+        return lambda values: values[slot]
+
+    elif node.kind == "ARRAY_REF":
+        slot = node.slot
+        index = compile_expr(node.expr)
+        return lambda values: values[slot][index(values)]
+
+    elif node.kind == "FUNCTION_CALL":
+        return compile_call(node)
+
+    elif node.kind == "ARRAY_EXPR":
+        # The entries are evaluated in order, and a new list is
+        # created every time, just like the tree-walker does.
+        entries = [compile_expr(entry) for entry in node.entries]
+        datatype = node.datatype
+        return lambda values: datatype(
+            [entry(values) for entry in entries])
+
+    elif node.kind == "ARRAY_FILL":
+        value, count = compile_expr(node.value), compile_expr(node.count)
+        fill = node.fill
+        return lambda values: fill(value(values), count(values))
+
+    elif node.kind == "ARRAY_RANGE":
+        start, stop = compile_expr(node.start), compile_expr(node.stop)
+        return lambda values: datatypes.range_list(start(values), stop(values))
+
+def compile_call(node):
+    """
+    Compiles function call nodes (both as expressions and as statements).
+    Returns a function which takes a list of values, performs the call,
+    and returns the call's result.
+    """
+
+    name, attrs, slot = node.name, node.attrs, node.slot
+    backwards = node.backwards
+    ref_slots = node.ref_slots
+    const_args = [compile_expr(arg) for arg in node.const_args]
+
+    def call(values):
+        # Functions are looked up when called rather than when compiled,
+        # since a function may be compiled before the ones it calls exist.
+        if attrs:
+            function = values[slot]
+            for attr in attrs:
+                function = getattr(function, attr)
+        else:
+            function = shared.program.functions[name]
+
+        return function.call(
+            backwards, values, ref_slots, [arg(values) for arg in const_args])
+
+    return call
+
+def compile_mod_op(node):
+    op = evaluator.mod_ops[node.op]
+    expr = compile_expr(node.expr)
+    slot = node.var.slot
+
+    if node.var.kind == "ARRAY_REF":
+        index = compile_expr(node.var.expr)
+
+        def mod_op(values):
+            expr_value = expr(values)
+            array = values[slot]
+            i = index(values)
+            array[i] = op(array[i], expr_value)
+
+    else:
+        def mod_op(values):
+            expr_value = expr(values)
+            values[slot] = op(values[slot], expr_value)
+
+    return mod_op
+
+def compile_swap_op(node):
+    left, right = node.left, node.right
+    l, r = left.slot, right.slot
+
+    if left.kind == "VAR_REF" and right.kind == "VAR_REF":
+        def swap_op(values):
+            values[l], values[r] = values[r], values[l]
+
+    elif left.kind == "ARRAY_REF" and right.kind == "VAR_REF":
+        l_index = compile_expr(left.expr)
+
+        def swap_op(values):
+            l_array, i = values[l], l_index(values)
+            l_array[i], values[r] = values[r], l_array[i]
+
+    elif left.kind == "VAR_REF" and right.kind == "ARRAY_REF":
+        r_index = compile_expr(right.expr)
+
+        def swap_op(values):
+            r_array, j = values[r], r_index(values)
+            values[l], r_array[j] = r_array[j], values[l]
+
+    else:
+        l_index = compile_expr(left.expr)
+        r_index = compile_expr(right.expr)
+
+        def swap_op(values):
+            L, R = values[l], values[r]
+            i, j = l_index(values), r_index(values)
+            L[i], R[j] = R[j], L[i]
+
+    return swap_op
+
+def compile_var_condition(node):
+    name, slot = node.name, node.slot
+    expr = compile_expr(node.expr)
+
+    def var_condition(values):
+        # Mirrors evaluator.var_condition_eval.
+        if values[slot] == expr(values):
+            values[slot] = None
+        else:
+            print(
+                name, "is supposed to be",
+                expr(values),
+                "but it's actually",
+                values[slot]
+                )
+
+    return var_condition
+
+def compile_statement(node):
+    """
+    Compiles statement nodes.
+    Returns a function which takes a list of values, modifies it in place,
+    and returns True if the function is returning.
+    """
+
+    if node.kind == "MOD_OP":
+        return compile_mod_op(node)
+
+    elif node.kind == "SWAP_OP":
+        return compile_swap_op(node)
+
+    elif node.kind == "FROM_LOOP":
+        block = compile_block(node.block)
+        end_condition = compile_expr(node.end_condition)
+
+        def from_loop(values):
+            while True:
+                if block(values):
+                    return True
+                if end_condition(values):
+                    break
+
+        return from_loop
+
+    elif node.kind == "FOR_LOOP":
+        var_slot = node.var_declaration.slot
+        start = compile_expr(node.var_declaration.expr)
+        loop = compile_for_loop(node)
+        unshared = datatypes.unshared
+
+        def for_loop(values):
+            values[var_slot] = unshared(start(values))
+            return loop(values)
+
+        return for_loop
+
+    elif node.kind == "IF":
+        condition = compile_expr(node.condition)
+        true = compile_block(node.true)
+
+        if node.false is not None:
+            false = compile_block(node.false)
+
+            def if_statement(values):
+                if condition(values):
+                    return true(values)
+                else:
+                    return false(values)
+        else:
+            def if_statement(values):
+                if condition(values):
+                    return true(values)
+
+        return if_statement
+
+    elif node.kind == "DO/UNDO":
+        # The undo half is inverted once, here, rather than every time
+        # the statement runs.
+        action = compile_block(node.action_block)
+        undo = compile_block(inverter.unblock(node.action_block))
+
+        if node.yielding_block is not None:
+            yielding = compile_block(node.yielding_block)
+
+            def do_undo(values):
+                return action(values) or yielding(values) or undo(values)
+        else:
+            def do_undo(values):
+                return action(values) or undo(values)
+
+        return do_undo
+
+    elif node.kind == "RESULT":
+        expr = compile_expr(node.expr)
+
+        # 'result' is always in slot 0.
+        def result(values):
+            values[0] = expr(values)
+
+        return result
+
+    elif node.kind == "VAR_DEC":
+        slot = node.slot
+        expr = compile_expr(node.expr)
+        unshared = datatypes.unshared
+
+        def var_dec(values):
+            values[slot] = unshared(expr(values))
+
+        return var_dec
+
+    elif node.kind == "VAR_CONDITION":
+        return compile_var_condition(node)
+
+    elif node.kind == "BLOCK":
+        return compile_block(node)
+
+    elif node.kind == "FUNCTION_CALL":
+        call = compile_call(node)
+
+        # The call's result mustn't be mistaken for a return.
+        def call_statement(values):
+            call(values)
+
+        return call_statement
+
+    elif node.kind == "UN":
+        return compile_statement(inverter.unstatement(node.statement))
+
+    elif node.kind == "EXIT":
+        condition = compile_expr(node.condition)
+
+        def exit_statement(values):
+            if condition(values):
+                return True
+
+        return exit_statement
+
+    elif node.kind == "ENTER":
+        return lambda values: None
+
+def compile_for_loop(node):
+    """
+    Compiles the looping part of a for loop, once its variable has been
+    initialized (see evaluator.for_loop_eval). Returns a function which
+    takes a list of values, and returns True if the function is returning.
+    """
+
+    increment = compile_mod_op(node.increment_statement)
+    block = compile_block(node.block)
+    until_slot = node.end_condition.slot
+    until = compile_expr(node.end_condition.expr)
+    deallocate = compile_var_condition(node.end_condition)
+    inc_at_end = node.inc_at_end
+
+    def loop(values):
+        while True:
+            if not inc_at_end:
+                increment(values)
+            if block(values):
+                return True
+
+            if inc_at_end:
+                increment(values)
+            if values[until_slot] == until(values):
+                break
+        deallocate(values)
+
+    return loop
+
+def compile_block(node):
+    """
+    Compiles block nodes.
+    Returns a function which takes a list of values, modifies it in place,
+    and returns True if the function is returning.
+    """
+
+    if node in compiled_blocks:
+        return compiled_blocks[node]
+
+    statements = [compile_statement(s) for s in node.statements]
+
+    def block(values):
+        for statement in statements:
+            if statement(values):
+                return True
+
+    compiled_blocks[node] = block
+    return block
+
+def compile_resume_block(node, path):
+    """
+    Compiles a block to run from partway through, as if execution had just
+    passed the enter statement at the end of path (see
+    evaluator.entry_points). Returns a function like compile_block's.
+    """
+
+    (i, sub_block), rest = path[0], path[1:]
+    statements = [compile_statement(s) for s in node.statements[i + 1:]]
+
+    if sub_block is not None:
+        statements.insert(0,
+            compile_resume_statement(node.statements[i], sub_block, rest))
+
+    def block(values):
+        for statement in statements:
+            if statement(values):
+                return True
+
+    return block
+
+def compile_resume_statement(node, sub_block, path):
+    """
+    Compiles the rest of a statement, starting partway through one of its
+    blocks (see evaluator.resume_statement).
+    """
+
+    resume = compile_resume_block(sub_block, path)
+
+    if node.kind == "FROM_LOOP":
+        end_condition = compile_expr(node.end_condition)
+        loop = compile_statement(node)
+
+        def resume_statement(values):
+            if resume(values):
+                return True
+            if not end_condition(values):
+                return loop(values)
+
+    elif node.kind == "DO/UNDO":
+        # Resuming in one part of a do/undo runs the parts after it.
+        undo_block = inverter.unblock(node.action_block)
+        parts = [resume]
+
+        if sub_block is node.action_block and node.yielding_block is not None:
+            parts.append(compile_block(node.yielding_block))
+        if sub_block is not undo_block:
+            parts.append(compile_block(undo_block))
+
+        def resume_statement(values):
+            for part in parts:
+                if part(values):
+                    return True
+
+    else:
+        resume_statement = resume
+
+    return resume_statement
+
+def compile_function(function, backwards):
+    """
+    Compiles an Arrow function in the given direction.
+    Returns a function which takes a memory table, runs the function's body
+    on it, and returns the function's result (see Function.execute).
+    """
+
+    key = (function, backwards)
+    if key in compiled_functions:
+        return compiled_functions[key]
+
+    block = inverter.unblock(function.block) if backwards else function.block
+    body = compile_block(block)
+
+    # Enter statements are checked from the bottom up; execution resumes
+    # right after the first one whose condition holds.
+    entries = [
+        (compile_expr(enter.condition), compile_resume_block(block, path))
+        for enter, path in evaluator.entry_points(block)
+        ]
+
+    def run(table):
+        values = table.values
+
+        for condition, resume in entries:
+            if condition(values):
+                resume(values)
+                break
+        else:
+            body(values)
+
+        # Hand back the result, and clear it out of the table.
+        result, values[0] = values[0], None
+        return result
+
+    compiled_functions[key] = run
+    return run
+
+def program_eval(node):
+    """
+    Compiles and evaluates the entire program.
+    Returns a memory table of the main variables.
+    """
+
+    table = evaluator.main_memory(node)
+    compile_block(node.main.block)(table.values)
+    return table
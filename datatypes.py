@@ -1,4 +1,63 @@
-import numbers, functools, evaluator, inverter, shared
+import array, collections, copy, numbers, functools, math, operator
+import evaluator, inverter, shared, compiler, vm
+
+def raise_error(message):
+    """
+    Raises an evaluation error from inside a datatype, which doesn't know
+    which statement it's being used by.
+    """
+
+    raise shared.ArrowException(shared.Stages.evaluation, message, None)
+
+class BuiltinMethod:
+    """
+    Declares a Python method as one of an Arrow datatype's builtin methods.
+
+    Looking the method up on a value (as Memory does for "x.to_str") returns
+    a BuiltinFunction bound to that value, so nothing is allocated per value
+    until one of its methods is actually used.
+    """
+
+    def __init__(self, refs, consts, inverse=None):
+        """
+        Takes the method's ref and const parameter names, and the name of
+        the method which undoes it (by default, the method itself).
+        """
+
+        self.ref_parameters = refs
+        self.const_parameters = consts
+        self.inverse = inverse
+
+        # Shared by every BuiltinFunction this creates. (Made on first use,
+        # since evaluator may still be loading when datatypes is.)
+        self.scope = None
+
+    def __call__(self, python_function):
+        self.name = python_function.__name__
+        self.python_function = python_function
+        return self
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        inverse = (
+            getattr(owner, self.inverse).python_function if self.inverse
+            else self.python_function
+            )
+
+        if self.scope is None:
+            self.scope = evaluator.Scope(
+                self.ref_parameters, self.const_parameters)
+
+        return BuiltinFunction(
+            self.name,
+            self.ref_parameters,
+            self.const_parameters,
+            self.python_function.__get__(instance, owner),
+            inverse.__get__(instance, owner),
+            self.scope
+            )
 
 @functools.total_ordering
 class Num:
@@ -6,77 +65,62 @@ class Num:
     Because floating-point numbers lead to irreversibility, infinite-precision
     rational numbers are used in Arrow.
     """
-    def __init__(self, top, bottom=None, sign=None):
-        """
-        Nums store a numerator, denominator, and sign (either 1 or -1).
-        """
 
-        _to_str = self.to_str
-        _is_int = self.is_int
+    __slots__ = ("top", "bottom", "sign")
 
-        self.to_str = BuiltinFunction("to_str", [], [], self.to_str, _to_str)
-        self.is_int = BuiltinFunction("is_int", [], [], self.is_int, _is_int)
+    def __init__(self, top, bottom=1, sign=None):
+        """
+        Nums store a numerator, denominator, and sign (either 1 or -1).
 
-        if bottom is None:
-            bottom = 1
+        If a sign is given, top and bottom must already be non-negative.
+        """
 
         if sign is None:
-            # If top and bottom's signs match, self.sign is positive.
-            if (bottom > 0) == (top > 0):
-                self.sign = 1
-            # Otherwise it's negative.
-            else:
-                self.sign = -1
-        else:
-            self.sign = sign
+            # If top and bottom's signs match, the sign is positive.
+            sign = 1 if (top < 0) == (bottom < 0) else -1
+            top, bottom = abs(top), abs(bottom)
 
-        # Top and bottom are positive only, since +/- is stored in self.sign.
-        self.top = abs(top)
-        self.bottom = abs(bottom)
+        if bottom == 0:
+            raise ZeroDivisionError("Num({}, 0)".format(top))
 
         # Because Nums are immutable, a reduction to lowest terms
         # in the constructor ensures they are always in lowest form.
-        self.reduce()
-
+        # Integers (the common case) are already there.
+        if bottom != 1:
+            d = math.gcd(top, bottom)
+            if d != 1:
+                top, bottom = top // d, bottom // d
+
+        # Zero always has the same sign, so equal Nums have equal fields.
+        self.top = top
+        self.bottom = bottom
+        self.sign = sign if top else 1
+
+    @BuiltinMethod([], [])
     def to_str(self, table):
         return String(str(self))
 
+    @BuiltinMethod([], [])
     def is_int(self, table):
         return Boolean(self.bottom == 1)
 
-    @staticmethod
-    def gcd(a, b):
-        # Euclid's algorithm.
-        while True:
-            a, b = b, a % b
-            if b == 0:
-                return a
-
-    def reduce(self):
-        """
-        Reduce this fraction to lowest terms.
-        """
-
-        # While the top and bottom have a factor in common, divide it out.
-        while True:
-            d = Num.gcd(self.top, self.bottom)
-            if d == 1:
-                break
-
-            # Integer division here because the whole point
-            # is to remain within the integers!
-            self.top, self.bottom = self.top // d, self.bottom // d
-
     def reciprocal(self):
         return Num(self.bottom, self.top, sign=self.sign)
 
     def __add__(self, other):
+        if self.bottom == 1 and other.bottom == 1:
+            return Num(self.top*self.sign + other.top*other.sign)
+
         # a/b + c/d = (ad)/(bd) + (bc)/(bd) = (ad + bc)/(bd)
         a, b, c, d = self.top, self.bottom, other.top, other.bottom
         return Num(a*self.sign*d + b*c*other.sign, b*d)
 
     def __sub__(self, other):
-        return self + (-other)
+        if self.bottom == 1 and other.bottom == 1:
+            return Num(self.top*self.sign - other.top*other.sign)
+
+        a, b, c, d = self.top, self.bottom, other.top, other.bottom
+        return Num(a*self.sign*d - b*c*other.sign, b*d)
 
     def __neg__(self):
         return Num(self.top, self.bottom, sign=-self.sign)
@@ -86,11 +130,18 @@ class Num:
             sign=self.sign*other.sign)
 
     def __truediv__(self, other):
-        return self * other.reciprocal()
+        return Num(self.top*other.bottom, self.bottom*other.top,
+            sign=self.sign*other.sign)
 
     def __mod__(self, other):
         return Num(self.top % other.top)
-            
+
+    def __xor__(self, other):
+        # Only integers have bits; x ^= y undoes itself.
+        if self.bottom != 1 or other.bottom != 1:
+            raise_error("Can't ^ {} and {}.".format(self, other))
+        return integer((self.top * self.sign) ^ (other.top * other.sign))
+
     __rmul__ = __mul__
     __radd__ = __add__
     __rsub__ = lambda self, other: -self + other
@@ -103,27 +154,107 @@ class Num:
             return "({}/{})".format(self.top * self.sign, self.bottom)
 
     def __eq__(self, other):
-        return (
-            self.top == other.top
-            and self.bottom == other.bottom
-            and self.sign == other.sign
-            )
+        try:
+            return (
+                self.top == other.top
+                and self.bottom == other.bottom
+                and self.sign == other.sign
+                )
+        except AttributeError:
+            # Not a Num (say, a String sharing a memo key position).
+            return NotImplemented
+
+    def __hash__(self):
+        # Nums are always in lowest terms, so equal Nums hash equally.
+        # (Integers, the usual Map keys, hash like Python's.)
+        if self.bottom == 1:
+            return hash(self.top * self.sign)
+        return hash((self.top, self.bottom, self.sign))
 
     def __lt__(self, other):
-        return True if (self - other).sign == -1 else False
+        # a/b < c/d  <=>  ad < cb, since b and d are positive.
+        #
+        # Arrow's '<' has always held for equal values too (the difference
+        # of two equal Nums used to come out with a negative sign), and
+        # programs like sort.arrow rely on it, so that's kept here.
+        return (self.top * self.sign * other.bottom
+            <= other.top * other.sign * self.bottom)
+
+class Memo:
+    """
+    A bounded cache of a pure function's results (see
+    resolver.find_pure_functions), keyed by the direction it was called in
+    and its const args' values. The least recently used result is dropped
+    when the cache is full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.results = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(backwards, const_arg_vals):
+        """
+        Returns the key for a call, or None if an arg can't be used as a
+        key (lists can change, so they're never cached).
+        """
+
+        key = [backwards]
+        for value in const_arg_vals:
+            if isinstance(value, Num):
+                key.append(value)
+            elif isinstance(value, String):
+                key.append(value.copy())
+            else:
+                return None
+
+        return tuple(key)
+
+    def get(self, key):
+        """
+        Returns (whether the key was found, the cached result).
+        """
+
+        results = self.results
+        if key in results:
+            self.hits += 1
+            results.move_to_end(key)
+            return True, Memo.copy(results[key])
+
+        self.misses += 1
+        return False, None
+
+    def put(self, key, result):
+        if result is not None and not isinstance(result, (Num, String)):
+            return
+
+        results = self.results
+        results[key] = Memo.copy(result)
+        if len(results) > self.size:
+            results.popitem(last=False)
+
+    @staticmethod
+    def copy(result):
+        # Strings can change in place, so each caller gets its own.
+        return result.copy() if isinstance(result, String) else result
 
 class Function:
     """
     Functions are first-class objects in Arrow.
     """
 
+    # Pure functions are given a Memo by the resolver.
+    memo = None
+
     def __init__(self, name, refs, consts, block):
         """
         Functions store
             - their name
             - their code
             - their parameters and those parameters' types, in L-to-R order.
-            - a list of their entry conditions (in bottom-up order).
         """
 
         self.name = name
@@ -132,81 +263,116 @@ class Function:
         self.ref_parameters = refs
         self.const_parameters = consts
 
+        # Where each of the function's variables lives in its memory table.
+        # The resolver adds the local variables once the program is parsed.
+        self.scope = evaluator.Scope(refs, consts)
+
     def execute(self, backwards, table):
-        # Go up from the bottom, looking for enter statements, in order to
-        # find out where we should start executing.
+        if shared.engine == "closure":
+            return compiler.compile_function(self, backwards)(table)
+        elif shared.engine == "vm":
+            return vm.execute(self, backwards, table)
 
         # The backwards flag tells us whether we are calling or uncalling.
         block = inverter.unblock(self.block) if backwards else self.block
 
-        result = None
+        # Check the enter statements' conditions from the bottom up, and
+        # start right after the first one that holds; if none do, start
+        # at the top.
+        for enter, path in evaluator.entry_points(block):
+            if evaluator.expr_eval(enter.condition, table):
+                evaluator.resume_block(block, path, table)
+                break
+        else:
+            evaluator.block_eval(block, table)
+
+        # Hand back the result, and clear it out of the table.
+        values = table.values
+        result, values[0] = values[0], None
+        return result
 
-        # TODO: this approach only finds un-nested enter statements.
-        to_execute = []
-        for node in reversed(block.statements):
-            if node.kind == "ENTER":
-                if evaluator.expr_eval(node.condition, table):
-                    result = evaluator.expr_eval(node.value, table)
-                    break
-            to_execute.append(node)
+    def call(self, backwards, values, ref_slots, const_arg_vals):
+        """
+        Calls the function from a caller whose memory table holds values.
+        The caller's variables in ref_slots are passed by reference: their
+        values go straight into the ref parameters' slots, and the
+        parameters' final values go straight back. Returns the result.
+        """
 
-        block_to_execute = self.block.replace(statements=to_execute[::-1])
+        # Pure functions (which have no ref parameters) may already know
+        # the answer.
+        memo = self.memo
+        if memo is not None:
+            key = memo.key(backwards, const_arg_vals)
+            if key is not None:
+                found, result = memo.get(key)
+                if found:
+                    return result
 
-        # Execute the block. If it returns, catch the return exception
-        # and update the table accordingly.
-        try:
-            table = evaluator.block_eval(block_to_execute, table)
-        
-        except shared.ReturnException:
-            pass
+        frame = self.bind(values, ref_slots, const_arg_vals)
+        result = self.execute(backwards, frame)
+        self.unbind(frame, values, ref_slots)
 
-        # HACKY HACK
-        if "result" in table:
-            temp = table["result"]
-            del table["result"]
-            return temp
+        if memo is not None and key is not None:
+            memo.put(key, result)
 
-    def evaluate(self, backwards, ref_arg_vars, ref_arg_vals, const_arg_vals):
+        return result
+
+    def bind(self, values, ref_slots, const_arg_vals):
         """
-        Given a list of reference and constant args, evaluates functions.
-        Returns (memory table, result value).
+        Takes a memory table from the pool (see evaluator.Scope), and puts
+        the arguments in their parameters' slots. Returns the table.
         """
 
-        # Create a memory table for the function by zipping up
-        # the arguments into (parameter, value) pairs.
-        table = evaluator.Memory(
-            zip(self.ref_parameters, ref_arg_vals),
-            zip(self.const_parameters, const_arg_vals)
-            )
+        scope = self.scope
+        frame = scope.frames.pop() if scope.frames else evaluator.Memory(scope)
+        frame_values = frame.values
+
+        slot = 1
+        for ref_slot in ref_slots:
+            frame_values[slot] = values[ref_slot]
+            slot += 1
+        for value in const_arg_vals:
+            frame_values[slot] = (
+                value.copy() if type(value) is String else value)
+            slot += 1
+
+        return frame
+
+    def unbind(self, frame, values, ref_slots):
+        """
+        Hands the ref parameters' final values back to the caller's
+        variables, and returns the memory table to the pool.
+        """
 
-        result = self.execute(backwards, table)
-
-        # Go through the variable names in the function's memory table
-        # and change them to the new names.
-        for arg, param_name in zip(ref_arg_vars, self.ref_parameters):
-            table.refs[arg.name] = table.refs[param_name]
-
-            # If a function like
-            # 
-            # f (ref x){
-            #   ...
-            # }
-            # 
-            # was called like
-            # 
-            # f(&x)
-            # 
-            # then we shouldn't delete 'x' from the resulting memory table.
-            if arg.name != param_name:
-                del table.refs[param_name]
-
-        return table, result
+        frame_values = frame.values
+
+        slot = 1
+        for ref_slot in ref_slots:
+            values[ref_slot] = frame_values[slot]
+            slot += 1
+
+        self.scope.release(frame)
+
+    def evaluate(self, backwards, ref_arg_vals, const_arg_vals):
+        """
+        Given the values of the reference and constant args, evaluates
+        functions. Returns (the reference parameters' final values,
+        result value).
+        """
+
+        ref_values = list(ref_arg_vals)
+        result = self.call(
+            backwards, ref_values, range(len(ref_values)), const_arg_vals)
+
+        return ref_values, result
 
 class BuiltinFunction(Function):
     """
     """
 
-    def __init__(self, name, refs, consts, python_function, inverse_function):
+    def __init__(self, name, refs, consts, python_function, inverse_function,
+        scope=None):
         self.name = name
         self.python_function = python_function
 
@@ -214,6 +380,8 @@ class BuiltinFunction(Function):
         self.const_parameters = consts
         self.inverse_function = inverse_function
 
+        self.scope = evaluator.Scope(refs, consts) if scope is None else scope
+
     def execute(self, backwards, table):
         # Run the appropriate underlying Python function.
         if backwards:
@@ -221,78 +389,684 @@ class BuiltinFunction(Function):
         else:
             return self.python_function(table)
 
+def integer(n):
+    """
+    Returns the Num for the integer n, quicker than Num(n) does. Nums are
+    immutable, so small ones are made once and shared.
+    """
+
+    if -SMALL_INTS <= n < SMALL_INTS:
+        return small_ints[n + SMALL_INTS]
+
+    num = new_num(Num)
+    if n < 0:
+        num.top, num.sign = -n, -1
+    else:
+        num.top, num.sign = n, 1
+    num.bottom = 1
+    return num
+
+new_num = object.__new__
+
+SMALL_INTS = 1024
+small_ints = [Num(n) for n in range(-SMALL_INTS, SMALL_INTS)]
+
+def pack(values):
+    """
+    Returns an array of the integers the values stand for, if they're all
+    integer Nums which fit in 64 bits; otherwise returns the values.
+    """
+
+    ints = []
+    for value in values:
+        if type(value) is not Num or value.bottom != 1:
+            return values
+        ints.append(value.top * value.sign)
+
+    try:
+        return array.array("q", ints)
+    except OverflowError:
+        return values
+
+def box(item):
+    """
+    Returns the Arrow value for an item of a List's contents.
+    """
+
+    return integer(item) if type(item) is int else item
+
+class Sparse:
+    """
+    The contents of a List made by a fill ("[value; n]") or range
+    ("[start:stop]") initializer, until much of it is written. Entry i is
+    the integer first + i * step unless it's been written, in which case
+    its value is in written. An entry written back to what it started as
+    is taken out of written, so a List put back the way it was made
+    compares equal to a new one straight away.
+
+    Items are read and written like an array's (see List), except that
+    written values are Arrow values.
+    """
+
+    __slots__ = ("size", "first", "step", "written")
+
+    def __init__(self, size, first, step):
+        self.size = size
+        self.first = first
+        self.step = step
+        self.written = {}
+
+    def position(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("list index out of range")
+        return i
+
+    def __getitem__(self, i):
+        i = self.position(i)
+        item = self.written.get(i)
+        if item is None:
+            return self.first + i * self.step
+        return item
+
+    def __setitem__(self, i, value):
+        i = self.position(i)
+        if (type(value) is Num and value.bottom == 1
+                and value.top * value.sign == self.first + i * self.step):
+            self.written.pop(i, None)
+        else:
+            self.written[i] = value
+
+    def crowded(self):
+        # Past this, an array takes less memory than written does.
+        return len(self.written) * 4 > self.size
+
+    def unsparse(self):
+        """
+        Returns every entry, written out as pack would.
+        """
+
+        try:
+            if self.step:
+                ints = array.array("q", range(
+                    self.first, self.first + self.size * self.step, self.step))
+            else:
+                ints = array.array("q", [self.first]) * self.size
+
+            for i, value in self.written.items():
+                if type(value) is not Num or value.bottom != 1:
+                    raise OverflowError
+                ints[i] = value.top * value.sign
+        except OverflowError:
+            return pack(list(map(box, self)))
+
+        return ints
+
+    def __iter__(self):
+        written, first, step = self.written, self.first, self.step
+        for i in range(self.size):
+            item = written.get(i)
+            yield first + i * step if item is None else item
+
+    def __len__(self):
+        return self.size
+
+def fill_size(count):
+    """
+    Returns a fill initializer's count (a Num) as a Python int, if it's a
+    whole number.
+    """
+
+    if type(count) is not Num or count.bottom != 1 or count.sign < 0:
+        raise_error("Can't fill {} entries.".format(count))
+    return count.top
+
+def fill_list(value, count):
+    """
+    Returns a List of count entries, each value. A List of an integer is
+    made lazily (see Sparse); anything else can change in place, so each
+    entry gets its own copy.
+    """
+
+    size = fill_size(count)
+    if type(value) is Num and value.bottom == 1:
+        return List(Sparse(size, value.top * value.sign, 0))
+    return List([copy.deepcopy(value) for _ in range(size)])
+
+def range_list(start, stop):
+    """
+    Returns a List of the integers from start up to (not including) stop,
+    made lazily (see Sparse).
+    """
+
+    if (type(start) is not Num or type(stop) is not Num
+            or start.bottom != 1 or stop.bottom != 1):
+        raise_error("Can't count from {} to {}.".format(start, stop))
+
+    first = start.top * start.sign
+    return List(Sparse(max(0, stop.top * stop.sign - first), first, 1))
+
 class List:
     """
     Arrow's list/array datatype, also serving as a stack.
+
+    While every entry is an integer which fits in 64 bits, contents is an
+    array.array of those integers, which takes 8 bytes per entry rather
+    than a whole Num, and lets operations on the whole list run in C.
+    Entries are made into Nums when they're read. Storing anything else
+    turns contents into a Python list of Arrow values, for good.
+
+    A List made by a fill or range initializer starts out as Sparse
+    contents, which only hold the entries written so far; it's written out
+    into an array (or list) once a quarter of it has been written, or when
+    it's used as a whole.
     """
 
+    __slots__ = ("contents",)
+
     def __init__(self, contents):
+        """
+        Takes a Python list of Arrow values, an array of integers or Sparse
+        contents.
+        """
+
+        if type(contents) is not array.array and type(contents) is not Sparse:
+            contents = pack(contents)
         self.contents = contents
 
-        _push = self.push
-        _pop = self.pop
-        _peek = self.peek
-        _empty = self.empty
-        _len = self.len
+    def unsparse(self):
+        """
+        Writes out Sparse contents in full.
+        """
 
-        self.push = BuiltinFunction("push", [], ["data"], self.push, _pop)
-        self.pop = BuiltinFunction("pop", [], [], self.pop, _push)
-        self.peek = BuiltinFunction("peek", [], [], self.peek, _peek)
-        self.empty = BuiltinFunction("empty", [], [], self.empty, _empty)
-        self.len = BuiltinFunction("len", [], [], self.len, _len)
+        if type(self.contents) is Sparse:
+            self.contents = self.contents.unsparse()
 
+    def unpack(self):
+        """
+        Switches contents over to a Python list of Arrow values.
+        """
+
+        self.unsparse()
+        if type(self.contents) is array.array:
+            self.contents = [integer(n) for n in self.contents]
+
+    def store(self, i, value):
+        """
+        Puts a value at position i, or at the end if i is None.
+        """
+
+        self.unsparse()
+        contents = self.contents
+
+        if type(contents) is array.array:
+            if type(value) is Num and value.bottom == 1:
+                try:
+                    if i is None:
+                        contents.append(value.top * value.sign)
+                    else:
+                        contents[i] = value.top * value.sign
+                    return
+                except OverflowError:
+                    pass
+
+            self.unpack()
+            contents = self.contents
+
+        if i is None:
+            contents.append(value)
+        else:
+            contents[i] = value
+
+    @BuiltinMethod([], ["data"], inverse="pop")
     def push(self, table):
-        self.contents.append(table["data"])
+        self.store(None, table["data"])
         return table["data"]
 
+    @BuiltinMethod([], [], inverse="push")
     def pop(self, table):
-        return self.contents.pop()
+        self.unsparse()
+        return box(self.contents.pop())
 
+    @BuiltinMethod([], [])
     def peek(self, table):
-        return self.contents[-1]
+        return box(self.contents[-1])
 
+    @BuiltinMethod([], [])
     def empty(self, table):
         return Boolean(len(self.contents) == 0)
 
+    @BuiltinMethod([], [])
     def len(self, table):
         return Num(len(self.contents))
 
+    @BuiltinMethod([], [])
+    def sum(self, table):
+        self.unsparse()
+        contents = self.contents
+        if type(contents) is array.array:
+            return integer(sum(contents))
+        return functools.reduce(operator.add, contents, integer(0))
+
+    @BuiltinMethod([], [])
+    def is_sorted(self, table):
+        # In order by Arrow's '<' (which, for Nums, holds for equal ones).
+        self.unsparse()
+        contents = self.contents
+        if type(contents) is array.array:
+            return Boolean(all(map(operator.le, contents, contents[1:])))
+        return Boolean(all(map(operator.lt, contents, contents[1:])))
+
     def check_index(self, index):
         """
         Raises an error if the index isn't valid.
         """
 
         if index.bottom != 1:
-            pass
-            #Only access arrays with whole indices!
-        elif index.top >= len(self):
-            pass
-            #Array out of bounds error!
+            raise_error(
+                "Only whole numbers can index a list, not {}.".format(index))
         elif index.sign == -1:
-            pass
-            #Indexes can't be negative!
+            raise_error("Indexes can't be negative, like {}.".format(index))
+        elif index.top >= len(self.contents):
+            raise_error("There's no entry {} in a list of {}.".format(
+                index, len(self.contents)))
 
     def __getitem__(self, index):
         self.check_index(index)
         # After checking, we know the index is n/1 so we just grab index.top
-        return self.contents[index.top]
+        item = self.contents[index.top]
+        if type(item) is not int:
+            return item
+        elif -SMALL_INTS <= item < SMALL_INTS:
+            return small_ints[item + SMALL_INTS]
+        return integer(item)
 
     def __setitem__(self, index, value):
         self.check_index(index)
         # Again, the index is n/1 at this point.
-        self.contents[index.top] = value
+        contents = self.contents
+        if type(contents) is not array.array:
+            contents[index.top] = value
+            if type(contents) is Sparse and contents.crowded():
+                self.unsparse()
+            return
+
+        # (The common case, from store, without the call.)
+        if type(value) is Num and value.bottom == 1:
+            try:
+                contents[index.top] = value.top * value.sign
+                return
+            except OverflowError:
+                pass
+
+        self.store(index.top, value)
+
+    def elementwise(self, other, op):
+        """
+        Returns a new List of op applied to each pair of entries.
+        Both Lists must be the same length.
+        """
+
+        self.unsparse()
+        other.unsparse()
+        a, b = self.contents, other.contents
+        if len(a) != len(b):
+            raise_error(
+                "Can't combine lists of lengths {} and {}.".format(len(a), len(b)))
+
+        if type(a) is array.array and type(b) is array.array:
+            try:
+                return List(array.array("q", map(op, a, b)))
+            except OverflowError:
+                pass
+
+        return List(list(map(op, self, other)))
+
+    # A += B adds B to A entry by entry, and A -= B undoes it.
+    def __add__(self, other):
+        return self.elementwise(other, operator.add)
+
+    def __sub__(self, other):
+        return self.elementwise(other, operator.sub)
+
+    def __eq__(self, other):
+        if not isinstance(other, List):
+            return NotImplemented
+
+        a, b = self.contents, other.contents
+        if type(a) is Sparse and type(b) is Sparse:
+            # (Fill and range Lists still as they were made compare
+            # without looking at each entry.)
+            if (a.size, a.first, a.step) == (b.size, b.first, b.step):
+                return a.written == b.written
+        elif type(a) is type(b):
+            return a == b
+        return list(self) == list(other)
+
+    def __iter__(self):
+        return map(box, self.contents)
 
     def __len__(self):
         return len(self.contents)
 
     def __repr__(self):
-        return self.contents.__repr__()
+        contents = self.contents
+        if type(contents) is array.array:
+            return "[{}]".format(", ".join(map(str, contents)))
+        elif type(contents) is Sparse:
+            return "[{}]".format(", ".join(map(repr, self)))
+        return contents.__repr__()
+
+class Deque:
+    """
+    Arrow's double-ended queue datatype, made with "deque[...]".
+
+    Values can be pushed onto, popped off and peeked at either end in
+    constant time. Entries can also be read, changed and swapped by index,
+    like a List's; that takes longer towards the middle of a long deque.
+    """
+
+    __slots__ = ("contents",)
+
+    def __init__(self, contents):
+        """
+        Takes a Python list (or any iterable) of Arrow values.
+        """
+
+        self.contents = collections.deque(contents)
+
+    @BuiltinMethod([], ["data"], inverse="pop_left")
+    def push_left(self, table):
+        self.contents.appendleft(table["data"])
+        return table["data"]
+
+    @BuiltinMethod([], [], inverse="push_left")
+    def pop_left(self, table):
+        return self.contents.popleft()
+
+    @BuiltinMethod([], ["data"], inverse="pop_right")
+    def push_right(self, table):
+        self.contents.append(table["data"])
+        return table["data"]
+
+    @BuiltinMethod([], [], inverse="push_right")
+    def pop_right(self, table):
+        return self.contents.pop()
+
+    @BuiltinMethod([], [])
+    def peek_left(self, table):
+        return self.contents[0]
+
+    @BuiltinMethod([], [])
+    def peek_right(self, table):
+        return self.contents[-1]
+
+    @BuiltinMethod([], [])
+    def empty(self, table):
+        return Boolean(len(self.contents) == 0)
+
+    @BuiltinMethod([], [])
+    def len(self, table):
+        return integer(len(self.contents))
+
+    def position(self, index):
+        """
+        Returns index (a Num) as a Python int, if there's an entry there.
+        """
+
+        if (type(index) is not Num or index.bottom != 1 or index.sign < 0
+                or index.top >= len(self.contents)):
+            raise_error("There's no entry {} in a deque of {}.".format(
+                index, len(self.contents)))
+        return index.top
+
+    def __getitem__(self, index):
+        return self.contents[self.position(index)]
+
+    def __setitem__(self, index, value):
+        self.contents[self.position(index)] = value
+
+    def __eq__(self, other):
+        if not isinstance(other, Deque):
+            return NotImplemented
+        return self.contents == other.contents
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __repr__(self):
+        return "deque[{}]".format(", ".join(map(repr, self.contents)))
+
+class Bitset:
+    """
+    Arrow's bitset datatype, made with "bitset[...]" (or "bitset[bit; n]"
+    for n copies of one bit): a fixed-length array of 0s and 1s, packed
+    eight to a byte.
+
+    Bits are read and written by indexing, like a List's entries, so
+    "b[i] ^= 1" flips one and "b[i] <=> b[j]" swaps two. count and toggle
+    work on the whole buffer at once.
+    """
+
+    __slots__ = ("bits", "size")
+
+    def __init__(self, entries):
+        """
+        Takes a Python list of Nums, each 0 or 1.
+        """
+
+        self.size = len(entries)
+        self.bits = bytearray((self.size + 7) // 8)
+        for i, entry in enumerate(entries):
+            if Bitset.bit(entry):
+                self.bits[i >> 3] |= 1 << (i & 7)
+
+    @staticmethod
+    def bit(value):
+        """
+        Returns value (a Num) as a Python 0 or 1, if it's either.
+        """
+
+        if value.bottom != 1 or value.top > 1 or value.sign < 0:
+            raise_error("A bit can't be {}.".format(value))
+        return value.top
+
+    def position(self, index):
+        """
+        Returns index (a Num) as a Python int, if there's a bit there.
+        """
+
+        i = index.top
+        if index.bottom != 1 or index.sign < 0 or i >= self.size:
+            raise_error("There's no bit {} in a bitset of {}.".format(
+                index, self.size))
+        return i
+
+    @BuiltinMethod([], [])
+    def count(self, table):
+        # How many bits are 1.
+        return integer(int.from_bytes(self.bits, "little").bit_count())
+
+    @BuiltinMethod([], ["start", "stop", "step"])
+    def toggle(self, table):
+        # Flips bits start, start + step, ... up to (not including) stop,
+        # all at once, by XORing the bytes they're in with a mask. (Its
+        # own inverse.)
+        start, stop, step = table["start"], table["stop"], table["step"]
+        if step.bottom != 1 or step.sign < 0 or not step.top:
+            raise_error("Can't toggle every {}th bit.".format(step))
+        if start.bottom != 1 or stop.bottom != 1:
+            raise_error("Can't toggle from bit {} to {}.".format(start, stop))
+
+        start, stop, step = (
+            start.top * start.sign, stop.top * stop.sign, step.top)
+        if start >= stop:
+            return
+        self.position(integer(start))
+        self.position(integer(stop - 1))
+
+        if step > 128:
+            # Few enough bits that flipping them one by one is quicker.
+            bits = self.bits
+            for i in range(start, stop, step):
+                bits[i >> 3] ^= 1 << (i & 7)
+            return
+
+        last = stop - 1 - (stop - 1 - start) % step
+        lo, hi = start >> 3, (last >> 3) + 1
+
+        # Eight steps' worth of bits fit in step bytes exactly, so
+        # repeating those bytes (counting from byte lo) gives every step'th
+        # bit; the bits outside start...last are then cleared.
+        period = 8 * step
+        pattern = sum(
+            1 << ((start - 8 * lo + k * step) % period) for k in range(8))
+        mask = bytearray(
+            pattern.to_bytes(step, "little") * ((hi - lo) // step + 1))
+        del mask[hi - lo:]
+        mask[0] &= 0xff << (start & 7) & 0xff
+        mask[-1] &= 0xff >> (7 - (last & 7))
+
+        chunk = (int.from_bytes(self.bits[lo:hi], "little")
+            ^ int.from_bytes(mask, "little"))
+        self.bits[lo:hi] = chunk.to_bytes(hi - lo, "little")
+
+    @BuiltinMethod([], [])
+    def len(self, table):
+        return integer(self.size)
+
+    def __getitem__(self, index):
+        i = self.position(index)
+        return small_ints[SMALL_INTS + ((self.bits[i >> 3] >> (i & 7)) & 1)]
+
+    def __setitem__(self, index, value):
+        i = self.position(index)
+        if Bitset.bit(value):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        else:
+            self.bits[i >> 3] &= ~(1 << (i & 7))
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitset):
+            return NotImplemented
+        return self.size == other.size and self.bits == other.bits
+
+    def __iter__(self):
+        return map(self.__getitem__, map(integer, range(self.size)))
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "bitset[{}]".format(", ".join(map(repr, self)))
+
+def fill_bitset(value, count):
+    """
+    Returns a Bitset of count bits, each value (0 or 1).
+    """
+
+    size = fill_size(count)
+    bitset = object.__new__(Bitset)
+    bitset.size = size
+    bitset.bits = bytearray((size + 7) // 8)
+
+    if Bitset.bit(value) and size:
+        # Every bit of every byte, except those past the end.
+        bitset.bits[:] = b"\xff" * len(bitset.bits)
+        bitset.bits[-1] >>= -size % 8
+    return bitset
+
+class Map:
+    """
+    Arrow's hash map datatype, made with "map[key: value, ...]". Keys are
+    Nums or Strings.
+
+    insert adds a key and its value, and delete (its inverse) takes them
+    out again. The value at a key can be read, changed and swapped by
+    indexing, like a List's entries. Inserting a key which is already
+    there, or deleting one with the wrong value, would lose a value for
+    good, so both are errors.
+    """
+
+    __slots__ = ("contents",)
+
+    def __init__(self, entries):
+        """
+        Takes a Python list of keys and values, alternating (as a map
+        literal's entries are).
+        """
+
+        self.contents = {}
+        for i in range(0, len(entries), 2):
+            self.contents[Map.key(entries[i])] = entries[i + 1]
+
+    @staticmethod
+    def key(value):
+        # Strings can change in place, so the map keeps its own copy.
+        return value.copy() if type(value) is String else value
+
+    @BuiltinMethod([], ["key", "value"], inverse="delete")
+    def insert(self, table):
+        key = table["key"]
+        if key in self.contents:
+            raise_error("{} is already in the map, with {}.".format(
+                key, self.contents[key]))
+
+        self.contents[Map.key(key)] = table["value"]
+
+    @BuiltinMethod([], ["key", "value"], inverse="insert")
+    def delete(self, table):
+        key, value = table["key"], table["value"]
+        if self[key] != value:
+            raise_error("{} is supposed to map to {}, but it maps to {}.".format(
+                key, value, self.contents[key]))
+
+        del self.contents[key]
+
+    @BuiltinMethod([], ["key"])
+    def has(self, table):
+        return Boolean(table["key"] in self.contents)
+
+    @BuiltinMethod([], [])
+    def len(self, table):
+        return integer(len(self.contents))
+
+    def __getitem__(self, key):
+        if key not in self.contents:
+            raise_error("{} isn't in the map.".format(key))
+        return self.contents[key]
+
+    def __setitem__(self, key, value):
+        # Only existing keys are indexed (insert adds new ones), so the
+        # map's own copy of the key stays.
+        if key not in self.contents:
+            raise_error("{} isn't in the map.".format(key))
+        self.contents[key] = value
+
+    def __eq__(self, other):
+        if not isinstance(other, Map):
+            return NotImplemented
+        return self.contents == other.contents
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __repr__(self):
+        return "map[{}]".format(", ".join(
+            "{!r}: {!r}".format(key, value)
+            for key, value in self.contents.items()))
 
 class Boolean:
     """
     Arrow's boolean datatype.
     """
 
+    __slots__ = ("bit",)
+
     def __init__(self, bit):
         self.bit = bit
 
@@ -308,65 +1082,154 @@ class Boolean:
 class String:
     """
     Arrow's string datatype.
+
+    The characters are kept in a Python list, chars, of which only those
+    from position start on are the string's; the ones before it are free
+    room for left_add. So adding or deleting characters at either end
+    costs only as much as the characters added or deleted (left_del just
+    moves start along, and the list is shortened once over half of it is
+    unused), and get is a plain list lookup. The string is only put
+    together into a Python str (str) to print, compare or hash it.
+
+    "+=" and "-=" change a string in place (__iadd__ and __isub__), while
+    "+" and "-" make a new one. A copy shares its original's chars until
+    one of the two is changed (shared is then set on both), so a string
+    given a new name (see unshared) is only copied out if it's changed.
     """
 
+    __slots__ = ("chars", "start", "shared")
+
     def __init__(self, python_str):
-        self.str = python_str
-
-        _len = self.len
-        _get = self.get
-        _left_add = self.left_add
-        _left_del = self.left_del
-        _to_int = self.to_int
-
-        self.len = BuiltinFunction("len", [], [], self.len, _len)
-        self.get = BuiltinFunction("get", [], ["index"], self.get, _get)
-        self.left_add = BuiltinFunction(
-            "left_add", [], ["other"], self.left_add, _left_del)
-        self.left_del = BuiltinFunction(
-            "left_del", [], ["other"], self.left_del, _left_add)
-        self.to_int = BuiltinFunction(
-            "to_int", [], [], self.to_int, _to_int)
+        self.chars = list(python_str)
+        self.start = 0
+        self.shared = False
+
+    @property
+    def str(self):
+        return "".join(self.chars[self.start:])
+
+    def copy(self):
+        self.shared = True
+        string = new_string(String)
+        string.chars = self.chars
+        string.start = self.start
+        string.shared = True
+        return string
+
+    def own(self):
+        """
+        Gives the string chars of its own, if they're shared with a copy,
+        before it's changed.
+        """
+
+        if self.shared:
+            self.chars = self.chars[self.start:]
+            self.start = 0
+            self.shared = False
 
+    @BuiltinMethod([], ["index"])
     def get(self, table):
         i = table["index"].top
-        return String(self.str[i])
+        string = new_string(String)
+        string.chars = [self.chars[self.start + i]]
+        string.start = 0
+        string.shared = False
+        return string
 
+    @BuiltinMethod([], [])
     def len(self, table):
-        return Num(len(self.str))
+        return integer(len(self.chars) - self.start)
 
+    @BuiltinMethod([], ["other"], inverse="left_del")
     def left_add(self, table):
-        self.str = table["other"].str + self.str
+        other = table["other"]
+        added = other.chars[other.start:]
+        n = len(added)
+        self.own()
+
+        if n > self.start:
+            # Make room at the front for at least as many characters as
+            # the string already has, so adding one at a time is cheap.
+            room = max(n, len(self.chars) - self.start, 8)
+            self.chars[:0] = [""] * room
+            self.start += room
 
+        self.start -= n
+        self.chars[self.start:self.start + n] = added
+
+    @BuiltinMethod([], ["other"], inverse="left_add")
     def left_del(self, table):
         other = table["other"]
-        if self.str[:len(other)] != other.str:
+        n = len(other)
+        if self.chars[self.start:self.start + n] != other.chars[other.start:]:
             print("ERRORED")
-        self.str = self.str[len(other):]
 
+        self.own()
+        self.start += n
+        if self.start > len(self.chars) // 2:
+            del self.chars[:self.start]
+            self.start = 0
+
+    @BuiltinMethod([], [])
     def to_int(self, table):
         return Num(int(self.str))
 
     def __eq__(self, other):
-        return Boolean(self.str == other.str)
+        try:
+            if len(self) != len(other):
+                return Boolean(False)
+            return Boolean(self.str == other.str)
+        except (AttributeError, TypeError):
+            return NotImplemented
 
     def __ne__(self, other):
-        return Boolean(self.str != other.str)
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return Boolean(not equal)
+
+    def __hash__(self):
+        # Strings can change in place, so only a copy which nothing else
+        # holds on to (like a memo key) should be used as a key.
+        return hash(self.str)
 
     def __add__(self, other):
-        return String(self.str + other.str)
+        return self.copy().__iadd__(other)
+
+    def __iadd__(self, other):
+        self.own()
+        self.chars.extend(other.chars[other.start:])
+        return self
 
     def __sub__(self, other):
-        if self.str[-len(other):] != other.str:
+        return self.copy().__isub__(other)
+
+    def __isub__(self, other):
+        n = len(other)
+        if n and self.chars[-n:] != other.chars[other.start:]:
             print("ERRORED")
-        return String(self.str[:-len(other)])
+        if n:
+            self.own()
+            del self.chars[max(self.start, len(self.chars) - n):]
+        return self
 
     def __len__(self):
-        return len(self.str)
+        return len(self.chars) - self.start
 
     def __repr__(self):
         return '"{}"'.format(self.str)
 
+# Makes a String without going through __init__ (see String.get).
+new_string = object.__new__
+
+def unshared(value):
+    """
+    Returns a value for a new variable or const parameter to hold: a copy,
+    if it's a String, since "+=" on one name mustn't change another's.
+    """
+
+    return value.copy() if type(value) is String else value
+
 if __name__ == "__main__":
     x = Num(-1)
     y = Num(1, 2)
@@ -1,5 +1,5 @@
 import operator
-import inverter, shared, datatypes
+import inverter, shared, datatypes, compiler, vm
 
 bin_ops = {
     "+": operator.add,
@@ -7,6 +7,7 @@ bin_ops = {
     "*": operator.mul,
     "/": operator.truediv,
     "%": operator.mod,
+    "^": operator.xor,
     ">": operator.gt,
     "<": operator.lt,
     ">=": operator.ge,
@@ -18,50 +19,120 @@ bin_ops = {
     "not": lambda x: not x
 }
 
+# The operators mod-ops use: "x += y" changes x in place if it can (Strings
+# can; Nums, having no in-place operators, are replaced by x + y).
+mod_ops = {
+    "+": operator.iadd,
+    "-": operator.isub,
+    "*": operator.imul,
+    "/": operator.itruediv,
+    "%": operator.imod,
+    "^": operator.ixor
+}
+
 # The node currently being evaluated. (used in error reporting)
 current_node = None
 
-class Memory():
+# The entry points of each function body, by block (see entry_points).
+entry_tables = {}
+
+class Scope:
     """
-    Stores variable names and values. One per scope.
+    The variables of one function (or of main), each of which is given a
+    fixed slot by the resolver when the program is loaded.
 
-    Essentially a wrapper around two dictionaries,
-    refs and consts, where consts is immutable.
+    Slot 0 is always 'result', followed by the ref parameters and then
+    the const parameters, in order.
+
+    A scope also keeps a pool of spare memory tables, so that calling a
+    function doesn't have to allocate a new one each time.
     """
 
-    def __init__(self, refs={}, consts={}):
-        self.refs = dict(refs)
-        self.consts = dict(consts)
+    def __init__(self, refs, consts):
+        self.slots = {}
+        self.names = []
+        self.consts = set(consts)
 
-    def update_refs(self, other):
-        for key in other.refs:
-            if key in self.refs:
-                self.refs[key] = other.refs[key]
+        # What a fresh memory table's values look like.
+        self.empty = ()
+        self.frames = []
 
-    def copy(self):
-        return Memory(self.refs, self.consts)
+        for name in ["result", *refs, *consts]:
+            self.slot(name)
 
-    def __contains__(self, key):
-        return key in self.refs or key in self.consts
+    def slot(self, name):
+        """
+        Returns a variable's slot, giving it one if it doesn't have one yet.
+        """
 
-    def __getitem__(self, name):
-        # Splits "x.foo.bar" into name = "x", after_dot = ["foo", "bar"]
-        name, *after_dot = name.split('.')
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.empty = (None,) * len(self.names)
+
+        return self.slots[name]
+
+    def frame(self):
+        """
+        Returns an empty memory table for this scope, reusing a spare one
+        if there is one.
+        """
+
+        if self.frames:
+            return self.frames.pop()
+        return Memory(self)
+
+    def release(self, frame):
+        """
+        Empties a memory table which is no longer in use, and keeps it
+        for the next call.
+        """
+
+        frame.values[:] = self.empty
+        frame.returning = False
+        self.frames.append(frame)
+
+    def __len__(self):
+        return len(self.names)
+
+class Memory():
+    """
+    Stores variable values. One per scope.
 
-        result = None
-        if name in self.refs:
-            result = self.refs[name]
-        elif name in self.consts:
-            result = self.consts[name]
+    values[i] is the value of the scope's variable in slot i, or None if
+    that variable doesn't currently exist. The evaluators use the slots
+    stored on the nodes; names work too, for builtins and for main.
 
-        # "x.foo.bar" will
-        # - get the variable x's attribute "foo"
-        # - get x.foo's attribute "bar"
-        # 
-        # If after_dot is empty, this loop won't run.
+    'returning' is set when an exit statement fires, and tells every
+    enclosing block and loop to stop.
+    """
 
-        for identifier in after_dot:
-            result = getattr(result, identifier)
+    def __init__(self, scope, values=None):
+        self.scope = scope
+        self.values = list(scope.empty) if values is None else values
+        self.returning = False
+
+    @property
+    def refs(self):
+        return {
+            name: value for name, value in zip(self.scope.names, self.values)
+            if value is not None and name not in self.scope.consts
+            }
+
+    @property
+    def consts(self):
+        return {
+            name: value for name, value in zip(self.scope.names, self.values)
+            if value is not None and name in self.scope.consts
+            }
+
+    def __contains__(self, name):
+        slot = self.scope.slots.get(name)
+        return slot is not None and self.values[slot] is not None
+
+    def __getitem__(self, name):
+        slot = self.scope.slots.get(name)
+        result = None if slot is None else self.values[slot]
 
         if result is not None:
             return result
@@ -74,31 +145,25 @@ class Memory():
                 )
 
     def __setitem__(self, name, value):
-        if name in self.consts:
-            # BROKEN
-            raise shared.ArrowException(
-                shared.Stages.evaluation,
-                "Modifying constant {} not allowed.".format(name),
-                current_node.token
-                )
-        else:
-            self.refs[name] = value
+        # Writes to constants are rejected when the program is loaded,
+        # by the resolver.
+        self.values[self.scope.slots[name]] = value
 
     def __delitem__(self, name):
-        if name in self.refs:
-            del self.refs[name]
-        elif name in consts.refs:
-            del consts.refs[name]
+        self.values[self.scope.slots[name]] = None
 
     def __repr__(self):
         return "refs: {}, consts: {}".format(self.refs, self.consts)
 
-def expr_eval(node, table=Memory()):
+def expr_eval(node, table=None):
     """
-    Evaluates expression nodes.
-    Returns a data value (right now, always a number).
+    Evaluates expression nodes, against an empty memory table if none is
+    given. Returns a data value (right now, always a number).
     """
 
+    if table is None:
+        table = Memory(Scope([], []))
+
     if node.kind == "BIN_OP":
         # Evaluate both sides, then return (left <op> right).
         left = expr_eval(node.left, table)
@@ -112,46 +177,64 @@ def expr_eval(node, table=Memory()):
         return node.number
 
     elif node.kind == "STRING":
-        return node.string
+        # Strings can change in place, so each use gets its own copy.
+        return node.string.copy()
 
     elif node.kind == "VAR_REF":
-        return table[node.name]
+        return table.values[node.slot]
 
     elif node.kind == "ARRAY_REF":
         # TODO: This code belongs in the Array datatype.
 
         # Fetch the array.
-        array = table[node.name]
+        array = table.values[node.slot]
         # Compute the index (a Num object).
         index = expr_eval(node.expr, table)
 
         return array[index]
 
     elif node.kind == "FUNCTION_CALL":
-        # Get the function/method object.
-        # If the ID contains dots, it's a method.
-        if "." in node.name:
-            function = table[node.name]
-        else:
-            function = shared.program.functions[node.name]
+        return call_eval(node, table)
 
-        updated, result = function.evaluate(
-            node.backwards,
-            node.ref_args,
-            [expr_eval(arg, table) for arg in node.ref_args],
-            [expr_eval(arg, table) for arg in node.const_args]
-        )
+    elif node.kind == "ARRAY_EXPR":
+        # Evaluate the expressions in order and create a list (or whichever
+        # datatype the literal was for).
+        return node.datatype(
+            [expr_eval(entry, table) for entry in node.entries])
 
-        # After evaluating the function, the updated table will
-        # contain changed variables and a final result.
-        table.update_refs(updated)
+    elif node.kind == "ARRAY_FILL":
+        return node.fill(
+            expr_eval(node.value, table), expr_eval(node.count, table))
 
-        return result
+    elif node.kind == "ARRAY_RANGE":
+        return datatypes.range_list(
+            expr_eval(node.start, table), expr_eval(node.stop, table))
 
-    elif node.kind == "ARRAY_EXPR":
-        # Evaluate the expressions in order and create a list.
-        return datatypes.List(
-            [expr_eval(entry, table) for entry in node.entries])
+def call_eval(node, table):
+    """
+    Evaluates function call nodes, both as expressions and as statements.
+    Returns the function's result.
+    """
+
+    values = table.values
+
+    # Get the function/method object.
+    # If the call had dots in it ("x.push"), it's a method.
+    if node.attrs:
+        function = values[node.slot]
+        for attr in node.attrs:
+            function = getattr(function, attr)
+    else:
+        function = shared.program.functions[node.name]
+
+    # Ref args are always plain variables (the resolver makes sure),
+    # which the function reads and writes in place.
+    return function.call(
+        node.backwards,
+        values,
+        node.ref_slots,
+        [expr_eval(arg, table) for arg in node.const_args]
+    )
 
 def mod_op_eval(node, table):
     """
@@ -162,16 +245,16 @@ def mod_op_eval(node, table):
 
     if node.var.kind == "ARRAY_REF":
         # TODO: Refactor to use the Array object's fetch.
-        array = table[node.var.name]
+        array = table.values[node.var.slot]
         index = expr_eval(node.var.expr, table)
 
         # A[x] += 1 expands into A[x] = A[x] + 1.
-        array[index] = bin_ops[node.op](array[index], expr_value)
+        array[index] = mod_ops[node.op](array[index], expr_value)
 
     elif node.var.kind == "VAR_REF":
         # x += 1 expands into x = x + 1.
-        old_value = table[node.var.name]
-        table[node.var.name] = bin_ops[node.op](old_value, expr_value)
+        slot = node.var.slot
+        table.values[slot] = mod_ops[node.op](table.values[slot], expr_value)
 
     return table
 
@@ -180,29 +263,30 @@ def swap_op_eval(node, table):
     Evaluates swap-op nodes. Returns a memory table.
     """
     # TODO: This is a mess. Array object simplification?
+    values = table.values
 
     if node.left.kind == "VAR_REF" and node.right.kind == "VAR_REF":
 
-        l, r = node.left.name, node.right.name
-        table[l], table[r] = table[r], table[l]
+        l, r = node.left.slot, node.right.slot
+        values[l], values[r] = values[r], values[l]
 
     if node.left.kind == "ARRAY_REF" and node.right.kind == "VAR_REF":
 
-        l_array, r = table[node.left.name], node.right.name
+        l_array, r = values[node.left.slot], node.right.slot
         l_index = expr_eval(node.left.expr, table)
 
-        l_array[l_index], table[r] = table[r], l_array[l_index]
+        l_array[l_index], values[r] = values[r], l_array[l_index]
 
     if node.left.kind == "VAR_REF" and node.right.kind == "ARRAY_REF":
 
-        l, r_array = node.left.name, table[node.right.name]
+        l, r_array = node.left.slot, values[node.right.slot]
         r_index = expr_eval(node.right.expr, table)
 
-        table[l], r_array[r_index] = r_array[r_index], table[l]
+        values[l], r_array[r_index] = r_array[r_index], values[l]
 
     if node.left.kind == "ARRAY_REF" and node.right.kind == "ARRAY_REF":
 
-        L, R = left_array, right_array = table[node.left.name], table[node.right.name]
+        L, R = left_array, right_array = values[node.left.slot], values[node.right.slot]
         i = left_index = expr_eval(node.left.expr, table)
         j = right_index = expr_eval(node.right.expr, table)
 
@@ -216,15 +300,15 @@ def var_condition_eval(node, table):
     Returns a memory table.
     """
 
-    if table.refs[node.name] == expr_eval(node.expr, table):
-        del table.refs[node.name]
+    if table.values[node.slot] == expr_eval(node.expr, table):
+        table.values[node.slot] = None
     else:
         # TODO: An error, not just a warning, should be thrown here.
         print(
             node.name, "is supposed to be",
             expr_eval(node.expr, table),
             "but it's actually",
-            table.refs[node.name]
+            table.values[node.slot]
             )
 
     return table
@@ -250,32 +334,17 @@ def statement_eval(node, table):
             table = block_eval(block_node, table)
 
             # Break if the end condition is satisfied.
-            if expr_eval(node.end_condition, table):
+            if table.returning or expr_eval(node.end_condition, table):
                 break
 
     elif node.kind == "FOR_LOOP":
         var_dec = node.var_declaration
-        until_node = node.end_condition
-        increment_node = node.increment_statement
 
         # Initialize the variable.
-        table[var_dec.name] = expr_eval(var_dec.expr, table)
+        table.values[var_dec.slot] = datatypes.unshared(
+            expr_eval(var_dec.expr, table))
 
-        while True:
-            # Execute the block and increment statement.
-            if not node.inc_at_end:
-                table = mod_op_eval(increment_node, table)
-            
-            table = block_eval(node.block, table)
-
-            if node.inc_at_end:
-                table = mod_op_eval(increment_node, table)
-
-            # Break if the end condition is satisfied.
-            if table.refs[until_node.name] == expr_eval(until_node.expr, table):
-                break
-
-        table = var_condition_eval(until_node, table)
+        table = for_loop_eval(node, table)
 
     elif node.kind == "IF":
         # Check the condition; if it fails, execute the
@@ -283,7 +352,7 @@ def statement_eval(node, table):
 
         if expr_eval(node.condition, table):
             table = block_eval(node.true, table)
-        elif "false" in node.data:
+        elif node.false is not None:
             table = block_eval(node.false, table)
 
     elif node.kind == "DO/UNDO":
@@ -291,17 +360,19 @@ def statement_eval(node, table):
         # then undo the action block.
         table = block_eval(node.action_block, table)
 
-        if "yielding_block" in node.data:
+        if node.yielding_block is not None and not table.returning:
             table = block_eval(node.yielding_block, table)
 
-        table = block_eval(inverter.unblock(node.action_block), table)
+        if not table.returning:
+            table = block_eval(inverter.unblock(node.action_block), table)
 
     elif node.kind == "RESULT":
         # Overwrites the variable 'result' with the given expression.
         table["result"] = expr_eval(node.expr, table)
 
     elif node.kind == "VAR_DEC":
-        table[node.name] = expr_eval(node.expr, table)
+        # A String declared from another variable gets its own copy.
+        table.values[node.slot] = datatypes.unshared(expr_eval(node.expr, table))
 
     elif node.kind == "VAR_CONDITION":
         table = var_condition_eval(node, table)
@@ -310,34 +381,19 @@ def statement_eval(node, table):
         table = block_eval(node, table)
 
     elif node.kind == "FUNCTION_CALL":
-        # Get the function/method object.
-        # If the ID contains dots, it's a method.
-
-        if "." in node.name:
-            function = table[node.name]
-        else:
-            function = shared.program.functions[node.name]
-
-        # Call the function, then update table with the results.
-        updated, _ = function.evaluate(
-            node.backwards,
-            node.ref_args,
-            [expr_eval(arg, table) for arg in node.ref_args],
-            [expr_eval(arg, table) for arg in node.const_args]
-        )
-
-        # After evaluating the function, the updated table will
-        # contain changed variables.
-        table.update_refs(updated)
+        call_eval(node, table)
 
     elif node.kind == "UN":
+        # The inverted statement is run by the plain statement_eval, not
+        # one which hooks or the profiler put in its place: they've seen
+        # this statement already, as the UN.
         inverted_node = inverter.unstatement(node.statement)
-        table = statement_eval(inverted_node, table)
+        table = plain_statement_eval(inverted_node, table)
 
     elif node.kind == "EXIT":
         if expr_eval(node.condition, table):
-            # We return by raising an exception.
-            raise shared.ReturnException()
+            # Flag the return; the enclosing blocks stop when they see it.
+            table.returning = True
 
     elif node.kind == "ENTER":
         # Do nothing when we actually encounter these.
@@ -345,13 +401,142 @@ def statement_eval(node, table):
 
     return table
 
-def block_eval(node, table=Memory()):
+plain_statement_eval = statement_eval
+
+def for_loop_eval(node, table):
+    """
+    Runs a for loop whose variable has been initialized, until its end
+    condition holds. Returns a memory table.
+    """
+
+    until_node = node.end_condition
+    increment_node = node.increment_statement
+
+    while True:
+        # Execute the block and increment statement.
+        if not node.inc_at_end:
+            table = mod_op_eval(increment_node, table)
+
+        table = block_eval(node.block, table)
+        if table.returning:
+            return table
+
+        if node.inc_at_end:
+            table = mod_op_eval(increment_node, table)
+
+        # Break if the end condition is satisfied.
+        if table.values[until_node.slot] == expr_eval(until_node.expr, table):
+            break
+
+    return var_condition_eval(until_node, table)
+
+def block_eval(node, table=None):
     """
-    Evaluates blocks. Returns a memory table.
+    Evaluates blocks, against an empty memory table if none is given.
+    Returns a memory table.
     """
 
+    if table is None:
+        table = Memory(Scope([], []))
+
     for statement in node.statements:
         table = statement_eval(statement, table)
+        if table.returning:
+            break
+    return table
+
+def sub_blocks(node):
+    """
+    Returns the blocks nested directly inside a statement, which execution
+    can resume inside of. (For loops can't be resumed inside of; the
+    resolver rejects enter statements in them.)
+    """
+
+    if node.kind == "IF":
+        return [node.true] if node.false is None else [node.true, node.false]
+    elif node.kind == "FROM_LOOP":
+        return [node.block]
+    elif node.kind == "DO/UNDO":
+        # The undo half runs too, so it counts.
+        blocks = [node.action_block, inverter.unblock(node.action_block)]
+        if node.yielding_block is not None:
+            blocks.insert(1, node.yielding_block)
+        return blocks
+    elif node.kind == "BLOCK":
+        return [node]
+    return []
+
+def entry_points(block):
+    """
+    Finds a function body's enter statements, however deeply nested, once
+    per body. Returns a list of (enter node, path) pairs in the order their
+    conditions are checked: from the bottom up.
+
+    A path is a tuple of (statement index, sub-block) steps leading from
+    block down to the enter statement, whose own step has no sub-block
+    (see resume_block).
+    """
+
+    if block in entry_tables:
+        return entry_tables[block]
+
+    entries = []
+
+    def search(node, path):
+        for i, statement in enumerate(node.statements):
+            if statement.kind == "ENTER":
+                entries.append((statement, path + ((i, None),)))
+            for sub_block in sub_blocks(statement):
+                search(sub_block, path + ((i, sub_block),))
+
+    search(block, ())
+    entries.reverse()
+
+    entry_tables[block] = entries
+    return entries
+
+def resume_block(node, path, table):
+    """
+    Evaluates a block from partway through, as if execution had just
+    passed the enter statement at the end of path (see entry_points).
+    Returns a memory table.
+    """
+
+    (i, sub_block), rest = path[0], path[1:]
+
+    if sub_block is not None:
+        table = resume_statement(node.statements[i], sub_block, rest, table)
+
+    for statement in node.statements[i + 1:]:
+        if table.returning:
+            break
+        table = statement_eval(statement, table)
+
+    return table
+
+def resume_statement(node, sub_block, path, table):
+    """
+    Evaluates the rest of a statement, starting partway through one of its
+    blocks. Returns a memory table.
+    """
+
+    table = resume_block(sub_block, path, table)
+    if table.returning:
+        return table
+
+    if node.kind == "FROM_LOOP":
+        if not expr_eval(node.end_condition, table):
+            table = statement_eval(node, table)
+
+    elif node.kind == "DO/UNDO":
+        undo_block = inverter.unblock(node.action_block)
+
+        if sub_block is node.action_block and node.yielding_block is not None:
+            table = block_eval(node.yielding_block, table)
+
+        if sub_block is not undo_block and not table.returning:
+            table = block_eval(undo_block, table)
+
     return table
 
 def program_eval(node):
@@ -360,5 +545,20 @@ def program_eval(node):
     Returns a memory table of the main variables.
     """
 
-    table = Memory(node.main_vars)
-    return block_eval(node.main.block, table)
\ No newline at end of file
+    if shared.engine == "closure":
+        return compiler.program_eval(node)
+    elif shared.engine == "vm":
+        return vm.program_eval(node)
+
+    return block_eval(node.main.block, main_memory(node))
+
+def main_memory(node):
+    """
+    Returns a memory table for main, holding the main vars.
+    """
+
+    table = Memory(node.main.scope)
+    for name, value in node.main_vars.items():
+        table[name] = value
+
+    return table
\ No newline at end of file
@@ -0,0 +1,205 @@
+import argparse, contextlib, copy, functools, io, multiprocessing, os, random
+import signal, time
+import cache, evaluator, inverter, shared, datatypes
+
+#
+# Checks that running a program's main forwards and then backwards gives
+# back the main vars it started with, for many randomly generated main
+# vars, spread over a pool of worker processes.
+#
+
+class Timeout(Exception):
+    pass
+
+def generate(default, rng):
+    """
+    Returns a random value shaped like a main var's default value:
+      -- integers of the same sign, up to about twice as big;
+      -- rationals with small denominators;
+      -- strings of the same characters, up to twice as long;
+      -- lists and deques of the same length (programs often depend on
+         it), with each entry generated from the default's entry;
+      -- maps with the same keys, each value generated from the default's;
+      -- bitsets of the same length, with random bits.
+    """
+
+    if isinstance(default, datatypes.Num):
+        bound = max(10, 2 * default.top // default.bottom)
+
+        if default.bottom == 1:
+            return datatypes.Num(rng.randint(0, bound) * default.sign)
+
+        bottom = rng.randint(1, 20)
+        return datatypes.Num(
+            rng.randint(0, bound * bottom) * default.sign, bottom)
+
+    elif isinstance(default, datatypes.String):
+        chars = sorted(set(default.str)) or ["a"]
+        length = rng.randint(1, max(1, 2 * len(default.str)))
+        return datatypes.String(
+            "".join(rng.choice(chars) for _ in range(length)))
+
+    elif isinstance(default, (datatypes.List, datatypes.Deque)):
+        return type(default)(
+            [generate(entry, rng) for entry in default])
+
+    elif isinstance(default, datatypes.Bitset):
+        return datatypes.Bitset(
+            [datatypes.Num(rng.randint(0, 1)) for _ in range(len(default))])
+
+    elif isinstance(default, datatypes.Map):
+        entries = []
+        for key, value in default.contents.items():
+            entries += [key, generate(value, rng)]
+        return datatypes.Map(entries)
+
+    return default
+
+def inputs(defaults, names, count, seed):
+    """
+    Yields count sets of main vars, with those in names generated and the
+    rest left at their defaults. Each set is generated from its own seed,
+    so that any one can be generated again.
+    """
+
+    for i in range(count):
+        rng = random.Random("{}-{}".format(seed, i))
+        yield i, {
+            name: generate(value, rng) if name in names else copy.deepcopy(value)
+            for name, value in defaults.items()
+            }
+
+# Each worker's copy of the program, and main's block in each direction.
+program = None
+blocks = None
+
+def start_worker(filename, engine, memo_size):
+    global program, blocks
+
+    shared.engine = engine
+    shared.memo_size = memo_size
+    program = cache.load(filename)
+    blocks = program.main.block, inverter.unblock(program.main.block)
+
+    signal.signal(signal.SIGALRM, time_out)
+
+def time_out(signum, frame):
+    raise Timeout()
+
+def check(timeout, task):
+    """
+    Runs main forwards and then backwards on one set of main vars (task
+    holds its number and the vars), for at most timeout seconds.
+    Returns (its number, the outcome, the main vars as they started, as
+    they ended up, and anything printed along the way). The outcome is
+    "ok", "mismatch" (the vars weren't restored), "warning" (a
+    var-condition didn't hold), "error" or "timeout".
+    """
+
+    i, main_vars = task
+    before = {name: repr(value) for name, value in main_vars.items()}
+    after = None
+    printed = io.StringIO()
+
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with contextlib.redirect_stdout(printed):
+            program.main_vars = main_vars
+            for block in blocks:
+                program.main.block = block
+                program.main_vars.update(evaluator.program_eval(program).refs)
+
+        after = {name: repr(value) for name, value in program.main_vars.items()}
+        if after != before:
+            outcome = "mismatch"
+        elif printed.getvalue():
+            outcome = "warning"
+        else:
+            outcome = "ok"
+
+    except Timeout:
+        outcome = "timeout"
+    except (shared.ArrowException, ArithmeticError, LookupError, TypeError,
+        AttributeError, ValueError, RecursionError) as e:
+        outcome = "error"
+        printed.write(getattr(e, "message", None) or repr(e))
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        program.main.block = blocks[0]
+
+    return i, outcome, before, after, printed.getvalue()
+
+def fuzz(filename, names, count, seed, workers, timeout, show):
+    """
+    Checks count generated inputs (see inputs) across workers processes,
+    and prints how many of each outcome there were, along with the first
+    few inputs which went wrong. Returns the number of mismatches and
+    warnings.
+    """
+
+    defaults = cache.load(filename).main_vars
+    totals = dict.fromkeys(["ok", "mismatch", "warning", "error", "timeout"], 0)
+    shown = 0
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, start_worker,
+        (filename, shared.engine, shared.memo_size)) as pool:
+
+        tasks = inputs(defaults, names or defaults.keys(), count, seed)
+        chunksize = max(1, min(64, count // (workers * 8)))
+
+        for i, outcome, before, after, printed in pool.imap_unordered(
+            functools.partial(check, timeout), tasks, chunksize):
+
+            totals[outcome] += 1
+            if outcome != "ok" and outcome != "timeout" and shown < show:
+                shown += 1
+                print("input {} ({}):".format(i, outcome))
+                print("    before: {}".format(before))
+                if after is not None:
+                    print("    after:  {}".format(after))
+                for line in printed.splitlines():
+                    print("    " + line)
+
+    elapsed = time.perf_counter() - start
+
+    print("{} inputs in {:.2f} s ({:.0f}/s) on {} workers: {}".format(
+        count, elapsed, count / elapsed, workers,
+        ", ".join("{} {}".format(n, outcome) for outcome, n in totals.items())))
+    return totals["mismatch"] + totals["warning"]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Check that an Arrow program's main undoes itself on "
+        "random main vars.")
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--inputs", type=int, default=1000,
+        help="how many sets of main vars to try")
+    arg_parser.add_argument("--vars", nargs="+", metavar="NAME",
+        help="the main vars to generate (by default, all of them); the rest "
+        "keep their values from the program")
+    arg_parser.add_argument("--seed", default="0",
+        help="what the inputs are generated from")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+        help="how many processes to run (by default, one per core)")
+    arg_parser.add_argument("--timeout", type=float, default=1,
+        help="how many seconds an input may run for; random inputs can "
+        "easily make a loop run forever")
+    arg_parser.add_argument("--show", type=int, default=10,
+        help="how many failing inputs to print")
+    arg_parser.add_argument("--engine", choices=["tree", "closure", "vm"],
+        default="tree")
+    arg_parser.add_argument("--memo-size", type=int, default=shared.memo_size)
+    args = arg_parser.parse_args()
+
+    shared.engine = args.engine
+    shared.memo_size = args.memo_size
+
+    try:
+        failures = fuzz(args.filename, args.vars, args.inputs, args.seed,
+            args.workers, args.timeout, args.show)
+    except shared.ArrowException as e:
+        print(e.message)
+        exit(1)
+
+    exit(1 if failures else 0)
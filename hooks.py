@@ -0,0 +1,161 @@
+import evaluator, datatypes
+
+#
+# Hooks let outside tools (tracers, metering, coverage) watch the
+# tree-walker run a program:
+#
+#   on_statement(node, backwards, table)
+#       before each statement, with the memory table it runs against (the
+#       statement inside an un(: ... :) is only seen as the UN);
+#   on_call(function, backwards, table)
+#       before each function runs, with its own table, arguments bound;
+#   on_return(function, backwards, table, result)
+#       after each function runs, before its ref parameters go back.
+#
+# 'backwards' is the direction of the function being run. Builtin methods
+# count as functions too.
+#
+# While no hooks are registered, the evaluator is the plain one. Registering
+# the first hook swaps in instrumented versions of evaluator.statement_eval
+# and of Function's and BuiltinFunction's execute methods, and removing the
+# last one swaps the plain ones back, so nothing is checked per statement
+# when hooks aren't in use.
+#
+# Only the tree-walker calls hooks; the closure and bytecode engines don't
+# go through statement_eval or execute.
+#
+
+statement_hooks = []
+call_hooks = []
+return_hooks = []
+
+# The plain functions, while the instrumented ones are installed.
+plain = None
+
+# The direction of each function being run, innermost last. The bottom
+# one is main's (see program_eval).
+directions = [False]
+
+def on_statement(hook):
+    """
+    Registers a hook to be called before each statement.
+    Returns the hook, so this can be used as a decorator.
+    """
+
+    return register(statement_hooks, hook)
+
+def on_call(hook):
+    """
+    Registers a hook to be called before each function runs.
+    """
+
+    return register(call_hooks, hook)
+
+def on_return(hook):
+    """
+    Registers a hook to be called after each function runs.
+    """
+
+    return register(return_hooks, hook)
+
+def register(hooks, hook):
+    hooks.append(hook)
+    install()
+    return hook
+
+def remove(hook):
+    """
+    Unregisters a hook, wherever it was registered.
+    """
+
+    for hooks in (statement_hooks, call_hooks, return_hooks):
+        while hook in hooks:
+            hooks.remove(hook)
+
+    if not (statement_hooks or call_hooks or return_hooks):
+        uninstall()
+
+def clear():
+    """
+    Unregisters every hook.
+    """
+
+    del statement_hooks[:], call_hooks[:], return_hooks[:]
+    uninstall()
+
+def install():
+    global plain
+    if plain is not None:
+        return
+
+    plain = (evaluator.statement_eval,
+        datatypes.Function.execute, datatypes.BuiltinFunction.execute)
+
+    evaluator.statement_eval = hooked_statement_eval
+    datatypes.Function.execute = hooked(plain[1])
+    datatypes.BuiltinFunction.execute = hooked(plain[2])
+
+def uninstall():
+    global plain
+    if plain is None:
+        return
+
+    (evaluator.statement_eval,
+        datatypes.Function.execute, datatypes.BuiltinFunction.execute) = plain
+    plain = None
+
+def hooked_statement_eval(node, table):
+    backwards = directions[-1]
+    for hook in statement_hooks:
+        hook(node, backwards, table)
+
+    return plain[0](node, table)
+
+def hooked(execute):
+    """
+    Returns a version of a function class's execute method which calls the
+    call and return hooks around it.
+    """
+
+    def hooked_execute(function, backwards, table):
+        for hook in call_hooks:
+            hook(function, backwards, table)
+
+        directions.append(backwards)
+        try:
+            result = execute(function, backwards, table)
+        finally:
+            directions.pop()
+
+        for hook in return_hooks:
+            hook(function, backwards, table, result)
+
+        return result
+
+    return hooked_execute
+
+def program_eval(program, backwards=False):
+    """
+    Runs the program on the tree-walker, like evaluator.program_eval with
+    shared.engine set to "tree", but tells the hooks which direction its
+    main block (given by backwards) runs in, and calls the call and return
+    hooks for main too.
+    Returns a memory table of the main variables.
+    """
+
+    table = evaluator.main_memory(program)
+    main = program.main
+
+    for hook in call_hooks:
+        hook(main, backwards, table)
+
+    directions.append(backwards)
+    try:
+        table = evaluator.block_eval(main.block, table)
+    finally:
+        directions.pop()
+
+    for hook in return_hooks:
+        hook(main, backwards, table, None)
+
+    return table
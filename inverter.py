@@ -1,12 +1,34 @@
+import functools
 import shared, parser, datatypes
 
 op_inverses = {
     "+": "-",
     "-": "+",
     "*": "/",
-    "/": "*"
+    "/": "*",
+    "^": "^"
 }
 
+def memoized(invert):
+    """
+    Makes an inversion function remember its result on the node, so each
+    node is inverted at most once. The inverse remembers the original too,
+    so inverting twice gives back the very same node.
+    """
+
+    @functools.wraps(invert)
+    def wrapper(node):
+        if node.inverse is None:
+            inverse = invert(node)
+            node.inverse = inverse
+            if inverse.inverse is None:
+                inverse.inverse = node
+
+        return node.inverse
+
+    return wrapper
+
+@memoized
 def unexpression(node):
     if node.kind == "FUNCTION_CALL":
         return node.replace(backwards= not (node.backwards))
@@ -36,7 +58,24 @@ def unexpression(node):
         return node.replace(
             entries=[unexpression(entry) for entry in node.entries])
 
+    elif node.kind == "ARRAY_FILL":
+        return node.replace(
+            value=unexpression(node.value), count=unexpression(node.count))
+
+    elif node.kind == "ARRAY_RANGE":
+        return node.replace(
+            start=unexpression(node.start), stop=unexpression(node.stop))
+
 def unstatement(node):
+    # un(: s :) is inverted by running s itself. This doesn't go through
+    # the cache, since s's own inverse is un-s, not the UN node.
+    if node.kind == "UN":
+        return node.statement
+
+    return invert_statement(node)
+
+@memoized
+def invert_statement(node):
     if node.kind == "MOD_OP":
         return node.replace(
             op=op_inverses[node.op],
@@ -63,17 +102,13 @@ def unstatement(node):
         return unblock(node)
 
     elif node.kind == "VAR_DEC":
-        return parser.ParseNode("VAR_CONDITION",
-            name=node.name, expr=node.expr
-            )
+        return node.replace("VAR_CONDITION")
 
     elif node.kind == "VAR_CONDITION":
-        return parser.ParseNode("VAR_DEC",
-            name=node.name, expr=node.expr
-            )
+        return node.replace("VAR_DEC")
 
     elif node.kind == "IF":
-        if "false" in node.data:
+        if node.false is not None:
             return node.replace(
                 condition=node.result,
                 true=unblock(node.true),
@@ -88,13 +123,13 @@ def unstatement(node):
                 )
 
     elif node.kind == "DO/UNDO":
-        if "yielding_block" in node.data:
-            return parser.ParseNode("DO/UNDO",
+        if node.yielding_block is not None:
+            return parser.ParseNode("DO/UNDO", node.token,
                 action_block=node.action_block,
                 yielding_block=unblock(node.yielding_block)
                 )
         else:
-            return parser.ParseNode("DO/UNDO",
+            return parser.ParseNode("DO/UNDO", node.token,
                 action_block=node.action_block
                 )
 
@@ -110,17 +145,12 @@ def unstatement(node):
     elif node.kind in ("SWAP_OP", "RESULT"):
         return node
 
-    elif node.kind == "UN":
-        return node.statement
-
+@memoized
 def unblock(node):
-    inverted = parser.ParseNode("BLOCK")
-    inverted.statements = (
-        [unstatement(s) for s in reversed(node.statements)]
+    return parser.ParseNode("BLOCK", node.token,
+        statements=[unstatement(s) for s in reversed(node.statements)]
         )
 
-    return inverted
-
 def unfunction(f):
     return datatypes.Function(
         f.name,
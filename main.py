@@ -1,10 +1,17 @@
-import scanner, parser, sys, evaluator, inverter, shared
+import scanner, parser, sys, argparse, contextlib, json, time
+import evaluator, inverter, shared, bytecode, cache, batch, profiler
+
+# Whether to use ANSI colors (batch runs don't).
+use_color = True
 
 def colorize(s, desired_color):
     """
     Wraps string s in the appropriate ANSI color codes.
     """
-    
+
+    if not use_color:
+        return s
+
     termcolors = {
     "PURPLE" : '\033[95m',
     "BLUE" : '\033[94m',
@@ -27,11 +34,55 @@ def print_state(program_node):
     for var, value in program_node.main_vars.items():
         print("{} --> {}".format(var, value))
 
+def run_batch(program, mode, round_trips, profile=None):
+    """
+    Runs main forwards, backwards, or forwards and backwards round_trips
+    times, without stopping in between, under the given Profiler if there
+    is one. Returns a list of the phases run, each with how long it took.
+    """
+
+    directions = {
+        "forward": [False],
+        "backward": [True],
+        "roundtrip": [False, True] * round_trips,
+        }[mode]
+
+    forward_block = program.main.block
+    backward_block = inverter.unblock(forward_block)
+
+    phases = []
+    for backwards in directions:
+        program.main.block = backward_block if backwards else forward_block
+
+        start = time.perf_counter()
+        if profile is None:
+            result = evaluator.program_eval(program)
+        else:
+            result = profile.run(program, backwards)
+        elapsed = time.perf_counter() - start
+
+        program.main_vars.update(result.refs)
+        phases.append({
+            "direction": "backward" if backwards else "forward",
+            "ms": elapsed * 1000,
+            })
+
+    program.main.block = forward_block
+    return phases
+
 def handle_errors(e):
     """
     Takes an exception, prints an appropriate message and exits the program.
     """
 
+    if e.token is None:
+        # Raised by a datatype, which doesn't know where in the code it is.
+        print("Error occurred in file '{}' during {}.".format(
+            filename, e.stage.name))
+        print()
+        print(e.message)
+        exit(1)
+
     # Prints a 'window' around the code we're interested in.
     line_num, char_num = e.token.line_num, e.token.char_num
     prev_line_num, next_line_num = line_num - 1, line_num + 1
@@ -67,14 +118,104 @@ def handle_errors(e):
     exit(1)
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Run an Arrow program, alternating forwards and backwards.")
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--engine", choices=["tree", "closure", "vm"],
+        default="tree",
+        help="walk the syntax tree directly, compile it to closures first, "
+        "or compile it to bytecode and run it on the VM")
+    arg_parser.add_argument("--memo-size", type=int, default=shared.memo_size,
+        help="how many results each pure function remembers (0 turns "
+        "memoization off)")
+    arg_parser.add_argument("--no-cache", action="store_true",
+        help="always parse the file, rather than loading it from the cache")
+    arg_parser.add_argument("--cache-dir",
+        help="where to cache parsed programs (by default, an __arrowcache__ "
+        "directory next to the file)")
+    arg_parser.add_argument("--disassemble", action="store_true",
+        help="print the bytecode for every function in both directions and exit")
+    arg_parser.add_argument("--batch", choices=["forward", "backward", "roundtrip"],
+        help="run without prompting, then write the timings and final main "
+        "vars as JSON")
+    arg_parser.add_argument("--round-trips", type=int, default=1,
+        help="how many times --batch roundtrip runs forwards and backwards")
+    arg_parser.add_argument("--output",
+        help="where --batch writes its JSON (by default, stdout)")
+    arg_parser.add_argument("--profile", metavar="FILE",
+        help="profile a --batch run (forward, by default) on the tree-walker, "
+        "and write a report of the time spent in each function and "
+        "statement")
+    arg_parser.add_argument("--flamegraph", metavar="FILE",
+        help="profile a --batch run like --profile, and write its stacks in "
+        "the collapsed format flamegraph tools read")
+    args = arg_parser.parse_args()
+
+    profile = None
+    if args.profile or args.flamegraph:
+        if args.engine != "tree":
+            arg_parser.error("profiling needs --engine tree")
+        profile = profiler.Profiler()
+        args.batch = args.batch or "forward"
+
+    filename = args.filename
+    use_color = args.batch is None
+    shared.engine = args.engine
+    shared.memo_size = args.memo_size
+    cache.cache_dir = args.cache_dir
+
     try:
-        filename = sys.argv[1]
-        scanner = scanner.Scanner(filename)
-        parser = parser.ArrowParser(scanner.tokens())
-        program = parser.program()
+        if args.no_cache:
+            scanner = scanner.Scanner(filename)
+            parser = parser.ArrowParser(scanner.tokens())
+            program = parser.program()
+        else:
+            program = cache.load(filename)
     except shared.ArrowException as e:
         handle_errors(e)
 
+    if args.disassemble:
+        for function in program.functions.values():
+            for code in bytecode.compile_function(function):
+                print(bytecode.disassemble(code))
+                print()
+        exit(0)
+
+    if args.batch:
+        # Var-condition warnings go to stderr, to keep stdout valid JSON.
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                phases = run_batch(
+                    program, args.batch, args.round_trips, profile)
+        except shared.ArrowException as e:
+            handle_errors(e)
+
+        if args.profile:
+            with open(args.profile, "w") as f:
+                profile.report(f)
+        if args.flamegraph:
+            with open(args.flamegraph, "w") as f:
+                profile.write_stacks(f)
+
+        report = {
+            "file": filename,
+            "engine": args.engine,
+            "mode": args.batch,
+            "phases": phases,
+            "total_ms": sum(phase["ms"] for phase in phases),
+            "main_vars": {
+                var: batch.to_json(value) for var, value in program.main_vars.items()
+                },
+            }
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        exit(0)
+
     print("Starting out... ")
     print()
     print_state(program)
@@ -1,47 +1,128 @@
-import shared, datatypes, inverter, evaluator, collections
+import re, shared, datatypes, inverter, evaluator, resolver, collections
+
+# The fields each kind of node has. Fields left out when a node is created
+# (an IF's 'false' block, a DO/UNDO's 'yielding_block') are None.
+node_fields = {
+    "PROGRAM": ("main_vars", "main", "functions"),
+    "BLOCK": ("statements",),
+    "ENTER": ("condition",),
+    "EXIT": ("condition",),
+    "UN": ("statement",),
+    "RESULT": ("expr",),
+    "VAR_DEC": ("name", "expr", "slot"),
+    "VAR_CONDITION": ("name", "expr", "slot"),
+    "MOD_OP": ("op", "var", "expr"),
+    "SWAP_OP": ("left", "right"),
+    "FOR_LOOP": ("inc_at_end", "var_declaration", "increment_statement",
+        "block", "end_condition"),
+    "FROM_LOOP": ("start_condition", "block", "end_condition"),
+    "IF": ("condition", "true", "result", "false"),
+    "DO/UNDO": ("action_block", "yielding_block"),
+    "BIN_OP": ("op", "left", "right"),
+    "NEGATE": ("expr",),
+    "NUM": ("number",),
+    "STRING": ("string",),
+    "VAR_REF": ("name", "slot"),
+    "ARRAY_REF": ("name", "expr", "slot"),
+    "ARRAY_EXPR": ("entries", "datatype"),
+    "ARRAY_FILL": ("value", "count", "fill"),
+    "ARRAY_RANGE": ("start", "stop"),
+    "FUNCTION_CALL": ("name", "attrs", "backwards", "ref_args", "const_args",
+        "slot", "ref_slots"),
+}
+
+# (The 'slot' fields say where a variable lives in its function's memory
+# table, and are filled in by the resolver once the program is parsed;
+# so are a call's 'ref_slots', the slots of its ref args.)
+
+# The datatypes an initializer can name in front of its "[", by their
+# names in datatypes. These are only types there, where an initializer is
+# expected; everywhere else they're ordinary names, which variables can
+# have.
+array_types = {
+    "deque": "Deque",
+    "bitset": "Bitset",
+    "map": "Map",
+}
+
+# The function in datatypes which each datatype's fill initializer
+# ("[value; n]") calls, by the datatype's name. (Names, since datatypes
+# may still be loading when parser is.)
+fills = {
+    "List": "fill_list",
+    "Bitset": "fill_bitset",
+}
 
 class ParseNode:
     """
     A node in the abstract syntax tree.
+
+    Each kind of node has its own subclass (see node_classes) which keeps
+    its fields in __slots__; ParseNode(kind, ...) creates the right one.
     """
 
-    def __init__(self, kind, **kwargs):
-        self.kind = kind
-        self.data = dict(**kwargs)
+    __slots__ = ("inverse", "token")
+    kind = None
+    fields = ()
+
+    def __new__(cls, kind, token=None, **kwargs):
+        return object.__new__(node_classes[kind])
+
+    def __init__(self, kind, token=None, **kwargs):
+        """
+        Takes the node's kind, the token it starts at (which every
+        statement has, for error reporting and profiling), and its fields.
+        """
+
+        self.token = token
+
+        for field in self.fields:
+            setattr(self, field, kwargs.pop(field, None))
+
+        if kwargs:
+            raise TypeError("{} nodes have no field {}.".format(
+                kind, ", ".join(kwargs)))
+
+        # Filled in by the inverter the first time this node is inverted.
+        self.inverse = None
+
+    def __getnewargs__(self):
+        # Lets nodes be pickled and copied.
+        return (self.kind,)
+
+    @property
+    def data(self):
+        return {field: getattr(self, field) for field in self.fields}
 
     def replace(self, kind=None, **kwargs):
         """
         Returns a node with updated data.
         """
 
-        new_data = self.data.copy()
+        new_data = self.data
         new_data.update(kwargs)
 
         if kind is None:
-            return ParseNode(self.kind, **new_data)
+            return ParseNode(self.kind, self.token, **new_data)
         else:
-            return ParseNode(kind, **new_data)
-
-    def __getattr__(self, attr):
-        if attr in self.data:
-            return self.data[attr]
-        
-        raise KeyError(attr)
-
-    # def flatten(self, d=0):
-    #     for item in self.data.values():
-    #         if isinstance(item, ParseNode):
-    #             yield item, d
-    #             yield from item.flatten(d+1)
-    #         elif isinstance(item, collections.Iterable):
-    #             for a in item:
-    #                 if isinstance(a, ParseNode):
-    #                     yield a, d
-    #                     yield from a.flatten(d+1)
+            return ParseNode(kind, self.token, **new_data)
 
     def __repr__(self):
         return "{}, {}".format(str(self.kind), str(self.data))
 
+# One class per kind of node, e.g. node_classes["BIN_OP"] is BinOpNode.
+node_classes = {}
+
+for kind, fields in node_fields.items():
+    class_name = "".join(
+        word.capitalize() for word in re.split("[_/]", kind)) + "Node"
+    node_classes[kind] = globals()[class_name] = type(class_name, (ParseNode,), {
+        "__slots__": fields,
+        "__module__": __name__,
+        "kind": kind,
+        "fields": fields,
+        })
+
 class Parser:
     """
     The base class for the ArrowParser object, providing utility and
@@ -159,6 +240,9 @@ class ArrowParser(Parser):
             functions=function_nodes
             )
 
+        # Give every variable a slot in its function's memory table.
+        resolver.resolve_program(node)
+
         shared.program = node
         return node
 
@@ -186,8 +270,9 @@ class ArrowParser(Parser):
             name, ref_parameters, const_parameters, block)
 
     def block(self):
+        token = self.current
         self.confirm_strings("{")
-        node = ParseNode("BLOCK", statements=[])
+        node = ParseNode("BLOCK", token, statements=[])
         
         while self.current.string != "}":
             node.statements.append(self.statement())
@@ -229,57 +314,96 @@ class ArrowParser(Parser):
             "Expected a statement, but found '{}'.".format(self.current.string))
 
     def enter_or_exit_statement(self):
+        token = self.current
+
         if self.check_strings("enter"):
             self.confirm_strings("if")
             return ParseNode(
-                "ENTER",
+                "ENTER", token,
                 condition=self.expression()
                 )
 
         elif self.check_strings("exit"):
             self.confirm_strings("if")
             return ParseNode(
-                "EXIT",
+                "EXIT", token,
                 condition=self.expression()
                 )
 
     def un(self):
+        token = self.current
         self.confirm_strings("un")
         self.confirm_strings("(")
         self.confirm_strings(":")
         statement_node = self.statement()
         self.confirm_strings(":")
         self.confirm_strings(")")
-        return ParseNode("UN", statement=statement_node)
+        return ParseNode("UN", token, statement=statement_node)
 
     def result_statement(self):
+        token = self.current
         self.confirm_strings("result")
-        return ParseNode("RESULT", expr=self.expression())
+        return ParseNode("RESULT", token, expr=self.expression())
 
     def var_dec(self):
+        token = self.current
         var_name = self.expect_kinds("ID")
         self.confirm_strings(":=")
 
         return ParseNode(
-            "VAR_DEC", name=var_name, expr=self.init_expr())
+            "VAR_DEC", token, name=var_name, expr=self.init_expr())
 
     def init_expr(self):
-        if self.check_strings("["):
-            node = ParseNode("ARRAY_EXPR", entries=[])
-
-            while not self.check_strings("]"):
-                node.entries.append(self.expression())
-                self.accept_strings(",")
-            return node
-            
+        # "deque[...]" makes a Deque rather than a List, "bitset[...]" a
+        # Bitset and "map[key: value, ...]" a Map.
+        if (self.current.string in array_types
+                and self.lookahead.string == "["):
+            name = array_types[self.expect_kinds("ID")]
+            datatype = getattr(datatypes, name)
+        elif self.current.string == "[":
+            datatype = datatypes.List
         else:
             return self.expression()
 
+        self.confirm_strings("[")
+        node = ParseNode("ARRAY_EXPR", entries=[], datatype=datatype)
+
+        while not self.check_strings("]"):
+            node.entries.append(self.expression())
+
+            if datatype is datatypes.Map:
+                # A Map's entries are its keys and values, alternating.
+                self.confirm_strings(":")
+                node.entries.append(self.expression())
+
+            elif datatype.__name__ in fills and len(node.entries) == 1:
+                # "[value; n]" is n entries of value ("bitset[bit; n]" n
+                # bits), and "[start:stop]" the integers from start up to
+                # stop.
+                first = node.entries[0]
+                if self.check_strings(";"):
+                    node = ParseNode(
+                        "ARRAY_FILL", value=first, count=self.expression(),
+                        fill=getattr(datatypes, fills[datatype.__name__]))
+                elif datatype is datatypes.List and self.check_strings(":"):
+                    node = ParseNode(
+                        "ARRAY_RANGE", start=first, stop=self.expression())
+
+                if node.kind != "ARRAY_EXPR":
+                    self.confirm_strings("]")
+                    return node
+
+            self.accept_strings(",")
+
+        return node
+
     def var_condition(self):
+        token = self.current
         var_name = self.expect_kinds("ID")
         self.confirm_strings("==")
 
-        return ParseNode("VAR_CONDITION", name=var_name, expr=self.init_expr())
+        return ParseNode(
+            "VAR_CONDITION", token, name=var_name, expr=self.init_expr())
 
     def mod_operation(self):
         v_node = self.V()
@@ -291,17 +415,18 @@ class ArrowParser(Parser):
                         v_node.name, self.current.string, self.current.string
                         ))
             other_v_node = self.V()
-            return ParseNode("SWAP_OP",
+            return ParseNode("SWAP_OP", v_node.token,
                 left=v_node, right=other_v_node)
 
         expr_node = self.expression()
 
-        return ParseNode("MOD_OP",
+        return ParseNode("MOD_OP", v_node.token,
             op=op[0], #We only want the '+' from the '+='
             var=v_node, expr=expr_node
             )
 
     def for_loop(self):
+        token = self.current
         self.confirm_strings("for")
         self.accept_strings("(")
         var_declaration_node = self.var_dec()
@@ -329,7 +454,7 @@ class ArrowParser(Parser):
         end_condition_node = self.var_condition()
         self.accept_strings(")")
 
-        return ParseNode("FOR_LOOP",
+        return ParseNode("FOR_LOOP", token,
             inc_at_end=increment_at_end,
             var_declaration=var_declaration_node,
             increment_statement=increment_statement_node,
@@ -338,6 +463,7 @@ class ArrowParser(Parser):
             )
 
     def from_loop(self):
+        token = self.current
         self.confirm_strings("from")
         start_condition_node = self.expression()
 
@@ -346,14 +472,15 @@ class ArrowParser(Parser):
         self.confirm_strings("until")
         end_condition_node = self.expression()
 
-        return ParseNode("FROM_LOOP",
+        return ParseNode("FROM_LOOP", token,
             start_condition=start_condition_node,
             block=block_node,
             end_condition=end_condition_node
             )
 
     def if_statement(self):
-        beginning_line = self.current.line_num
+        token = self.current
+        beginning_line = token.line_num
         self.confirm_strings("if")
         
         condition_node = self.expression()
@@ -373,32 +500,33 @@ class ArrowParser(Parser):
         if self.check_strings("else"):
             else_node = self.block()
 
-            return ParseNode("IF",
+            return ParseNode("IF", token,
                 condition=condition_node,
                 true=block_node,
                 result=result_node,
                 false=else_node
                 )
 
-        return ParseNode("IF",
+        return ParseNode("IF", token,
             condition=condition_node,
             true=block_node,
             result=result_node,
             )
 
     def do_undo_statement(self):
+        token = self.current
         self.confirm_strings("do/undo")
         action_block = self.block()
 
         if self.check_strings("yielding"):
             yielding_block = self.block()
 
-            return ParseNode("DO/UNDO",
+            return ParseNode("DO/UNDO", token,
                 action_block=action_block,
                 yielding_block=yielding_block
                 )
 
-        return ParseNode("DO/UNDO",
+        return ParseNode("DO/UNDO", token,
             action_block=action_block)
 
     def expression(self):
@@ -489,7 +617,10 @@ class ArrowParser(Parser):
             return node
 
     def function_call(self):
-        name = self.expect_kinds("ID")
+        token = self.current
+
+        # "x.push" calls the method 'push' of the variable 'x'.
+        name, *attrs = self.expect_kinds("ID").split(".")
         self.confirm_strings("(")
         ref_args = []
         const_args = []
@@ -510,18 +641,29 @@ class ArrowParser(Parser):
             self.confirm_strings(",")
 
         self.confirm_strings(")")
-        return ParseNode("FUNCTION_CALL", name=name, backwards=False,
+        return ParseNode("FUNCTION_CALL", token, name=name, attrs=tuple(attrs),
+            backwards=False,
             ref_args=ref_args,
             const_args=const_args)
 
     def V(self):
+        token = self.current
         string = self.expect_kinds("ID")
+
+        # Dots are only meaningful in method calls.
+        if "." in string:
+            raise shared.ArrowException(
+                shared.Stages.parsing,
+                "'{}' isn't a variable name; methods must be called.".format(
+                    string),
+                token)
+
         if self.check_strings("["):
             expr_node = self.expression()
             self.confirm_strings("]")
-            return ParseNode("ARRAY_REF", name=string, expr=expr_node)
+            return ParseNode("ARRAY_REF", token, name=string, expr=expr_node)
         
-        return ParseNode("VAR_REF", name=string)
+        return ParseNode("VAR_REF", token, name=string)
 
     def number(self):
         base_numerator = int(self.expect_kinds("DIGITS"))
@@ -0,0 +1,168 @@
+import collections, time
+import evaluator, datatypes
+
+class Profiler:
+    """
+    Counts and times the statements the tree-walker executes and the
+    functions it calls (builtin methods included), in both directions.
+
+    While profiling (inside a 'with profiler:' block), evaluator's
+    statement_eval and Function.call are swapped for timed versions; the
+    rest of the time nothing is changed, so profiling costs nothing when
+    it's off.
+
+    Statements are grouped by the function they ran in, their line and
+    their kind; functions by their name and direction. For each, the
+    profiler keeps how many times it ran, its total time (including the
+    statements or calls nested inside it) and its self time (excluding
+    them). As in cProfile, a recursive function's total time is only
+    counted at its outermost call, so that it isn't counted once for each
+    level of recursion; the same goes for statements.
+    """
+
+    def __init__(self):
+        # (function, line, kind) -> [count, total, self]
+        self.statements = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        # (name, backwards) -> [calls, total, self]
+        self.functions = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        # A tuple of the functions on the stack -> the self time of the last
+        self.stacks = collections.defaultdict(float)
+
+        # The functions being run, e.g. ["main", "sort", "un pass"].
+        self.frames = []
+
+        # The time spent in nested statements, for each statement being
+        # run; and in nested calls, for each function.
+        self.nested_statements = [0.0]
+        self.nested_calls = [0.0]
+
+        # How many runs of each statement and function are under way.
+        self.active = collections.Counter()
+
+    def __enter__(self):
+        self.statement_eval = evaluator.statement_eval
+        self.call = datatypes.Function.call
+
+        profiler = self
+        def call(function, backwards, values, ref_slots, const_arg_vals):
+            return profiler.timed_call(function.name, backwards, profiler.call,
+                function, backwards, values, ref_slots, const_arg_vals)
+
+        evaluator.statement_eval = self.timed_statement_eval
+        datatypes.Function.call = call
+        return self
+
+    def __exit__(self, *exc_info):
+        evaluator.statement_eval = self.statement_eval
+        datatypes.Function.call = self.call
+
+    def run(self, program, backwards=False):
+        """
+        Profiles running the program's main block, whose direction is
+        given by backwards. Returns the memory table of the main variables.
+        """
+
+        with self:
+            return self.timed_call(
+                "main", backwards, evaluator.program_eval, program)
+
+    def timed_statement_eval(self, node, table):
+        # Lines are counted from 1 here, as editors count them.
+        line = node.token.line_num + 1 if node.token else None
+        key = (self.frames[-1], line, node.kind)
+        self.active[key] += 1
+
+        nested = self.nested_statements
+        nested.append(0.0)
+
+        start = time.perf_counter()
+        try:
+            return self.statement_eval(node, table)
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = nested.pop()
+            nested[-1] += elapsed
+
+            self.record(self.statements, key, elapsed, inner)
+
+    def timed_call(self, name, backwards, call, *args):
+        """
+        Makes a call (running the function called name, in the direction
+        given by backwards) and records how long it took.
+        """
+
+        self.frames.append("un " + name if backwards else name)
+        key = (name, backwards)
+        self.active[key] += 1
+
+        nested = self.nested_calls
+        nested.append(0.0)
+
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = nested.pop()
+            nested[-1] += elapsed
+
+            self.stacks[tuple(self.frames)] += elapsed - inner
+            self.frames.pop()
+
+            self.record(self.functions, key, elapsed, inner)
+
+    def record(self, entries, key, elapsed, inner):
+        """
+        Adds a finished run of a statement or function, which took elapsed
+        seconds, inner of them in the statements or calls nested inside it.
+        """
+
+        active = self.active
+        active[key] -= 1
+
+        entry = entries[key]
+        entry[0] += 1
+        entry[2] += elapsed - inner
+        if not active[key]:
+            # The outermost run, which includes any nested inside it.
+            entry[1] += elapsed
+
+    def report(self, file):
+        """
+        Writes the functions, by total time, and the statements, by self
+        time, as text tables.
+        """
+
+        print("{:<24}{:<10}{:>10}{:>12}{:>12}".format(
+            "function", "direction", "calls", "total ms", "self ms"),
+            file=file)
+
+        functions = sorted(
+            self.functions.items(), key=lambda item: item[1][1], reverse=True)
+        for (name, backwards), (calls, total, own) in functions:
+            print("{:<24}{:<10}{:>10}{:>12.3f}{:>12.3f}".format(
+                name, "uncall" if backwards else "call", calls,
+                total * 1000, own * 1000), file=file)
+
+        print(file=file)
+        print("{:<24}{:>6}  {:<16}{:>10}{:>12}{:>12}".format(
+            "function", "line", "statement", "count", "total ms", "self ms"),
+            file=file)
+
+        statements = sorted(
+            self.statements.items(), key=lambda item: item[1][2], reverse=True)
+        for (function, line, kind), (count, total, own) in statements:
+            print("{:<24}{:>6}  {:<16}{:>10}{:>12.3f}{:>12.3f}".format(
+                function, "?" if line is None else line, kind, count,
+                total * 1000, own * 1000), file=file)
+
+    def write_stacks(self, file):
+        """
+        Writes each stack of functions and its self time in microseconds,
+        one per line ("main;sort;un pass 1234"), the collapsed format that
+        flamegraph tools read.
+        """
+
+        for stack, elapsed in sorted(self.stacks.items()):
+            print("{} {}".format(";".join(stack), round(elapsed * 1e6)),
+                file=file)
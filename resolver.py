@@ -0,0 +1,229 @@
+import shared, inverter, datatypes, parser
+
+#
+# The resolver runs once, after parsing. It gives every variable of every
+# function a fixed slot in that function's memory table (see
+# evaluator.Scope), and stores the slot on the nodes which use the
+# variable, so the evaluators can read and write variables by index.
+#
+# Along the way it rejects writes to constants, which would otherwise
+# only be caught (or not) when the program ran, and enter and exit
+# statements inside for loops, which can't be resumed. Finally, it finds
+# the pure functions, whose results can be memoized.
+#
+
+def raise_error(message, node):
+    raise shared.ArrowException(
+        shared.Stages.resolution,
+        message,
+        node.token)
+
+def resolve_program(program):
+    for function in program.functions.values():
+        resolve_function(function)
+
+    if shared.memo_size > 0:
+        for function in find_pure_functions(program):
+            function.memo = datatypes.Memo(shared.memo_size)
+
+def walk(node):
+    """
+    Yields a node and every node beneath it.
+    """
+
+    yield node
+    for field in node.fields:
+        value = getattr(node, field)
+        if isinstance(value, parser.ParseNode):
+            yield from walk(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, parser.ParseNode):
+                    yield from walk(item)
+
+def find_pure_functions(program):
+    """
+    Returns the functions whose result depends only on their const args:
+    those with no ref parameters, which change no array elements (an array
+    may be a const arg), call no methods (which may change their values),
+    and call only pure functions.
+    """
+
+    calls = {}
+    for name, function in program.functions.items():
+        if function is program.main or function.ref_parameters:
+            continue
+
+        called = set()
+        for node in walk(function.block):
+            if node.kind == "FUNCTION_CALL":
+                if node.attrs:
+                    break
+                called.add(node.name)
+            elif node.kind == "MOD_OP" and node.var.kind == "ARRAY_REF":
+                break
+            elif node.kind == "SWAP_OP" and "ARRAY_REF" in (
+                    node.left.kind, node.right.kind):
+                break
+        else:
+            calls[name] = called
+
+    # Drop functions which call impure ones until none are left to drop.
+    changed = True
+    while changed:
+        changed = False
+        for name, called in list(calls.items()):
+            if not called <= calls.keys():
+                del calls[name]
+                changed = True
+
+    return [program.functions[name] for name in calls]
+
+def resolve_function(function):
+    """
+    Resolves a function's body in both directions.
+    """
+
+    resolve_block(function.block, function.scope)
+    resolve_block(inverter.unblock(function.block), function.scope)
+
+def check_writable(node, scope):
+    """
+    Raises an error if node names a constant, which mustn't be changed.
+    (The elements of a constant array can be, as they always could.)
+    """
+
+    if node.kind != "ARRAY_REF" and node.name in scope.consts:
+        raise_error("Modifying constant {} not allowed.".format(node.name), node)
+
+def check_no_entry_points(node):
+    """
+    Raises an error if a for loop's body has an enter or exit statement in
+    it. This is a restriction of the language, not just of the evaluators:
+    an exit becomes an enter when the function is uncalled, and resuming at
+    an enter inside the loop would need the loop's variable, which is a
+    local that was lost when the function exited. Enters and exits inside
+    from loops, ifs and do/undos are fine.
+    """
+
+    for inner in walk(node.block):
+        if inner.kind in ("ENTER", "EXIT"):
+            raise_error(
+                "{} statements can't be inside a for loop, since the loop's "
+                "variable is lost when the function exits.".format(
+                    inner.kind.capitalize()),
+                inner)
+
+def resolve_expr(node, scope):
+    if node.kind == "BIN_OP":
+        resolve_expr(node.left, scope)
+        resolve_expr(node.right, scope)
+
+    elif node.kind == "NEGATE":
+        resolve_expr(node.expr, scope)
+
+    elif node.kind == "VAR_REF":
+        node.slot = scope.slot(node.name)
+
+    elif node.kind == "ARRAY_REF":
+        node.slot = scope.slot(node.name)
+        resolve_expr(node.expr, scope)
+
+    elif node.kind == "FUNCTION_CALL":
+        resolve_call(node, scope)
+
+    elif node.kind == "ARRAY_EXPR":
+        for entry in node.entries:
+            resolve_expr(entry, scope)
+
+    elif node.kind == "ARRAY_FILL":
+        resolve_expr(node.value, scope)
+        resolve_expr(node.count, scope)
+
+    elif node.kind == "ARRAY_RANGE":
+        resolve_expr(node.start, scope)
+        resolve_expr(node.stop, scope)
+
+def resolve_call(node, scope):
+    # Methods are looked up on a variable; plain functions aren't variables.
+    if node.attrs:
+        node.slot = scope.slot(node.name)
+
+    for arg in node.ref_args:
+        if arg.kind != "VAR_REF":
+            raise_error(
+                "Only variables can be passed by reference, not {}[...].".format(
+                    arg.name),
+                arg)
+
+        # Passing a constant by reference would let the callee change it.
+        check_writable(arg, scope)
+        resolve_expr(arg, scope)
+
+    node.ref_slots = tuple(arg.slot for arg in node.ref_args)
+
+    for arg in node.const_args:
+        resolve_expr(arg, scope)
+
+def resolve_statement(node, scope):
+    if node.kind == "MOD_OP":
+        check_writable(node.var, scope)
+        resolve_expr(node.var, scope)
+        resolve_expr(node.expr, scope)
+
+    elif node.kind == "SWAP_OP":
+        for side in (node.left, node.right):
+            check_writable(side, scope)
+            resolve_expr(side, scope)
+
+    elif node.kind == "FROM_LOOP":
+        resolve_expr(node.start_condition, scope)
+        resolve_block(node.block, scope)
+        resolve_expr(node.end_condition, scope)
+
+    elif node.kind == "FOR_LOOP":
+        check_no_entry_points(node)
+        resolve_statement(node.var_declaration, scope)
+        resolve_statement(node.increment_statement, scope)
+        resolve_block(node.block, scope)
+        resolve_statement(node.end_condition, scope)
+
+    elif node.kind == "IF":
+        resolve_expr(node.condition, scope)
+        resolve_block(node.true, scope)
+        resolve_expr(node.result, scope)
+        if node.false is not None:
+            resolve_block(node.false, scope)
+
+    elif node.kind == "DO/UNDO":
+        # The undo half is an inverted copy of the action block,
+        # which needs resolving too.
+        resolve_block(node.action_block, scope)
+        resolve_block(inverter.unblock(node.action_block), scope)
+        if node.yielding_block is not None:
+            resolve_block(node.yielding_block, scope)
+
+    elif node.kind == "RESULT":
+        resolve_expr(node.expr, scope)
+
+    elif node.kind in ("VAR_DEC", "VAR_CONDITION"):
+        check_writable(node, scope)
+        node.slot = scope.slot(node.name)
+        resolve_expr(node.expr, scope)
+
+    elif node.kind == "BLOCK":
+        resolve_block(node, scope)
+
+    elif node.kind == "FUNCTION_CALL":
+        resolve_call(node, scope)
+
+    elif node.kind == "UN":
+        resolve_statement(node.statement, scope)
+        resolve_statement(inverter.unstatement(node.statement), scope)
+
+    elif node.kind in ("ENTER", "EXIT"):
+        resolve_expr(node.condition, scope)
+
+def resolve_block(node, scope):
+    for statement in node.statements:
+        resolve_statement(statement, scope)
@@ -1,12 +1,36 @@
-import re, collections, shared
+import re, sys, collections, shared
 Token = collections.namedtuple(
     'Token', ['kind', 'string', 'line_num', 'char_num'])
 
-def tokenizer(kind):
-    """
-    Returns a function which generates tokens for a given regexp.
-    """
-    return lambda scanner, string: Token(kind, string, scanner.line_num, None)
+# The kinds of token, each with the regexp which recognizes it. Earlier
+# ones take priority, so keywords aren't mistaken for identifiers.
+token_regexps = [
+    # Skip whitespace.
+    ("WHITESPACE", r"\s+"),
+    # Skip comments, which are either hashtags or C-style /* ... */
+    # (which can span lines).
+    ("COMMENT", r"#.*|/\*[\s\S]*?\*/"),
+    # String literals.
+    ("STRING", r"\".*?\""),
+    # Keywords.
+    ("KEYWORD", r"\bor\b|\band\b|\bexit\b|\benter\b|\bdo/undo\b|\byielding\b|\bresult\b|\buntil\b|\bconst\b|\bfrom\b|\bfor\b|\bref\b|\bif\b"),
+    # Identifiers.
+    # (though the '.' technically isn't allowed in identifiers,
+    #  it's considered part of an identifier internally.)
+    ("ID", r"[a-zA-Z_]+(?:\d|[a-zA-Z_]|\.)*"),
+    # Number literals.
+    ("DIGITS", r"\d+"),
+    # Symbols.
+    ("SYMBOL", r"\.|\*=|/=|\^=|\+=|-=|%|&|\+|-|\/|\*|<=>|<=|>=|==|!=|:=|=>|>|<|=|:|\[|\]|\(|\)|{|}|,|;"),
+    # We don't recognize anything else.
+    ("UNRECOGNIZED", r".+"),
+]
+
+# One regexp for every kind of token, compiled once; the name of the group
+# which matched is the token's kind. Spaces and tabs before a token are
+# matched along with it, which saves a match per token.
+master_regexp = re.compile(r"[ \t]*(?:{})".format("|".join(
+    "(?P<{}>{})".format(kind, regexp) for kind, regexp in token_regexps)))
 
 def raise_error(token):
     raise shared.ArrowException(
@@ -15,57 +39,70 @@ def raise_error(token):
         token)
 
 class Scanner:
-    def __init__(self, file_string):
+    """
+    Turns Arrow source code into tokens, in a single pass over all of it.
+
+    The source is read from the named file, from stdin if the name is "-",
+    or given directly as a string.
+    """
+
+    def __init__(self, file_string=None, source=None):
         self.file_string = file_string
-        self.scanner = re.Scanner([
-            # Skip whitespace.
-            (r"\s+", tokenizer("SKIPPABLE")),
-            # Skip comments, which are either hashtags or C-style /* ... */.
-            (r"#.*|\/\*.*\*\/", tokenizer("SKIPPABLE")),
-            # String literals.
-            (r"\".*?\"", tokenizer("STRING")),
-            # Keywords.
-            (r"\bor\b|\band\b|\bexit\b|\benter\b|\bdo/undo\b|\byielding\b|\bresult\b|\buntil\b|\bconst\b|\bfrom\b|\bfor\b|\bref\b|\bif\b", tokenizer("KEYWORD")),
-            # Identifiers.
-            # (though the '.' technically isn't allowed in identifiers,
-            #  it's considered part of an identifier internally.)
-            (r"[a-zA-Z_]+(\d|[a-zA-Z_]|\.)*", tokenizer("ID")),
-            # Number literals.
-            (r"\d+", tokenizer("DIGITS")),
-            # Symbols.
-            (r"\.|\*=|/=|\^=|\+=|-=|%|&|\+|-|\/|\*|<=>|<=|>=|==|!=|:=|=>|>|<|=|:|\[|\]|\(|\)|{|}|,",
-                tokenizer("SYMBOL")),
-            # We don't recognize anything else.
-            (r".*", tokenizer("UNRECOGNIZED"))
-        ])
+        self.source = source
+
+    def read(self):
+        if self.source is not None:
+            return self.source
+        elif self.file_string == "-":
+            return sys.stdin.read()
 
-    def tokens(self):
         with open(self.file_string, "r") as f:
-            # Store the entire file. 
-            shared.code = [line.rstrip() for line in f.readlines()]
-
-            for line_num, line in enumerate(shared.code):
-                self.scanner.line_num = line_num
-                results, remainder = self.scanner.scan(line)
-
-                # In order for each token to know where it is on the line,
-                # we keep track of how far we are into the current line.
-                current_char = 0
-                for token in results:
-                    token = token._replace(char_num=current_char)
-                    
-                    if token.kind == "UNRECOGNIZED":
-                        raise_error(token)
-                    elif token.kind == "SKIPPABLE":
-                        pass
-                    else:
-                        yield token
-
-                    current_char += len(token.string.expandtabs())
-
-        yield Token("EOF", "", line_num, current_char)
+            return f.read()
+
+    def tokens(self):
+        source = self.read()
+
+        # Store the entire file, line by line, for error messages.
+        shared.code = [line.rstrip() for line in source.split("\n")]
+
+        # Columns count tabs as reaching the next tab stop, which takes more
+        # work; most sources don't have any, though.
+        tabs = "\t" in source
+
+        line_num = 0
+        line_start = 0
+
+        # Every position matches some kind of token (if only UNRECOGNIZED),
+        # so the matches cover the whole source.
+        for m in master_regexp.finditer(source):
+            kind = m.lastgroup
+
+            if kind == "WHITESPACE" or kind == "COMMENT":
+                # Skipped, but they're where the line breaks are.
+                string = m.group(kind)
+                newlines = string.count("\n")
+                if newlines:
+                    line_num += newlines
+                    line_start = m.start(kind) + string.rindex("\n") + 1
+
+            else:
+                group = m.lastindex
+                start = m.start(group)
+                if tabs:
+                    char_num = len(source[line_start:start].expandtabs())
+                else:
+                    char_num = start - line_start
+
+                # (Building the tuple directly skips namedtuple's __new__.)
+                token = tuple.__new__(
+                    Token, (kind, m.group(group), line_num, char_num))
+                if kind == "UNRECOGNIZED":
+                    raise_error(token)
+                yield token
+
+        yield Token("EOF", "", line_num, len(source) - line_start)
 
 if __name__ == "__main__":
-    scanner = Scanner("test.txt")
-    for kind, string in scanner.tokens():
-        print(kind, string)
\ No newline at end of file
+    scanner = Scanner(sys.argv[1] if len(sys.argv) > 1 else "-")
+    for token in scanner.tokens():
+        print(token.kind, token.string)
@@ -6,13 +6,16 @@ program = None
 # A list of lines of the Arrow code currently being processed.
 code = None
 
-# 
-class ReturnException(Exception):
-    """
-    Used by Arrow functions to return.
-    """
-    def __init__(self):
-        pass
+# The engine used to run Arrow code: "tree" walks the ParseNodes directly,
+# "closure" compiles them into Python closures first (see compiler.py),
+# and "vm" compiles them into bytecode for a stack machine (see vm.py),
+# which keeps Arrow calls on its own stack rather than Python's, so deep
+# recursion is only limited by memory.
+engine = "tree"
+
+# How many results each pure function remembers (see datatypes.Memo).
+# 0 turns memoization off.
+memo_size = 1024
 
 class ArrowException(Exception):
     """
@@ -31,4 +34,5 @@ class ArrowException(Exception):
 class Stages(Enum):
     scanning = 1
     parsing = 2
-    evaluation = 3
\ No newline at end of file
+    evaluation = 3
+    resolution = 4
\ No newline at end of file
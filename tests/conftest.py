@@ -0,0 +1,47 @@
+import os, sys
+
+import pytest
+
+# The interpreter's modules live at the top of the repository, and import
+# each other by their bare names.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch, cache, main, shared
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "sample_programs")
+
+def main_vars(program):
+    """
+    Returns a program's main vars as plain Python values (see batch.to_json).
+    """
+
+    return {
+        name: batch.to_json(value) for name, value in program.main_vars.items()
+        }
+
+@pytest.fixture(params=["tree", "closure", "vm"])
+def engine(request):
+    """
+    Runs a test once on each engine.
+    """
+
+    old_engine = shared.engine
+    shared.engine = request.param
+    yield request.param
+    shared.engine = old_engine
+
+@pytest.fixture
+def run():
+    """
+    Returns a function which parses an Arrow program, runs its main
+    forwards, backwards, or both (see main.run_batch), and returns the
+    main vars afterwards (see main_vars).
+    """
+
+    def run(source, mode="forward"):
+        program = cache.parse(source)
+        main.run_batch(program, mode, 1)
+        return main_vars(program)
+
+    return run
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import cache, main, shared
+from conftest import SAMPLES, main_vars
+
+source = """
+    double(ref n){
+        n *= 2
+    }
+
+    main(n := 3){
+        double(&n)
+    }
+"""
+
+@pytest.fixture
+def parses(monkeypatch, tmp_path):
+    """
+    Caches programs under tmp_path, and counts how many times a program is
+    actually parsed rather than read from the cache.
+    """
+
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path / "cache"))
+    parse = cache.parse
+    counts = {"parses": 0}
+
+    def counted_parse(source):
+        counts["parses"] += 1
+        return parse(source)
+
+    monkeypatch.setattr(cache, "parse", counted_parse)
+    return counts
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+def run(program):
+    main.run_batch(program, "forward", 1)
+    return main_vars(program)
+
+def test_second_load_reads_the_cache(engine, parses, tmp_path):
+    filename = write(tmp_path / "double.arrow", source)
+
+    assert run(cache.load(filename)) == {"n": 6}
+    assert run(cache.load(filename)) == {"n": 6}
+    assert parses["parses"] == 1
+
+def test_cached_samples_run_like_fresh_ones(engine, parses):
+    for name in ("sort.arrow", "fibonacci_rec.arrow", "count_until.arrow"):
+        parses["parses"] = 0
+        filename = os.path.join(SAMPLES, name)
+        with open(filename) as f:
+            text = f.read()
+        initial = main_vars(cache.parse(text))
+        fresh = run(cache.parse(text))
+        cache.load(filename)
+
+        # The cached copy has to run backwards too, since the inverted
+        # trees are pickled along with the rest.
+        cached = cache.load(filename)
+        assert parses["parses"] == 3
+        assert run(cached) == fresh
+        main.run_batch(cached, "backward", 1)
+        assert main_vars(cached) == initial
+
+def test_editing_the_source_invalidates(parses, tmp_path):
+    filename = write(tmp_path / "double.arrow", source)
+    cache.load(filename)
+
+    write(tmp_path / "double.arrow", source.replace("n := 3", "n := 5"))
+    assert run(cache.load(filename)) == {"n": 10}
+    assert parses["parses"] == 2
+
+def test_changing_the_interpreter_invalidates(monkeypatch, parses, tmp_path):
+    filename = write(tmp_path / "double.arrow", source)
+    cache.load(filename)
+
+    monkeypatch.setattr(cache, "version", "another interpreter")
+    cache.load(filename)
+    assert parses["parses"] == 2
+
+def test_changing_the_memo_size_invalidates(monkeypatch, parses, tmp_path):
+    filename = write(tmp_path / "double.arrow", source)
+    cache.load(filename)
+
+    monkeypatch.setattr(shared, "memo_size", shared.memo_size + 1)
+    cache.load(filename)
+    assert parses["parses"] == 2
+
+def test_same_name_in_another_directory_isnt_confused(parses, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = write(tmp_path / "a" / "double.arrow", source)
+    second = write(tmp_path / "b" / "double.arrow",
+        source.replace("n := 3", "n := 4"))
+
+    assert run(cache.load(first)) == {"n": 6}
+    assert run(cache.load(second)) == {"n": 8}
+    assert parses["parses"] == 2
+
+def test_a_damaged_cache_file_is_reparsed(parses, tmp_path):
+    filename = write(tmp_path / "double.arrow", source)
+    cache.load(filename)
+
+    path = cache.cache_path(filename)
+    with open(path, "rb") as f:
+        key = f.readline()
+    with open(path, "wb") as f:
+        f.write(key + b"not a pickle")
+
+    assert run(cache.load(filename)) == {"n": 6}
+    assert parses["parses"] == 2
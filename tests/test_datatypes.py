@@ -0,0 +1,172 @@
+import pytest
+
+import datatypes, shared
+
+def check_error(run, source, message):
+    with pytest.raises(shared.ArrowException) as e:
+        run(source)
+    assert e.value.stage is shared.Stages.evaluation
+    assert message in e.value.message
+
+def test_deque(engine, run):
+    source = """
+        main(q := deque[1, 2, 3], x := 0){
+            q.push_left(0)
+            q.push_right(4)
+            q[2] += 10
+            q[0] <=> q[4]
+            x += q.len()
+        }
+    """
+
+    assert run(source) == {"q": [4, 1, 12, 3, 0], "x": 5}
+    assert run(source, "roundtrip") == {"q": [1, 2, 3], "x": 0}
+
+@pytest.mark.parametrize("index", ["3", "-1", "1/2"])
+def test_deque_bad_index(engine, run, index):
+    source = "main(q := deque[1, 2, 3]){ q[%s] += 1 }" % index
+    check_error(run, source, "in a deque of 3")
+
+def test_map(engine, run):
+    source = """
+        main(m := map[1: 10, "a": 20], x := 0){
+            m.insert(2, 30)
+            m[1] += 5
+            m[1] <=> m["a"]
+            x += m[2] + m.len()
+            m.delete(2, 30)
+        }
+    """
+
+    assert run(source) == {"m": {1: 20, "a": 15}, "x": 33}
+    assert run(source, "roundtrip") == {"m": {1: 10, "a": 20}, "x": 0}
+
+@pytest.mark.parametrize("statement, message", [
+    ("m.insert(1, 5)", "already in the map"),
+    ("m.delete(1, 5)", "is supposed to map to 5"),
+    ("m[2] += 1", "isn't in the map"),
+    ])
+def test_map_errors(engine, run, statement, message):
+    source = "main(m := map[1: 10]){ %s }" % statement
+    check_error(run, source, message)
+
+def test_bitset(engine, run):
+    source = """
+        main(b := bitset[1, 0, 0, 1], x := 0){
+            flags := bitset[1; 10]
+            flags.toggle(1, 10, 3)
+            b[1] ^= 1
+            b[0] <=> b[2]
+            x += flags.count() + b.count()
+            flags.toggle(1, 10, 3)
+            flags == bitset[1; 10]
+        }
+    """
+
+    assert run(source) == {"b": [0, 1, 1, 1], "x": 10}
+    assert run(source, "roundtrip") == {"b": [1, 0, 0, 1], "x": 0}
+
+@pytest.mark.parametrize("statement, message", [
+    ("b[0] += 1", "A bit can't be 2"),
+    ("b[4] ^= 1", "There's no bit 4 in a bitset of 4"),
+    ("b.toggle(0, 4, 0)", "Can't toggle every 0th bit"),
+    ("b.toggle(2, 5, 1)", "There's no bit 4 in a bitset of 4"),
+    ])
+def test_bitset_errors(engine, run, statement, message):
+    source = "main(b := bitset[1, 0, 0, 1]){ %s }" % statement
+    check_error(run, source, message)
+
+def test_bitset_toggle_matches_flipping_one_bit_at_a_time():
+    for size in (1, 7, 8, 9, 64, 100, 1000):
+        for step in (1, 2, 3, 7, 8, 9, 17, 129):
+            for start in range(0, min(size, 20)):
+                for stop in (start + 1, size // 2, size - 1, size):
+                    bitset = datatypes.Bitset(
+                        [datatypes.Num(i % 5 % 2) for i in range(size)])
+                    expected = [i % 5 % 2 for i in range(size)]
+
+                    bitset.toggle.python_function({
+                        "start": datatypes.Num(start),
+                        "stop": datatypes.Num(stop),
+                        "step": datatypes.Num(step),
+                        })
+                    for i in range(start, stop, step):
+                        expected[i] ^= 1
+
+                    assert [int(bit.top) for bit in bitset] == expected, \
+                        (size, start, stop, step)
+
+def test_fills_and_ranges(engine, run):
+    source = """
+        main(a := [0; 2], h := [1/2; 3], e := [5:2], x := 0){
+            t := [7; 5]
+            r := [2:6]
+            t[1] += r[3]
+            x += t.sum() + r.sum() + t.len()
+            t[1] -= r[3]
+            t == [7, 7, 7, 7, 7]
+            r == [2, 3, 4, 5]
+            a.push(x)
+            h[0] += 1
+        }
+    """
+
+    assert run(source) == {
+        "a": [0, 0, 59], "h": ["3/2", "1/2", "1/2"], "e": [], "x": 59}
+    assert run(source, "roundtrip") == {
+        "a": [0, 0], "h": ["1/2", "1/2", "1/2"], "e": [], "x": 0}
+
+@pytest.mark.parametrize("init, message", [
+    ("[0; -1]", "Can't fill -1 entries"),
+    ("[0; 1/2]", "Can't fill (1/2) entries"),
+    ("bitset[0; -1]", "Can't fill -1 entries"),
+    ("[1/2:3]", "Can't count from (1/2) to 3"),
+    ])
+def test_fill_errors(engine, run, init, message):
+    check_error(run, "main(x := 0){ t := %s }" % init, message)
+
+def test_string_copies_dont_change_the_original(engine, run):
+    source = """
+        main(data := "ab", out := ""){
+            t := data
+            t += "c"
+            t.left_add("z")
+            out += data
+            out += t
+            t.left_del("z")
+            t -= "c"
+            t == data
+        }
+    """
+
+    assert run(source) == {"data": "ab", "out": "abzabc"}
+    assert run(source, "roundtrip") == {"data": "ab", "out": ""}
+
+def test_string_const_args_dont_change_with_ref_args(engine, run):
+    # (Not reversible: uncalled, s would be x's new value.)
+    source = """
+        twice(ref out, const s){
+            out += s
+            out += s
+        }
+
+        main(x := "ab"){
+            twice(&x, x)
+        }
+    """
+
+    assert run(source) == {"x": "ababab"}
+
+def test_string_copy_on_write():
+    original = datatypes.String("abc")
+    copy = original.copy()
+    assert copy.chars is original.chars
+
+    copy += datatypes.String("d")
+    assert (original.str, copy.str) == ("abc", "abcd")
+    assert copy.chars is not original.chars
+
+    # The original was shared too, so changing it copies its chars out
+    # rather than changing the copy's.
+    original -= datatypes.String("c")
+    assert (original.str, copy.str) == ("ab", "abcd")
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import shared
+from conftest import SAMPLES
+
+def sample(name):
+    with open(os.path.join(SAMPLES, name)) as f:
+        return f.read()
+
+def test_exit_inside_from_loop(engine, run):
+    source = sample("count_until.arrow")
+
+    assert run(source) == {"n": 4, "total": 10}
+    assert run(source, "roundtrip") == {"n": 0, "total": 0}
+
+def test_exit_inside_if_and_do_undo(engine, run):
+    source = """
+        step(ref n, ref log, const stop){
+            if stop > 0 {
+                n += 1
+                exit if n == stop
+            } <=>
+            do/undo {
+                log += 1
+            } yielding {
+                n += 10
+                exit if n > 20
+            }
+        }
+
+        main(
+        n := 2,
+        log := 0
+        ){
+            step(&n, &log, 3)
+            step(&n, &log, 0)
+            step(&n, &log, 0)
+        }
+    """
+
+    assert run(source) == {"n": 23, "log": 1}
+    assert run(source, "roundtrip") == {"n": 2, "log": 0}
+
+@pytest.mark.parametrize("statement", ["exit if i == 2", "enter if i == 2"])
+def test_entry_points_inside_for_loops_are_rejected(run, statement):
+    source = """
+        f(ref n){
+            for i := 0, i += 1 {
+                n += i
+                %s
+            } until (i == 3)
+        }
+
+        main(n := 0){
+            f(&n)
+        }
+    """ % statement
+
+    with pytest.raises(shared.ArrowException) as e:
+        run(source)
+    assert e.value.stage is shared.Stages.resolution
+    assert "inside a for loop" in e.value.message
+
+def test_prime_factors_doesnt_round_trip(engine, run):
+    # Every level of the recursion ends with n == 1, so uncalling the outer
+    # call resumes at its enter (the inverse of 'exit if n <= 1') too, and
+    # only its own factor is undone. (Running main backwards from n == 200
+    # uncalls without ever entering, and never stops.)
+    source = sample("prime_factors.arrow")
+
+    assert run(source) == {"n": 1, "results": [2, 2, 2, 5, 5]}
+    assert run(source, "roundtrip") == {"n": 5, "results": [2, 2, 2, 5]}
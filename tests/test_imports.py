@@ -0,0 +1,49 @@
+import glob, os, subprocess, sys
+
+import pytest
+
+from conftest import SAMPLES
+
+ROOT = os.path.dirname(SAMPLES)
+
+# Every module of the interpreter, each of which has to work when it's the
+# first one imported, whatever import cycles it's part of.
+modules = sorted(
+    os.path.basename(filename)[:-3]
+    for filename in glob.glob(os.path.join(ROOT, "*.py")))
+
+# Uses the datatypes whose names the parser looks up while datatypes may
+# still be loading.
+source = """
+    main(
+    q := deque[1, 2],
+    m := map[1: 2],
+    flags := bitset[1; 3],
+    a := [0; 4],
+    b := [0:3]
+    ){
+        q.push_right(3)
+    }
+"""
+
+def run_first(module, code=""):
+    return subprocess.run(
+        [sys.executable, "-c", "import {}\n{}".format(module, code)],
+        cwd=ROOT, capture_output=True, text=True)
+
+@pytest.mark.parametrize("module", modules)
+def test_module_imports_first(module):
+    result = run_first(module)
+    assert result.returncode == 0, result.stderr
+
+@pytest.mark.parametrize("module", modules)
+def test_programs_run_whatever_was_imported_first(module):
+    code = "\n".join([
+        "import cache, evaluator, shared",
+        "for engine in ['tree', 'closure', 'vm']:",
+        "    shared.engine = engine",
+        "    evaluator.program_eval(cache.parse({!r}))".format(source),
+        ])
+
+    result = run_first(module, code)
+    assert result.returncode == 0, result.stderr
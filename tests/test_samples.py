@@ -0,0 +1,49 @@
+import glob, os
+
+import pytest
+
+import cache, shared
+from conftest import SAMPLES, main_vars
+
+samples = sorted(glob.glob(os.path.join(SAMPLES, "*.arrow")))
+
+# Uncalling prime_factors undoes only one factor (see test_entry_points).
+round_trips = [
+    sample for sample in samples
+    if os.path.basename(sample) != "prime_factors.arrow"
+    ]
+
+# The samples whose main can also be run backwards from its initial values.
+# (The rest fail assertions or never stop.)
+backwards = [
+    sample for sample in samples if os.path.basename(sample) in (
+        "cyclic.arrow", "fibonacci_rec.arrow", "interest.arrow",
+        "permute.arrow", "primes.arrow", "sort.arrow", "sort_traceless.arrow")
+    ]
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+def on_tree(run, source, mode):
+    old_engine = shared.engine
+    shared.engine = "tree"
+    try:
+        return run(source, mode)
+    finally:
+        shared.engine = old_engine
+
+@pytest.mark.parametrize("sample", samples, ids=os.path.basename)
+def test_forward_matches_tree(engine, run, sample):
+    source = read(sample)
+    assert run(source) == on_tree(run, source, "forward")
+
+@pytest.mark.parametrize("sample", backwards, ids=os.path.basename)
+def test_backward_matches_tree(engine, run, sample):
+    source = read(sample)
+    assert run(source, "backward") == on_tree(run, source, "backward")
+
+@pytest.mark.parametrize("sample", round_trips, ids=os.path.basename)
+def test_round_trip_restores_main_vars(engine, run, sample):
+    source = read(sample)
+    assert run(source, "roundtrip") == main_vars(cache.parse(source))
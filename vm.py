@@ -0,0 +1,224 @@
+import bytecode, datatypes, evaluator, shared
+
+# The operator functions, in the order BIN_OP's argument refers to them,
+# and the ones the MOD_ instructions use (see evaluator.mod_ops). (Filled
+# in on first use, since evaluator may still be loading when vm is.)
+bin_ops = []
+mod_ops = []
+
+def run(code, table):
+    """
+    Runs a Code object against a memory table, modifying it in place.
+
+    Arrow functions called along the way run in this same loop: a call
+    saves the caller's state on a stack of frames (a Python list, so only
+    memory limits how deep Arrow code can recurse) and switches to the
+    callee's code, and returning switches back.
+    """
+
+    # The opcodes are imported here, rather than with the module, since
+    # bytecode may still be loading when vm is. (As locals, they're also
+    # quicker to compare against.)
+    from bytecode import (
+        LOAD_CONST, LOAD_VAR, STORE_VAR, LOAD_INDEX, STORE_INDEX, BIN_OP,
+        NEGATE, BUILD_LIST, MOD_VAR, MOD_INDEX, SWAP_INDEX, ROT_TWO, DUP_TWO,
+        POP_TOP, CALL, DEALLOC, JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, RETURN,
+        LOAD_STRING, BUILD_TYPED, BUILD_FILL, BUILD_RANGE, DECLARE_VAR)
+
+    if not bin_ops:
+        bin_ops.extend(evaluator.bin_ops[name] for name in bytecode.bin_op_names)
+        mod_ops.extend(evaluator.mod_ops.get(name) for name in bytecode.bin_op_names)
+
+    ops, consts, calls = code.ops, code.consts, code.calls
+    values = table.values
+    stack = []
+    push, pop = stack.append, stack.pop
+
+    # Each frame is a tuple of
+    #   (the caller's code, pc and values, the function called, its memory
+    #    table, the slots of the caller's ref args, and the memo key).
+    frames = []
+
+    pc = 0
+
+    # The most common instructions are checked first.
+    while True:
+        op, arg = ops[pc], ops[pc + 1]
+        pc += 2
+
+        if op == LOAD_VAR:
+            push(values[arg])
+
+        elif op == LOAD_CONST:
+            push(consts[arg])
+
+        elif op == BIN_OP:
+            right = pop()
+            push(bin_ops[arg](pop(), right))
+
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = arg
+
+        elif op == STORE_VAR:
+            values[arg] = pop()
+
+        elif op == DECLARE_VAR:
+            value = pop()
+            values[arg] = (
+                value.copy() if type(value) is datatypes.String else value)
+
+        elif op == LOAD_INDEX:
+            index = pop()
+            push(pop()[index])
+
+        elif op == MOD_VAR:
+            slot, bin_op = divmod(arg, 16)
+            values[slot] = mod_ops[bin_op](values[slot], pop())
+
+        elif op == MOD_INDEX:
+            index, array = pop(), pop()
+            array[index] = mod_ops[arg](array[index], pop())
+
+        elif op == JUMP:
+            pc = arg
+
+        elif op == CALL:
+            name, attrs, slot, backwards, ref_slots, n_consts = calls[arg]
+
+            # Only the const args were pushed; the refs are read straight
+            # out of (and written straight back into) their slots.
+            split = len(stack) - n_consts
+            const_args = stack[split:]
+            del stack[split:]
+
+            if attrs:
+                function = values[slot]
+                for attr in attrs:
+                    function = getattr(function, attr)
+            else:
+                function = shared.program.functions[name]
+
+            # Builtins are plain Python, and don't call back into Arrow.
+            if type(function) is not datatypes.Function:
+                push(function.call(backwards, values, ref_slots, const_args))
+                continue
+
+            key = None
+            memo = function.memo
+            if memo is not None:
+                key = memo.key(backwards, const_args)
+                if key is not None:
+                    found, result = memo.get(key)
+                    if found:
+                        push(result)
+                        continue
+
+            frame = function.bind(values, ref_slots, const_args)
+            frames.append((code, pc, values, function, frame, ref_slots, key))
+
+            code = bytecode.compile_function(function)[backwards]
+            ops, consts, calls = code.ops, code.consts, code.calls
+            values = frame.values
+            pc = 0
+
+        elif op == RETURN:
+            if not frames:
+                break
+
+            # Hand back the result, and clear it out of the table.
+            result, values[0] = values[0], None
+
+            caller, pc, values, function, frame, ref_slots, key = frames.pop()
+            function.unbind(frame, values, ref_slots)
+            if key is not None:
+                function.memo.put(key, result)
+
+            code = caller
+            ops, consts, calls = code.ops, code.consts, code.calls
+            push(result)
+
+        elif op == POP_TOP:
+            pop()
+
+        elif op == JUMP_IF_TRUE:
+            if pop():
+                pc = arg
+
+        elif op == STORE_INDEX:
+            value, index = pop(), pop()
+            pop()[index] = value
+
+        elif op == NEGATE:
+            push(- pop())
+
+        elif op == DUP_TWO:
+            stack.extend(stack[-2:])
+
+        elif op == ROT_TWO:
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+
+        elif op == SWAP_INDEX:
+            j, R, i, L = pop(), pop(), pop(), pop()
+            L[i], R[j] = R[j], L[i]
+
+        elif op == DEALLOC:
+            # Mirrors evaluator.var_condition_eval.
+            value = pop()
+            if values[arg] == value:
+                values[arg] = None
+            else:
+                print(
+                    code.scope.names[arg], "is supposed to be", value,
+                    "but it's actually", values[arg]
+                    )
+
+        elif op == BUILD_LIST:
+            entries = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push(datatypes.List(entries))
+
+        elif op == LOAD_STRING:
+            push(consts[arg].copy())
+
+        elif op == BUILD_TYPED:
+            entries = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push(pop()(entries))
+
+        elif op == BUILD_FILL:
+            count, value = pop(), pop()
+            push(pop()(value, count))
+
+        elif op == BUILD_RANGE:
+            stop = pop()
+            push(datatypes.range_list(pop(), stop))
+
+    return table
+
+def execute(function, backwards, table):
+    """
+    Runs an Arrow function's forward or inverse code.
+    Returns the function's result (see Function.execute).
+    """
+
+    run(bytecode.compile_function(function)[backwards], table)
+
+    # Hand back the result, and clear it out of the table.
+    values = table.values
+    result, values[0] = values[0], None
+    return result
+
+def program_eval(node):
+    """
+    Compiles every function in both directions, then runs main.
+    Returns a memory table of the main variables.
+    """
+
+    for function in node.functions.values():
+        if function is not node.main:
+            bytecode.compile_function(function)
+
+    table = evaluator.main_memory(node)
+    return run(
+        bytecode.compile_block(node.main.block, node.main.scope, "main"), table)